@@ -0,0 +1,57 @@
+"""
+Compare venv creation and dependency install across installer backends
+
+Usage:
+    uv run python benchmarks/bench_install.py [--rounds N]
+"""
+
+import argparse
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from stores.constants import VENV_NAME
+from stores.indexes.venv_utils import (
+    SUPPORTED_INSTALLERS,
+    init_venv,
+    install_venv_deps,
+)
+
+INDEX_FOLDER = Path(__file__).parent.parent / "tests" / "mock_index_w_deps"
+
+
+def install_once(installer: str) -> tuple[float, float]:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        index_folder = Path(tmpdir) / "index"
+        shutil.copytree(INDEX_FOLDER, index_folder)
+        start = time.perf_counter()
+        init_venv(index_folder / VENV_NAME, installer=installer)
+        created = time.perf_counter()
+        install_venv_deps(index_folder, installer=installer)
+        installed = time.perf_counter()
+    return created - start, installed - created
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=3)
+    options = parser.parse_args()
+
+    print(f"Cold install of {INDEX_FOLDER.name}, {options.rounds} rounds")
+    for installer in SUPPORTED_INSTALLERS:
+        if installer == "uv" and not shutil.which("uv"):
+            print(f"{installer:<8} skipped, not on PATH")
+            continue
+        timings = [install_once(installer) for _ in range(options.rounds)]
+        create_times, install_times = zip(*timings, strict=True)
+        print(
+            f"{installer:<8} venv {statistics.median(create_times):7.2f} s"
+            f"   install {statistics.median(install_times):7.2f} s"
+            f"   total {statistics.median(map(sum, timings)):7.2f} s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Compare the per-call latency of tool execution across transports
+
+Usage:
+    uv run python benchmarks/bench_transport.py [--calls N] [--cold-calls N]
+"""
+
+import argparse
+import functools
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+import venv
+from pathlib import Path
+
+from stores.indexes.transport import SUPPORTED_TRANSPORTS, Transport
+from stores.indexes.venv_utils import run_remote_tool
+from stores.indexes.worker_pool import VenvWorker
+from stores.indexes.worker_runtime import connect
+
+INDEX_FOLDER = Path(__file__).parent.parent / "tests" / "mock_index"
+
+
+def measure(fn, n: int) -> list[float]:
+    timings = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(label: str, timings: list[float]):
+    print(
+        f"{label:<32} median {statistics.median(timings):8.3f} ms"
+        f"   p90 {statistics.quantiles(timings, n=10)[-1]:8.3f} ms"
+    )
+
+
+def connect_once(transport: str):
+    channel = Transport(transport)
+    if transport == "socketpair":
+        # Stand-in for the copy of the socket inherited by a child
+        child = socket.socket(fileno=os.dup(channel.pass_fds[0]))
+    else:
+        child = connect(channel.address)
+    sock = channel.accept()
+    child.close()
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--cold-calls", type=int, default=20)
+    options = parser.parse_args()
+
+    transports = [
+        t
+        for t in SUPPORTED_TRANSPORTS
+        if os.name != "nt" or t not in ["socketpair", "unix"]
+    ]
+
+    print(f"Connection setup, {options.calls} connections")
+    for transport in transports:
+        report(
+            transport,
+            measure(functools.partial(connect_once, transport), options.calls),
+        )
+
+    print(f"\nWarm worker, {options.calls} calls")
+    for transport in transports:
+        worker = VenvWorker(sys.executable, INDEX_FOLDER, transport=transport)
+        try:
+            worker.call("tools.foo", ["warmup"])
+            timings = measure(
+                functools.partial(worker.call, "tools.foo", ["hello"]), options.calls
+            )
+        finally:
+            worker.close()
+        report(transport, timings)
+
+    print(f"\nFresh interpreter per call, {options.cold_calls} calls")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        venv_folder = Path(tmpdir) / "venv"
+        venv.create(venv_folder, symlinks=True, with_pip=False)
+        for transport in transports:
+            timings = measure(
+                functools.partial(
+                    run_remote_tool,
+                    "tools.foo",
+                    INDEX_FOLDER,
+                    args=["hello"],
+                    venv=str(venv_folder),
+                    executor="subprocess",
+                    transport=transport,
+                ),
+                options.cold_calls,
+            )
+            report(transport, timings)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3 @@
+from stores.cli import main
+
+main()
@@ -0,0 +1,89 @@
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+from stores.constants import VENV_NAME
+from stores.indexes.venv_utils import (
+    SUPPORTED_INSTALLERS,
+    fill_wheelhouse,
+    init_venv,
+    install_venv_deps,
+    publish_signatures,
+)
+
+logging.basicConfig()
+logger = logging.getLogger("stores.cli")
+logger.setLevel(logging.INFO)
+
+
+def init_index_venv(args: argparse.Namespace) -> Path:
+    index_folder = Path(args.index_folder)
+    venv_path = index_folder / VENV_NAME
+    if not venv_path.exists():
+        init_venv(
+            venv_path, sys_executable=args.sys_executable, installer=args.installer
+        )
+    return index_folder
+
+
+def signatures(args: argparse.Namespace):
+    """
+    Generate the signature file shipped alongside tools.toml
+    """
+    index_folder = init_index_venv(args)
+    install_venv_deps(index_folder, installer=args.installer)
+    signatures_path = publish_signatures(index_folder)
+    logger.info(f"Wrote signatures to {signatures_path}")
+
+
+def wheelhouse(args: argparse.Namespace):
+    """
+    Save wheels for the dependencies of an index and lock their versions
+    """
+    index_folder = init_index_venv(args)
+    lock_path = fill_wheelhouse(index_folder, args.wheelhouse)
+    logger.info(f"Saved wheels to {args.wheelhouse} and locked them in {lock_path}")
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="stores")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    venv_parser = argparse.ArgumentParser(add_help=False)
+    venv_parser.add_argument("index_folder", nargs="?", default=".")
+    venv_parser.add_argument(
+        "--sys-executable",
+        help="Python interpreter used to create the index venv",
+    )
+    venv_parser.add_argument(
+        "--installer",
+        choices=SUPPORTED_INSTALLERS,
+        help="Installer used for the index venv, by default uv if available",
+    )
+
+    signatures_parser = subparsers.add_parser(
+        "signatures",
+        parents=[venv_parser],
+        help="Generate tool signatures to publish with an index",
+    )
+    signatures_parser.set_defaults(func=signatures)
+
+    wheelhouse_parser = subparsers.add_parser(
+        "wheelhouse",
+        parents=[venv_parser],
+        help="Fill a wheelhouse and lockfile to install an index offline",
+    )
+    wheelhouse_parser.add_argument(
+        "--wheelhouse",
+        required=True,
+        help="Folder to save wheels to",
+    )
+    wheelhouse_parser.set_defaults(func=wheelhouse)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,2 +1,4 @@
 VENV_NAME = ".venv"
 TOOLS_CONFIG_FILENAME = "tools.toml"
+SIGNATURES_FILENAME = "tools.signatures.json"
+LOCK_FILENAME = "tools.lock"
@@ -2,6 +2,8 @@ import asyncio
 import inspect
 import logging
 import re
+from contextlib import contextmanager
+from contextvars import ContextVar
 from inspect import Parameter
 from types import NoneType, UnionType
 from typing import (
@@ -26,6 +28,19 @@ logging.basicConfig()
 logger = logging.getLogger("stores.indexes.base_index")
 logger.setLevel(logging.INFO)
 
+# Timeout of the tool call being executed, which tools running in an index
+# venv apply on top of their own timeout
+CALL_TIMEOUT: ContextVar[float | None] = ContextVar("call_timeout", default=None)
+
+
+@contextmanager
+def call_timeout(timeout: float | None):
+    token = CALL_TIMEOUT.set(timeout)
+    try:
+        yield
+    finally:
+        CALL_TIMEOUT.reset(token)
+
 
 def _cast_arg(value: Any, typ: type | tuple[type]):
     try:
@@ -284,75 +299,91 @@ class BaseIndex:
 
         return self.tools_dict[toolname]
 
-    def execute(self, toolname: str, kwargs: dict | None = None, collect_results=False):
+    def execute(
+        self,
+        toolname: str,
+        kwargs: dict | None = None,
+        collect_results=False,
+        timeout: float | None = None,
+    ):
         tool_fn = self._get_tool(toolname)
         kwargs = kwargs or {}
-        if inspect.isasyncgenfunction(tool_fn):
-            # Handle async generator
-
-            async def collect():
+        with call_timeout(timeout):
+            if inspect.isasyncgenfunction(tool_fn):
+                # Handle async generator
+
+                async def collect():
+                    results = []
+                    async for value in tool_fn(**kwargs):
+                        results.append(value)
+                    if collect_results:
+                        return results
+                    else:
+                        return results[-1]
+
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+                return loop.run_until_complete(collect())
+            elif inspect.isgeneratorfunction(tool_fn):
+                # Handle sync generator
                 results = []
-                async for value in tool_fn(**kwargs):
+                for value in tool_fn(**kwargs):
                     results.append(value)
                 if collect_results:
                     return results
                 else:
                     return results[-1]
-
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            return loop.run_until_complete(collect())
-        elif inspect.isgeneratorfunction(tool_fn):
-            # Handle sync generator
-            results = []
-            for value in tool_fn(**kwargs):
-                results.append(value)
-            if collect_results:
-                return results
+            elif inspect.iscoroutinefunction(tool_fn):
+                # Handle async
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+                return loop.run_until_complete(tool_fn(**kwargs))
             else:
-                return results[-1]
-        elif inspect.iscoroutinefunction(tool_fn):
-            # Handle async
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            return loop.run_until_complete(tool_fn(**kwargs))
-        else:
-            # Handle sync
-            return tool_fn(**kwargs)
+                # Handle sync
+                return tool_fn(**kwargs)
 
     async def aexecute(
-        self, toolname: str, kwargs: dict | None = None, collect_results=False
+        self,
+        toolname: str,
+        kwargs: dict | None = None,
+        collect_results=False,
+        timeout: float | None = None,
     ):
         tool_fn = self._get_tool(toolname)
         kwargs = kwargs or {}
-        if inspect.isasyncgenfunction(tool_fn):
-            # Handle async generator
-            results = []
-            async for value in tool_fn(**kwargs):
-                results.append(value)
-            if collect_results:
-                return results
-            else:
-                return results[-1]
-        elif inspect.isgeneratorfunction(tool_fn):
-            # Handle sync generator
-            results = []
-            for value in tool_fn(**kwargs):
-                results.append(value)
-            if collect_results:
-                return results
+        with call_timeout(timeout):
+            if inspect.isasyncgenfunction(tool_fn):
+                # Handle async generator
+                results = []
+                async for value in tool_fn(**kwargs):
+                    results.append(value)
+                if collect_results:
+                    return results
+                else:
+                    return results[-1]
+            elif inspect.isgeneratorfunction(tool_fn):
+                # Handle sync generator
+                results = []
+                for value in tool_fn(**kwargs):
+                    results.append(value)
+                if collect_results:
+                    return results
+                else:
+                    return results[-1]
+            elif inspect.iscoroutinefunction(tool_fn):
+                # Handle async
+                return await tool_fn(**kwargs)
             else:
-                return results[-1]
-        elif inspect.iscoroutinefunction(tool_fn):
-            # Handle async
-            return await tool_fn(**kwargs)
-        else:
-            # Handle sync
-            return tool_fn(**kwargs)
+                # Handle sync
+                return tool_fn(**kwargs)
 
-    def stream_execute(self, toolname: str, kwargs: dict | None = None):
+    def stream_execute(
+        self, toolname: str, kwargs: dict | None = None, timeout: float | None = None
+    ):
         tool_fn = self._get_tool(toolname)
         kwargs = kwargs or {}
+        # The caller runs between values, so the timeout is only set while
+        # the tool produces the next one
         if inspect.isasyncgenfunction(tool_fn):
             # Handle async generator
 
@@ -365,64 +396,112 @@ class BaseIndex:
             agen = collect()
             try:
                 while True:
-                    yield loop.run_until_complete(agen.__anext__())
+                    with call_timeout(timeout):
+                        value = loop.run_until_complete(agen.__anext__())
+                    yield value
             except StopAsyncIteration:
                 pass
             finally:
                 loop.close()
         elif inspect.isgeneratorfunction(tool_fn):
             # Handle sync generator
-            for value in tool_fn(**kwargs):
+            generator = tool_fn(**kwargs)
+            while True:
+                with call_timeout(timeout):
+                    try:
+                        value = next(generator)
+                    except StopIteration:
+                        break
                 yield value
         elif inspect.iscoroutinefunction(tool_fn):
             # Handle async
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
-            yield loop.run_until_complete(tool_fn(**kwargs))
+            with call_timeout(timeout):
+                value = loop.run_until_complete(tool_fn(**kwargs))
+            yield value
         else:
             # Handle sync
-            yield tool_fn(**kwargs)
+            with call_timeout(timeout):
+                value = tool_fn(**kwargs)
+            yield value
 
-    async def astream_execute(self, toolname: str, kwargs: dict | None = None):
+    async def astream_execute(
+        self, toolname: str, kwargs: dict | None = None, timeout: float | None = None
+    ):
         tool_fn = self._get_tool(toolname)
         kwargs = kwargs or {}
         if inspect.isasyncgenfunction(tool_fn):
             # Handle async generator
-            async for value in tool_fn(**kwargs):
+            agen = tool_fn(**kwargs)
+            while True:
+                with call_timeout(timeout):
+                    try:
+                        value = await agen.__anext__()
+                    except StopAsyncIteration:
+                        break
                 yield value
         elif inspect.isgeneratorfunction(tool_fn):
             # Handle sync generator
-            for value in tool_fn(**kwargs):
+            generator = tool_fn(**kwargs)
+            while True:
+                with call_timeout(timeout):
+                    try:
+                        value = next(generator)
+                    except StopIteration:
+                        break
                 yield value
         elif inspect.iscoroutinefunction(tool_fn):
             # Handle async
-            yield await tool_fn(**kwargs)
+            with call_timeout(timeout):
+                value = await tool_fn(**kwargs)
+            yield value
         else:
             # Handle sync
-            yield tool_fn(**kwargs)
+            with call_timeout(timeout):
+                value = tool_fn(**kwargs)
+            yield value
 
-    def parse_and_execute(self, msg: str, collect_results=False):
+    def parse_and_execute(
+        self, msg: str, collect_results=False, timeout: float | None = None
+    ):
         toolcall = llm_parse_json(msg, keys=["toolname", "kwargs"])
         return self.execute(
-            toolcall.get("toolname"), toolcall.get("kwargs"), collect_results
+            toolcall.get("toolname"), toolcall.get("kwargs"), collect_results, timeout
         )
 
-    async def aparse_and_execute(self, msg: str, collect_results=False):
+    async def aparse_and_execute(
+        self, msg: str, collect_results=False, timeout: float | None = None
+    ):
         toolcall = llm_parse_json(msg, keys=["toolname", "kwargs"])
         return await self.aexecute(
-            toolcall.get("toolname"), toolcall.get("kwargs"), collect_results
+            toolcall.get("toolname"), toolcall.get("kwargs"), collect_results, timeout
         )
 
-    def stream_parse_and_execute(self, msg: str):
+    def stream_parse_and_execute(self, msg: str, timeout: float | None = None):
         toolcall = llm_parse_json(msg, keys=["toolname", "kwargs"])
-        return self.stream_execute(toolcall.get("toolname"), toolcall.get("kwargs"))
+        return self.stream_execute(
+            toolcall.get("toolname"), toolcall.get("kwargs"), timeout
+        )
 
-    async def astream_parse_and_execute(self, msg: str):
+    async def astream_parse_and_execute(self, msg: str, timeout: float | None = None):
         toolcall = llm_parse_json(msg, keys=["toolname", "kwargs"])
         async for value in self.astream_execute(
-            toolcall.get("toolname"), toolcall.get("kwargs")
+            toolcall.get("toolname"), toolcall.get("kwargs"), timeout
         ):
             yield value
 
     def format_tools(self, provider: ProviderFormat):
         return format_tools(self.tools, provider)
+
+    def close(self):
+        """
+        Release resources held by the index, such as tool worker processes
+        """
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
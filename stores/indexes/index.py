@@ -5,7 +5,13 @@ from typing import Callable, Optional
 
 from stores.indexes.base_index import BaseIndex
 from stores.indexes.local_index import LocalIndex
-from stores.indexes.remote_index import RemoteIndex
+from stores.indexes.remote_index import (
+    CACHE_DIR,
+    RemoteIndex,
+    lookup_indexes,
+    split_index_id,
+)
+from stores.indexes.venv_utils import DEFAULT_EXECUTOR
 
 logging.basicConfig()
 logger = logging.getLogger("stores.index")
@@ -22,12 +28,39 @@ class Index(BaseIndex):
         cache_dir: Optional[os.PathLike] = None,
         reset_cache=False,
         sys_executable: str | None = None,
+        executor: str = DEFAULT_EXECUTOR,
+        timeout: float | None = None,
+        static_signatures: bool = False,
+        installer: str | None = None,
+        package_store: bool = False,
+        base_layer: list[str] | None = None,
+        wheelhouse: os.PathLike | None = None,
+        precompile: bool = True,
+        pycache_prefix: os.PathLike | None = None,
+        fetch: str = "git",
+        allow_pickle: bool = False,
     ):
         self.env_var = env_var or {}
+        self.indexes = []
         include = include or {}
         exclude = exclude or {}
         tools = tools or []
 
+        # Look up all indexes that need installing in one registry request
+        try:
+            remote_indexes = [
+                split_index_id(tool)
+                for tool in tools
+                if isinstance(tool, str)
+                and not Path(tool).exists()
+                and (reset_cache or not Path(cache_dir or CACHE_DIR, tool).exists())
+            ]
+            if len(remote_indexes) > 1:
+                lookup_indexes(remote_indexes)
+        except Exception:
+            # Indexes are looked up again one by one as they are loaded
+            logger.warning("Unable to look up indexes in stores", exc_info=True)
+
         _tools = []
         for tool in tools:
             if isinstance(tool, (str, Path)):
@@ -56,6 +89,17 @@ class Index(BaseIndex):
                             cache_dir=cache_dir,
                             reset_cache=reset_cache,
                             sys_executable=sys_executable,
+                            executor=executor,
+                            timeout=timeout,
+                            static_signatures=static_signatures,
+                            installer=installer,
+                            package_store=package_store,
+                            base_layer=base_layer,
+                            wheelhouse=wheelhouse,
+                            precompile=precompile,
+                            pycache_prefix=pycache_prefix,
+                            fetch=fetch,
+                            allow_pickle=allow_pickle,
                         )
                     except Exception:
                         logger.warning(
@@ -66,8 +110,13 @@ class Index(BaseIndex):
                     raise ValueError(
                         f'Unable to load index "{index_name}"\nIf this is a local index, make sure it can be found as a directory and contains a tools.toml file.'
                     )
+                self.indexes.append(loaded_index)
                 _tools += loaded_index.tools
             elif isinstance(tool, Callable):
                 _tools.append(tool)
 
         super().__init__(_tools)
+
+    def close(self):
+        for index in self.indexes:
+            index.close()
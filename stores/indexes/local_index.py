@@ -1,14 +1,18 @@
 import importlib
 import logging
 import os
-import subprocess
 import sys
-import venv
 from pathlib import Path
 
 from stores.constants import TOOLS_CONFIG_FILENAME, VENV_NAME
 from stores.indexes.base_index import BaseIndex
-from stores.indexes.venv_utils import init_venv_tools, install_venv_deps
+from stores.indexes.venv_utils import (
+    DEFAULT_EXECUTOR,
+    init_venv,
+    init_venv_tools,
+    install_venv_deps,
+)
+from stores.indexes.worker_pool import acquire_workers, release_workers
 
 if sys.version_info >= (3, 11):
     import tomllib
@@ -29,8 +33,19 @@ class LocalIndex(BaseIndex):
         include: list[str] | None = None,
         exclude: list[str] | None = None,
         sys_executable: str | None = None,
+        executor: str = DEFAULT_EXECUTOR,
+        timeout: float | None = None,
+        static_signatures: bool = False,
+        installer: str | None = None,
+        package_store: bool = False,
+        base_layer: list[str] | None = None,
+        wheelhouse: os.PathLike | None = None,
+        precompile: bool = True,
+        pycache_prefix: os.PathLike | None = None,
     ):
         self.index_folder = Path(index_folder)
+        self.create_venv = create_venv
+        self.closed = False
         self.env_var = env_var or {}
         include = include or []
         exclude = exclude or []
@@ -44,21 +59,25 @@ class LocalIndex(BaseIndex):
             # Create venv and install deps
             self.venv = self.index_folder / VENV_NAME
             if not self.venv.exists():
-                if sys_executable:
-                    subprocess.run(
-                        [sys_executable, "-m", "venv", str(self.venv)], check=True
-                    )
-                else:
-                    venv.create(
-                        self.venv, symlinks=True, with_pip=True, upgrade_deps=True
-                    )
-            install_venv_deps(self.index_folder)
+                init_venv(self.venv, sys_executable=sys_executable, installer=installer)
+            install_venv_deps(
+                self.index_folder,
+                installer=installer,
+                package_store=package_store,
+                base_layer=base_layer,
+                wheelhouse=wheelhouse,
+                precompile=precompile,
+                pycache_prefix=pycache_prefix,
+            )
             # Initialize tools
             tools = init_venv_tools(
                 self.index_folder,
                 env_var=self.env_var,
                 include=include,
                 exclude=exclude,
+                executor=executor,
+                timeout=timeout,
+                static_signatures=static_signatures,
             )
         else:
             if self.env_var:
@@ -67,6 +86,14 @@ class LocalIndex(BaseIndex):
                 )
             tools = self._init_tools(include=include, exclude=exclude)
         super().__init__(tools)
+        if create_venv:
+            acquire_workers(self.index_folder)
+
+    def close(self):
+        if self.create_venv and not self.closed:
+            # Other indexes on the same folder may still use its workers
+            release_workers(self.index_folder)
+        self.closed = True
 
     def _init_tools(
         self, include: list[str] | None = None, exclude: list[str] | None = None
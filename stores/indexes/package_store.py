@@ -0,0 +1,83 @@
+import hashlib
+import logging
+import os
+import stat
+from pathlib import Path
+
+logging.basicConfig()
+logger = logging.getLogger("stores.indexes.package_store")
+logger.setLevel(logging.INFO)
+
+# Shared by every index venv on the host
+PACKAGE_STORE_DIR = Path.home() / ".cache" / "stores" / "packages"
+
+
+def get_site_packages(venv_path: os.PathLike) -> list[Path]:
+    venv_path = Path(venv_path)
+    if os.name == "nt":
+        return [venv_path / "Lib" / "site-packages"]
+    else:
+        return sorted(venv_path.glob("lib/python*/site-packages"))
+
+
+def get_object_name(path: os.PathLike) -> str:
+    """
+    Address a file by its content, keeping executable files apart since
+    hardlinks share their mode
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    executable = os.stat(path).st_mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return digest.hexdigest() + ("x" if executable else "")
+
+
+def link_file(path: Path, object_path: Path) -> bool:
+    """
+    Replace path with a hardlink to object_path, or add path to the store if
+    object_path does not exist yet
+
+    Returns whether path was deduplicated.
+    """
+    if object_path.exists():
+        if os.path.samefile(path, object_path):
+            return False
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}")
+        os.link(object_path, tmp_path)
+        os.replace(tmp_path, path)
+        return True
+    object_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = object_path.with_name(f"{object_path.name}.{os.getpid()}")
+    os.link(path, tmp_path)
+    # Objects never appear partially written to concurrent installs
+    os.replace(tmp_path, object_path)
+    return False
+
+
+def link_venv(venv_path: os.PathLike, store_dir: os.PathLike = PACKAGE_STORE_DIR):
+    """
+    Hardlink files installed in a venv to identical files in the store, so
+    that each distinct file is stored once per host
+
+    Returns the number of bytes deduplicated.
+    """
+    store_dir = Path(store_dir)
+    saved = 0
+    for site_packages in get_site_packages(venv_path):
+        for path in site_packages.rglob("*"):
+            # Bytecode embeds the mtime of its source and is rarely identical
+            if path.is_symlink() or not path.is_file() or path.suffix == ".pyc":
+                continue
+            object_name = get_object_name(path)
+            try:
+                if link_file(path, store_dir / object_name[:2] / object_name[2:]):
+                    saved += path.stat().st_size
+            except OSError:
+                # Hardlinks cannot cross filesystems
+                logger.warning(
+                    f"Unable to link {venv_path} to package store {store_dir}",
+                    exc_info=True,
+                )
+                return saved
+    return saved
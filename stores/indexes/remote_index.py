@@ -1,8 +1,11 @@
 import json
 import logging
+import os
+import re
 import shutil
-import subprocess
-import venv
+import tarfile
+import tempfile
+import time
 from os import PathLike
 from pathlib import Path
 from typing import Optional
@@ -10,9 +13,14 @@ from typing import Optional
 import requests
 from git import GitCommandError, Repo
 
-from stores.constants import VENV_NAME
 from stores.indexes.base_index import BaseIndex
-from stores.indexes.venv_utils import init_venv_tools, install_venv_deps
+from stores.indexes.venv_utils import (
+    DEFAULT_EXECUTOR,
+    init_shared_venv,
+    init_venv_tools,
+    install_venv_deps,
+)
+from stores.indexes.worker_pool import acquire_workers, release_workers
 
 logging.basicConfig()
 logger = logging.getLogger("stores.indexes.remote_index")
@@ -20,17 +28,111 @@ logger.setLevel(logging.INFO)
 
 # TODO: CACHE_DIR might resolve differently
 CACHE_DIR = Path(".tools")
+VENVS_DIR = ".venvs"
+MIRRORS_DIR = ".mirrors"
 INDEX_LOOKUP_URL = (
     "https://mnryl5tkkol3yitc3w2rupqbae0ovnej.lambda-url.us-east-1.on.aws/"
 )
+# Registry lookups are cached per host, misses for less time so that newly
+# published indexes are found soon after
+LOOKUP_CACHE_FILE = Path.home() / ".cache" / "stores" / "lookups.json"
+LOOKUP_TTL = 60 * 60
+NEGATIVE_LOOKUP_TTL = 5 * 60
+LOOKUP_TIMEOUT = 10
+_session = None
+
+
+# "git" fetches just the requested commit into a mirror of the index repo
+# "tarball" downloads a source archive of the commit, for GitHub repos only
+SUPPORTED_FETCHES = [
+    "git",
+    "tarball",
+]
+GITHUB_ARCHIVE_URL = "https://codeload.github.com/{owner}/{repo}/tar.gz/{ref}"
+DOWNLOAD_TIMEOUT = 60
 
 
 def clear_default_cache():
     shutil.rmtree(CACHE_DIR)
 
 
-def lookup_index(index_id: str, index_version: str | None = None):
-    response = requests.post(
+def split_index_id(index_id: str) -> tuple[str, str | None]:
+    if index_id.count(":") > 1:
+        raise ValueError(f"Invalid index id: {index_id}")
+    if ":" in index_id:
+        index_id, index_version = index_id.split(":")
+        return index_id, index_version
+    return index_id, None
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the session shared by registry lookups, so that connections to
+    the registry are reused
+    """
+    global _session
+    if _session is None:
+        _session = requests.Session()
+    return _session
+
+
+def get_lookup_key(index_id: str, index_version: str | None) -> str:
+    return f"{index_id}:{index_version or ''}"
+
+
+def load_lookup_cache() -> dict:
+    """
+    Returns lookups of INDEX_LOOKUP_URL that have not expired, keyed by
+    get_lookup_key
+    """
+    try:
+        with open(LOOKUP_CACHE_FILE) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    now = time.time()
+    lookups = {}
+    for key, entry in cache.get(INDEX_LOOKUP_URL, {}).items():
+        ttl = LOOKUP_TTL if entry["metadata"] else NEGATIVE_LOOKUP_TTL
+        if now - entry["time"] < ttl:
+            lookups[key] = entry["metadata"]
+    return lookups
+
+
+def write_lookup_cache(lookups: dict[str, dict | None]):
+    try:
+        with open(LOOKUP_CACHE_FILE) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    now = time.time()
+    # Drop expired lookups so that the cache does not grow without bound
+    entries = {
+        key: entry
+        for key, entry in cache.get(INDEX_LOOKUP_URL, {}).items()
+        if now - entry["time"] < LOOKUP_TTL
+    }
+    cache[INDEX_LOOKUP_URL] = entries
+    for key, metadata in lookups.items():
+        entries[key] = {"metadata": metadata, "time": now}
+    try:
+        LOOKUP_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = LOOKUP_CACHE_FILE.with_name(
+            f"{LOOKUP_CACHE_FILE.name}.{os.getpid()}"
+        )
+        with open(tmp_path, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, LOOKUP_CACHE_FILE)
+    except OSError:
+        logger.warning(f"Unable to write {LOOKUP_CACHE_FILE}", exc_info=True)
+
+
+def request_lookup(index_id: str, index_version: str | None) -> dict | None:
+    """
+    Returns the metadata of an index, or None if it is not in the registry.
+    Raises requests.RequestException if the registry could not answer.
+    """
+    response = get_session().post(
         INDEX_LOOKUP_URL,
         headers={
             "content-type": "application/json",
@@ -41,13 +143,195 @@ def lookup_index(index_id: str, index_version: str | None = None):
                 "index_version": index_version,
             }
         ),
+        timeout=LOOKUP_TIMEOUT,
+    )
+    if response.status_code == 404:
+        # Only misses the registry is sure about are cached
+        return None
+    response.raise_for_status()
+    return response.json()
+
+
+def request_lookups(
+    indexes: list[tuple[str, str | None]],
+) -> list[dict | None]:
+    """
+    Look up several indexes with one request, falling back to one request per
+    index if the registry does not support batch lookups
+    """
+    response = get_session().post(
+        INDEX_LOOKUP_URL,
+        headers={
+            "content-type": "application/json",
+        },
+        data=json.dumps(
+            {
+                "indexes": [
+                    {
+                        "index_id": index_id,
+                        "index_version": index_version,
+                    }
+                    for index_id, index_version in indexes
+                ]
+            }
+        ),
+        timeout=LOOKUP_TIMEOUT,
     )
     if response.ok:
-        return response.json()
+        try:
+            results = response.json()
+        except ValueError:
+            results = None
+        if isinstance(results, list) and len(results) == len(indexes):
+            return results
+    return [request_lookup(*index) for index in indexes]
+
+
+def lookup_indexes(
+    indexes: list[tuple[str, str | None]],
+) -> dict[tuple[str, str | None], dict | None]:
+    """
+    Look up (index_id, index_version) pairs in the registry, using cached
+    lookups where possible and a single request for the rest
+
+    Returns the metadata of each index, or None for indexes not in the registry.
+    """
+    indexes = list(dict.fromkeys(indexes))
+    cache = load_lookup_cache()
+    results = {}
+    missing = []
+    for index in indexes:
+        key = get_lookup_key(*index)
+        if key in cache:
+            results[index] = cache[key]
+        else:
+            missing.append(index)
+    if missing:
+        if len(missing) == 1:
+            lookups = [request_lookup(*missing[0])]
+        else:
+            lookups = request_lookups(missing)
+        results.update(zip(missing, lookups, strict=True))
+        write_lookup_cache(
+            {
+                get_lookup_key(*index): metadata
+                for index, metadata in zip(missing, lookups, strict=True)
+            }
+        )
+    return results
+
+
+def lookup_index(index_id: str, index_version: str | None = None):
+    index_metadata = lookup_indexes([(index_id, index_version)])[
+        (index_id, index_version)
+    ]
+    if index_metadata:
+        return index_metadata
     else:
         raise ValueError(f"Index {index_id} not found in database")
 
 
+def get_mirror(repo_url: str, mirrors_dir: PathLike) -> Repo:
+    """
+    Return the bare mirror of repo_url shared by every version of an index
+    """
+    mirror_name = re.sub(r"[^\w.-]+", "_", repo_url.split("://")[-1])
+    mirror_path = Path(mirrors_dir) / mirror_name
+    if mirror_path.exists():
+        return Repo(mirror_path)
+    mirror = Repo.init(mirror_path, bare=True)
+    mirror.create_remote("origin", repo_url)
+    return mirror
+
+
+def fetch_ref(repo: Repo, commit_like: str | None) -> str:
+    """
+    Fetch commit_like, or the default branch, from origin without history
+    and return its commit hash
+
+    Objects that repo already has are not fetched again.
+    """
+    ref = commit_like or "HEAD"
+    # Fetched into a ref of its own rather than FETCH_HEAD, which concurrent
+    # fetches of other versions would overwrite
+    target = f"refs/stores/{ref}"
+    try:
+        # Servers resolve branch and tag names, and full commit hashes as long
+        # as they allow fetching reachable commits directly
+        repo.git.fetch("origin", f"+{ref}:{target}", depth=1)
+        return repo.git.rev_parse(f"{target}^{{commit}}")
+    except GitCommandError:
+        if commit_like is None:
+            raise
+        # e.g. an abbreviated commit hash, which needs history to resolve
+        logger.info(f"Unable to fetch {commit_like} alone, fetching history...")
+        if repo.git.rev_parse("--is-shallow-repository") == "true":
+            repo.git.fetch("origin", unshallow=True)
+        else:
+            repo.git.fetch("origin")
+        return repo.git.rev_parse(f"{commit_like}^{{commit}}")
+
+
+def fetch_worktree(
+    repo_url: str,
+    index_folder: PathLike,
+    commit_like: str | None,
+    mirrors_dir: PathLike,
+) -> Repo:
+    """
+    Check out commit_like, or the default branch, of repo_url into
+    index_folder as a worktree of the mirror of repo_url
+    """
+    mirror = get_mirror(repo_url, mirrors_dir)
+    try:
+        commit = fetch_ref(mirror, commit_like)
+    except GitCommandError:
+        if not mirror.refs:
+            # Nothing was ever fetched into the mirror
+            shutil.rmtree(mirror.git_dir, ignore_errors=True)
+            for folder in [Path(mirrors_dir), Path(mirrors_dir).parent]:
+                try:
+                    folder.rmdir()
+                except OSError:
+                    break
+        raise
+    # Forget worktrees of index folders that have been deleted
+    mirror.git.worktree("prune")
+    mirror.git.worktree("add", "--detach", str(Path(index_folder).absolute()), commit)
+    return Repo(index_folder)
+
+
+def download_tarball(repo_url: str, index_folder: PathLike, commit_like: str | None):
+    """
+    Extract a source archive of commit_like, or the default branch, of a
+    GitHub repo_url into index_folder
+    """
+    match = re.match(
+        r"https://github\.com/(?P<owner>[^/]+)/(?P<repo>[^/]+?)(\.git)?/?$", repo_url
+    )
+    if match is None:
+        raise ValueError(f"Unable to download a tarball of {repo_url}")
+    response = requests.get(
+        GITHUB_ARCHIVE_URL.format(**match.groupdict(), ref=commit_like or "HEAD"),
+        stream=True,
+        timeout=DOWNLOAD_TIMEOUT,
+    )
+    if not response.ok:
+        raise ValueError(f"Unable to download a tarball of {repo_url}")
+
+    index_folder = Path(index_folder)
+    index_folder.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=index_folder.parent) as tmp_dir:
+        with tarfile.open(fileobj=response.raw, mode="r|gz") as tar:
+            if hasattr(tarfile, "data_filter"):
+                tar.extractall(tmp_dir, filter="data")
+            else:
+                tar.extractall(tmp_dir)
+        # Archives contain a single folder named after the repo and commit
+        (source_folder,) = Path(tmp_dir).iterdir()
+        os.rename(source_folder, index_folder)
+
+
 class RemoteIndex(BaseIndex):
     def __init__(
         self,
@@ -58,7 +342,20 @@ class RemoteIndex(BaseIndex):
         cache_dir: Optional[PathLike] = None,
         reset_cache=False,
         sys_executable: str | None = None,
+        executor: str = DEFAULT_EXECUTOR,
+        timeout: float | None = None,
+        static_signatures: bool = False,
+        installer: str | None = None,
+        package_store: bool = False,
+        base_layer: list[str] | None = None,
+        wheelhouse: PathLike | None = None,
+        precompile: bool = True,
+        pycache_prefix: PathLike | None = None,
+        fetch: str = "git",
+        allow_pickle: bool = False,
     ):
+        if fetch not in SUPPORTED_FETCHES:
+            raise ValueError(f"Unsupported fetch: {fetch}")
         self.index_id = index_id
         if cache_dir is None:
             cache_dir = CACHE_DIR
@@ -72,9 +369,7 @@ class RemoteIndex(BaseIndex):
         exclude = exclude or []
         if not self.index_folder.exists():
             logger.info(f"Installing {index_id}...")
-            commit_like = None
-            if ":" in index_id:
-                index_id, commit_like = index_id.split(":")
+            index_id, commit_like = split_index_id(index_id)
             # Lookup Stores DB
             repo_url = None
             try:
@@ -82,7 +377,10 @@ class RemoteIndex(BaseIndex):
                 if index_metadata:
                     repo_url = index_metadata["clone_url"]
                     commit_like = index_metadata["commit"]
-            except Exception:
+            except requests.RequestException:
+                # The registry may list the index under another repo
+                raise
+            except ValueError:
                 logger.warning(
                     f"Could not find {index_id} in stores, assuming index references a GitHub repo..."
                 )
@@ -91,24 +389,53 @@ class RemoteIndex(BaseIndex):
                 # Otherwise, assume index references a GitHub repo
                 repo_url = f"https://github.com/{index_id}.git"
             try:
-                repo = Repo.clone_from(repo_url, self.index_folder)
-            except GitCommandError as e:
+                if fetch == "tarball":
+                    download_tarball(repo_url, self.index_folder, commit_like)
+                else:
+                    fetch_worktree(
+                        repo_url,
+                        self.index_folder,
+                        commit_like,
+                        cache_dir / MIRRORS_DIR,
+                    )
+            except (GitCommandError, ValueError, requests.RequestException) as e:
+                # Do not leave a partial index to be loaded next time
+                shutil.rmtree(self.index_folder, ignore_errors=True)
                 raise ValueError(f"Index {index_id} not found") from e
-            if commit_like:
-                repo.git.checkout(commit_like)
-
-        # Create venv and install deps
-        self.venv = self.index_folder / VENV_NAME
-        if not self.venv.exists():
-            if sys_executable:
-                subprocess.run(
-                    [sys_executable, "-m", "venv", str(self.venv)], check=True
-                )
-            else:
-                venv.create(self.venv, symlinks=True, with_pip=True, upgrade_deps=True)
-        install_venv_deps(self.index_folder)
+
+        # Versions of the index with the same dependencies share a venv
+        self.venv = init_shared_venv(
+            self.index_folder,
+            cache_dir / VENVS_DIR,
+            sys_executable=sys_executable,
+            installer=installer,
+        )
+        install_venv_deps(
+            self.index_folder,
+            installer=installer,
+            package_store=package_store,
+            base_layer=base_layer,
+            wheelhouse=wheelhouse,
+            precompile=precompile,
+            pycache_prefix=pycache_prefix,
+        )
         # Initialize tools
         tools = init_venv_tools(
-            self.index_folder, env_var=self.env_var, include=include, exclude=exclude
+            self.index_folder,
+            env_var=self.env_var,
+            include=include,
+            exclude=exclude,
+            executor=executor,
+            timeout=timeout,
+            static_signatures=static_signatures,
+            allow_pickle=allow_pickle,
         )
         super().__init__(tools)
+        acquire_workers(self.index_folder)
+        self.closed = False
+
+    def close(self):
+        if not self.closed:
+            # Other indexes on the same folder may still use its workers
+            release_workers(self.index_folder)
+        self.closed = True
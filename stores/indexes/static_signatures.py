@@ -0,0 +1,415 @@
+"""
+Tool signatures read from source code without importing it
+
+Tools whose annotations only use builtins, typing constructs and Enum or
+TypedDict classes defined in the same module can be described by parsing
+their module. The annotations are rebuilt as the objects the venv
+interpreter would see and described with the same get_param_info, so a
+static signature matches the one the dynamic runner returns. Anything that
+cannot be resolved with certainty is left to the dynamic runner.
+"""
+
+import ast
+import enum
+import inspect
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Literal, Optional, Tuple, TypedDict, Union
+
+from stores.indexes.worker_runtime import (
+    SIGNATURE_SCHEMA_VERSION,
+    check_signature,
+    extract_type_info,
+    get_param_info,
+)
+
+# Names that resolve to the same object in any module that does not rebind them
+BUILTIN_TYPES = {
+    "str": str,
+    "int": int,
+    "float": float,
+    "bool": bool,
+    "bytes": bytes,
+    "list": list,
+    "dict": dict,
+    "tuple": tuple,
+}
+TYPING_NAMES = {
+    "typing.Any": Any,
+    "typing.Dict": Dict,
+    "typing.List": List,
+    "typing.Literal": Literal,
+    "typing.Optional": Optional,
+    "typing.Tuple": Tuple,
+    "typing.Union": Union,
+}
+ENUM_BASES = {"enum.Enum"}
+TYPED_DICT_BASES = {"typing.TypedDict", "typing_extensions.TypedDict"}
+# Mixin types of Enums whose members can be rebuilt from their values
+ENUM_MIXINS = {"str": str, "int": int}
+
+
+class Unresolved(Exception):
+    """
+    Raised when part of a signature can only be known by running the module
+    """
+
+
+def get_module_path(index_folder: os.PathLike, module_name: str) -> Path | None:
+    """
+    Locate the source file of a module within index_folder
+    """
+    module_path = Path(index_folder, *module_name.split("."))
+    for source in [module_path.with_suffix(".py"), module_path / "__init__.py"]:
+        if source.exists():
+            return source
+    return None
+
+
+def _walk_scope(node: ast.AST):
+    """
+    Yield nodes evaluated in the scope of node, skipping nested scopes
+    """
+    for child in ast.iter_child_nodes(node):
+        yield child
+        if isinstance(
+            child,
+            (
+                ast.FunctionDef,
+                ast.AsyncFunctionDef,
+                ast.ClassDef,
+                ast.Lambda,
+                ast.ListComp,
+                ast.SetComp,
+                ast.DictComp,
+                ast.GeneratorExp,
+            ),
+        ):
+            continue
+        yield from _walk_scope(child)
+
+
+class ModuleScope:
+    """
+    Top-level names of a module that are bound exactly once, by a function
+    or class definition or an import
+    """
+
+    def __init__(self, source: str):
+        self.tree = ast.parse(source)
+        self.definitions: dict[str, ast.AST] = {}
+        self.imports: dict[str, str] = {}
+        self.classes: dict[str, Any] = {}
+        counts: dict[str, int] = {}
+
+        def bind(name: str):
+            counts[name] = counts.get(name, 0) + 1
+
+        for node in _walk_scope(self.tree):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                bind(node.name)
+                if node in self.tree.body:
+                    self.definitions[node.name] = node
+            elif isinstance(node, ast.Import):
+                for alias in node.names:
+                    name = alias.asname or alias.name.split(".")[0]
+                    bind(name)
+                    if node in self.tree.body:
+                        self.imports[name] = alias.name if alias.asname else name
+            elif isinstance(node, ast.ImportFrom):
+                for alias in node.names:
+                    if alias.name == "*" or node.level:
+                        raise Unresolved("Module uses star or relative imports")
+                    name = alias.asname or alias.name
+                    bind(name)
+                    if node in self.tree.body:
+                        self.imports[name] = f"{node.module}.{alias.name}"
+            elif isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+                bind(node.id)
+            elif isinstance(node, ast.Attribute) and not isinstance(node.ctx, ast.Load):
+                # Assigning attributes, e.g. __signature__, may change a tool
+                if isinstance(node.value, ast.Name):
+                    bind(node.value.id)
+        # Names declared global in functions may be rebound when they run
+        for node in ast.walk(self.tree):
+            if isinstance(node, (ast.Global, ast.Nonlocal)):
+                for name in node.names:
+                    bind(name)
+        self.rebound = {name for name, count in counts.items() if count > 1}
+        self.bound = set(counts)
+
+    def lookup(self, name: str) -> str:
+        """
+        Qualified name of an imported name, or of a builtin
+        """
+        if name in self.rebound:
+            raise Unresolved(f"{name} is bound more than once")
+        if name in self.imports:
+            return self.imports[name]
+        if name in self.bound:
+            return f"<module>.{name}"
+        return f"builtins.{name}"
+
+    def qualname(self, node: ast.expr) -> str:
+        if isinstance(node, ast.Name):
+            return self.lookup(node.id)
+        elif isinstance(node, ast.Attribute):
+            return f"{self.qualname(node.value)}.{node.attr}"
+        raise Unresolved(f"Unsupported expression {ast.dump(node)}")
+
+    def function(self, name: str) -> ast.FunctionDef | ast.AsyncFunctionDef:
+        node = self.definitions.get(name)
+        if name in self.rebound or not isinstance(
+            node, (ast.FunctionDef, ast.AsyncFunctionDef)
+        ):
+            raise Unresolved(f"{name} is not a plain function")
+        if node.decorator_list:
+            raise Unresolved(f"{name} is decorated")
+        return node
+
+    def resolve(self, node: ast.expr, resolving: tuple[str, ...] = ()):
+        """
+        Rebuild the object an annotation evaluates to
+        """
+        if isinstance(node, ast.Constant):
+            if node.value is None:
+                return type(None)
+            elif isinstance(node.value, str):
+                # Forward references and postponed annotations
+                return self.resolve(ast.parse(node.value, mode="eval").body, resolving)
+            raise Unresolved(f"Unsupported annotation {node.value!r}")
+        elif isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitOr):
+            left = self.resolve(node.left, resolving)
+            right = self.resolve(node.right, resolving)
+            try:
+                return left | right
+            except TypeError as e:
+                raise Unresolved(str(e)) from e
+        elif isinstance(node, ast.Subscript):
+            origin = self.resolve(node.value, resolving)
+            elts = (
+                node.slice.elts if isinstance(node.slice, ast.Tuple) else [node.slice]
+            )
+            if origin is Literal:
+                args = tuple(self.literal(elt) for elt in elts)
+            else:
+                args = tuple(
+                    Ellipsis
+                    if isinstance(elt, ast.Constant) and elt.value is Ellipsis
+                    else self.resolve(elt, resolving)
+                    for elt in elts
+                )
+            if origin not in (List, Dict, Tuple, Union, Optional, Literal) and (
+                origin not in (list, dict, tuple)
+            ):
+                raise Unresolved(f"Unsupported generic {origin}")
+            try:
+                return origin[args if len(args) > 1 else args[0]]
+            except TypeError as e:
+                raise Unresolved(str(e)) from e
+
+        qualname = self.qualname(node)
+        if qualname in TYPING_NAMES:
+            return TYPING_NAMES[qualname]
+        elif qualname.startswith("builtins."):
+            name = qualname.removeprefix("builtins.")
+            if name in BUILTIN_TYPES:
+                return BUILTIN_TYPES[name]
+        elif qualname.startswith("<module>."):
+            return self.resolve_class(qualname.removeprefix("<module>."), resolving)
+        raise Unresolved(f"Unsupported annotation {qualname}")
+
+    def literal(self, node: ast.expr):
+        try:
+            return ast.literal_eval(node)
+        except (ValueError, TypeError, SyntaxError) as e:
+            raise Unresolved(f"{ast.dump(node)} is not a literal") from e
+
+    def resolve_class(self, name: str, resolving: tuple[str, ...]):
+        if name in self.classes:
+            return self.classes[name]
+        node = self.definitions.get(name)
+        if name in resolving or not isinstance(node, ast.ClassDef):
+            raise Unresolved(f"{name} is not a supported class")
+        if node.decorator_list:
+            raise Unresolved(f"{name} is decorated")
+        bases = [self.qualname(base) for base in node.bases]
+        if bases and bases[-1] in ENUM_BASES:
+            cls = self.build_enum(node, bases[:-1])
+        elif bases and all(base in TYPED_DICT_BASES for base in bases):
+            cls = self.build_typed_dict(node, resolving + (name,))
+        else:
+            raise Unresolved(f"{name} is not an Enum or TypedDict")
+        self.classes[name] = cls
+        return cls
+
+    def build_enum(self, node: ast.ClassDef, mixins: list[str]):
+        if node.keywords or len(mixins) > 1:
+            raise Unresolved(f"{node.name} has unsupported bases")
+        mixin = None
+        if mixins:
+            name = mixins[0].removeprefix("builtins.")
+            if not mixins[0].startswith("builtins.") or name not in ENUM_MIXINS:
+                raise Unresolved(f"{node.name} has unsupported bases")
+            mixin = ENUM_MIXINS[name]
+        members = []
+        for stmt in self.class_body(node):
+            if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                continue
+            if not (
+                isinstance(stmt, ast.Assign)
+                and len(stmt.targets) == 1
+                and isinstance(stmt.targets[0], ast.Name)
+                and not stmt.targets[0].id.startswith("_")
+            ):
+                raise Unresolved(f"{node.name} has unsupported members")
+            members.append((stmt.targets[0].id, self.literal(stmt.value)))
+        try:
+            return enum.Enum(node.name, members, type=mixin)
+        except (TypeError, ValueError) as e:
+            raise Unresolved(str(e)) from e
+
+    def build_typed_dict(self, node: ast.ClassDef, resolving: tuple[str, ...]):
+        total = True
+        for keyword in node.keywords:
+            if keyword.arg != "total":
+                raise Unresolved(f"{node.name} has unsupported keywords")
+            total = self.literal(keyword.value)
+        fields = {}
+        for stmt in self.class_body(node):
+            if not (
+                isinstance(stmt, ast.AnnAssign)
+                and isinstance(stmt.target, ast.Name)
+                and stmt.value is None
+            ):
+                raise Unresolved(f"{node.name} has unsupported fields")
+            fields[stmt.target.id] = self.resolve(stmt.annotation, resolving)
+        return TypedDict(node.name, fields, total=total)
+
+    def class_body(self, node: ast.ClassDef):
+        for i, stmt in enumerate(node.body):
+            if isinstance(stmt, ast.Pass):
+                continue
+            if i == 0 and ast.get_docstring(node) is not None:
+                continue
+            yield stmt
+
+
+def _is_generator(node: ast.FunctionDef | ast.AsyncFunctionDef) -> bool:
+    return any(
+        isinstance(child, (ast.Yield, ast.YieldFrom)) for child in _walk_scope(node)
+    )
+
+
+def get_static_signature(
+    scope: ModuleScope,
+    tool_id: str,
+    python_version: tuple[int, ...] | None,
+) -> dict:
+    """
+    Describe a tool in the same way as worker_runtime.get_signature
+
+    Raises Unresolved if the signature cannot be derived from source.
+    """
+    node = scope.function(tool_id.rsplit(".", 1)[-1])
+    arguments = node.args
+    positional = arguments.posonlyargs + arguments.args
+    defaults = [None] * (len(positional) - len(arguments.defaults))
+    defaults += arguments.defaults
+    params = [
+        (arg, kind, default)
+        for arg, kind, default in zip(
+            positional,
+            [inspect.Parameter.POSITIONAL_ONLY] * len(arguments.posonlyargs)
+            + [inspect.Parameter.POSITIONAL_OR_KEYWORD] * len(arguments.args),
+            defaults,
+            strict=True,
+        )
+    ]
+    if arguments.vararg:
+        params.append((arguments.vararg, inspect.Parameter.VAR_POSITIONAL, None))
+    params += [
+        (arg, inspect.Parameter.KEYWORD_ONLY, default)
+        for arg, default in zip(
+            arguments.kwonlyargs, arguments.kw_defaults, strict=True
+        )
+    ]
+    if arguments.kwarg:
+        params.append((arguments.kwarg, inspect.Parameter.VAR_KEYWORD, None))
+
+    param_infos = {}
+    for arg, kind, default_node in params:
+        default = (
+            inspect.Parameter.empty
+            if default_node is None
+            else scope.literal(default_node)
+        )
+        if arg.annotation is None:
+            hint = inspect.Parameter.empty
+        else:
+            hint = scope.resolve(arg.annotation)
+            if default is None:
+                # get_type_hints made these Optional before Python 3.11
+                if python_version is None:
+                    raise Unresolved("Unknown interpreter version")
+                if python_version < (3, 11):
+                    hint = Optional[hint]
+        param_infos[arg.arg] = get_param_info(hint, kind, default)
+
+    if node.returns is None:
+        return_type = inspect.Signature.empty
+    else:
+        return_type = scope.resolve(node.returns)
+    is_async = isinstance(node, ast.AsyncFunctionDef)
+    is_generator = _is_generator(node)
+    return check_signature(
+        {
+            "schema_version": SIGNATURE_SCHEMA_VERSION,
+            "tool_id": tool_id,
+            "params": param_infos,
+            "return": extract_type_info(return_type),
+            "iscoroutinefunction": is_async and not is_generator,
+            "isgeneratorfunction": not is_async and is_generator,
+            "isasyncgenfunction": is_async and is_generator,
+            "doc": ast.get_docstring(node),
+        }
+    )
+
+
+def get_static_signatures(
+    tool_ids: list[str],
+    index_folder: os.PathLike,
+    python_version: str | None = None,
+) -> dict[str, dict]:
+    """
+    Derive the signatures of tool_ids that can be read from source
+
+    Tools missing from the result must be introspected by the dynamic
+    runner. python_version is the version of the venv interpreter.
+    """
+    version = None
+    if python_version:
+        version = tuple(int(part) for part in python_version.split(".")[:2])
+
+    scopes = {}
+    signatures = {}
+    for tool_id in tool_ids:
+        module_name = tool_id.rsplit(".", 1)[0]
+        try:
+            if module_name not in scopes:
+                scopes[module_name] = None
+                module_path = get_module_path(index_folder, module_name)
+                if module_path is None:
+                    raise Unresolved(f"{module_name} is not in the index")
+                with open(module_path, encoding="utf-8") as f:
+                    scopes[module_name] = ModuleScope(f.read())
+            if scopes[module_name] is None:
+                continue
+            signatures[tool_id] = get_static_signature(
+                scopes[module_name], tool_id, version
+            )
+        except (Unresolved, SyntaxError, UnicodeDecodeError, TypeError):
+            # TypeError covers types and defaults that signatures cannot
+            # describe, which the dynamic runner reports as errors
+            continue
+    return signatures
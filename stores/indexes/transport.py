@@ -0,0 +1,173 @@
+import asyncio
+import os
+import shutil
+import socket
+import tempfile
+import time
+from typing import Callable
+
+from stores.indexes import worker_runtime
+
+# "socketpair" hands the child one end of a socket pair it inherits
+# "unix" has the child connect to a Unix domain socket
+# "tcp" has the child connect to a localhost port, which works everywhere
+SUPPORTED_TRANSPORTS = [
+    "socketpair",
+    "unix",
+    "tcp",
+]
+DEFAULT_TRANSPORT = "tcp" if os.name == "nt" else "socketpair"
+
+# Interval at which a pending accept checks whether the child has exited
+EXIT_POLL_INTERVAL = 0.05
+
+# Loads the worker runtime as "runtime" within inline runner scripts, which
+# run in index venvs where stores itself is not installed
+RUNTIME_IMPORT = f"""
+import importlib.util
+_spec = importlib.util.spec_from_file_location(
+    "stores_worker_runtime", {os.path.abspath(worker_runtime.__file__)!r}
+)
+runtime = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(runtime)
+"""
+
+
+class Transport:
+    """
+    Socket connecting the parent to a single child process
+
+    Create the transport, spawn the child with pass_fds=transport.pass_fds
+    and the transport address, then call accept to obtain the parent socket.
+    """
+
+    def __init__(self, kind: str | None = None):
+        self.kind = kind or DEFAULT_TRANSPORT
+        self.pass_fds = ()
+        self._parent = None
+        self._child = None
+        self._listener = None
+        self._tmpdir = None
+
+        if self.kind == "socketpair":
+            self._parent, self._child = socket.socketpair()
+            self.pass_fds = (self._child.fileno(),)
+            self.address = f"fd:{self._child.fileno()}"
+        elif self.kind == "unix":
+            self._tmpdir = tempfile.mkdtemp(prefix="stores-")
+            path = os.path.join(self._tmpdir, "sock")
+            self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._listener.bind(path)
+            self._listener.listen(1)
+            self.address = f"unix:{path}"
+        elif self.kind == "tcp":
+            self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._listener.bind(("localhost", 0))
+            self._listener.listen(1)
+            host, port = self._listener.getsockname()
+            self.address = f"tcp:{host}:{port}"
+        else:
+            raise ValueError(f"Unsupported transport: {self.kind}")
+
+    def _close_child_end(self):
+        # The child holds its own copy of the inherited socket
+        if self._child is not None:
+            self._child.close()
+            self._child = None
+
+    def _configure(self, sock: socket.socket):
+        if self.kind == "tcp":
+            # Messages are small and latency sensitive
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def accept(
+        self,
+        timeout: float | None = None,
+        exit_code: Callable[[], int | None] | None = None,
+    ) -> socket.socket:
+        """
+        Return the parent socket once the child has connected
+
+        Raises socket.timeout if the child does not connect within timeout,
+        and ChildProcessError as soon as exit_code reports that the child
+        exited without connecting.
+        """
+        self._close_child_end()
+        if self._parent is not None:
+            sock, self._parent = self._parent, None
+        else:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            try:
+                while True:
+                    wait = EXIT_POLL_INTERVAL if exit_code is not None else timeout
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise socket.timeout("Timed out waiting for connection")
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._listener.settimeout(wait)
+                    try:
+                        sock, _ = self._listener.accept()
+                        break
+                    except socket.timeout:
+                        self._check_exit(exit_code)
+            finally:
+                self.close()
+            self._configure(sock)
+        sock.settimeout(None)
+        return sock
+
+    async def aaccept(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        timeout: float | None = None,
+        exit_code: Callable[[], int | None] | None = None,
+    ) -> socket.socket:
+        """
+        Non-blocking version of accept for use within an event loop
+        """
+        self._close_child_end()
+        if self._parent is not None:
+            sock, self._parent = self._parent, None
+        else:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            self._listener.setblocking(False)
+            try:
+                while True:
+                    wait = EXIT_POLL_INTERVAL if exit_code is not None else timeout
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise socket.timeout("Timed out waiting for connection")
+                        wait = remaining if wait is None else min(wait, remaining)
+                    try:
+                        sock, _ = await asyncio.wait_for(
+                            loop.sock_accept(self._listener), wait
+                        )
+                        break
+                    except asyncio.TimeoutError:
+                        self._check_exit(exit_code)
+            finally:
+                self.close()
+            self._configure(sock)
+        sock.setblocking(False)
+        return sock
+
+    def _check_exit(self, exit_code: Callable[[], int | None] | None):
+        if exit_code is not None:
+            code = exit_code()
+            if code is not None:
+                raise ChildProcessError(
+                    f"Process exited with code {code} before connecting"
+                )
+
+    def close(self):
+        for sock in (self._parent, self._child, self._listener):
+            if sock is not None:
+                sock.close()
+        self._parent = None
+        self._child = None
+        self._listener = None
+        if self._tmpdir is not None:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+            self._tmpdir = None
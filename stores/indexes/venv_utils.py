@@ -4,19 +4,53 @@ import inspect
 import json
 import logging
 import os
-import pickle
-import queue
-import socket
+import re
+import shutil
 import subprocess
 import sys
-import threading
+import time
+import venv
 from enum import Enum
 from pathlib import Path
 from typing import Dict, Literal, Tuple, TypedDict, Union
 
+from git import InvalidGitRepositoryError, NoSuchPathError, Repo
 from makefun import create_function
 
-from stores.constants import TOOLS_CONFIG_FILENAME, VENV_NAME
+from stores.constants import (
+    LOCK_FILENAME,
+    SIGNATURES_FILENAME,
+    TOOLS_CONFIG_FILENAME,
+    VENV_NAME,
+)
+from stores.indexes.base_index import CALL_TIMEOUT
+from stores.indexes.package_store import get_site_packages, link_venv
+from stores.indexes.static_signatures import get_module_path, get_static_signatures
+from stores.indexes.transport import RUNTIME_IMPORT, Transport
+from stores.indexes.worker_pool import (
+    DEFAULT_STREAM_WINDOW,
+    ForkServer,
+    StderrTail,
+    close_workers,
+    collect_response,
+    get_fork_server,
+    get_worker,
+    process_error,
+    remaining,
+    unpack_result,
+)
+from stores.indexes.worker_runtime import (
+    CODECS,
+    DEFAULT_CODEC,
+    DEFAULT_SHARED_MEMORY_THRESHOLD,
+    SIGNATURE_SCHEMA_VERSION,
+    TYPE_NAMES,
+    MessageReader,
+    asend_message,
+    remove_shared,
+    send_message,
+    unlink_shared,
+)
 
 if sys.version_info >= (3, 11):
     import tomllib
@@ -28,6 +62,17 @@ logger = logging.getLogger("stores.indexes.venv_utils")
 logger.setLevel(logging.INFO)
 
 HASH_FILE = ".deps_hash"
+SIGNATURE_CACHE_FILE = ".signature_cache"
+RESOLVED_FILE = ".deps_resolved"
+BASE_LAYER_FILE = "_stores_base_layer.pth"
+PYCACHE_PREFIX_FILE = "_stores_pycache_prefix.pth"
+
+TEMPLATE_FILE = ".template_path"
+
+# Shared by every index venv on the host
+BASE_LAYER_DIR = Path.home() / ".cache" / "stores" / "base"
+VENV_TEMPLATE_DIR = Path.home() / ".cache" / "stores" / "templates"
+WHEELHOUSE_DIR = Path.home() / ".cache" / "stores" / "wheelhouses"
 
 
 SUPPORTED_CONFIGS = [
@@ -35,23 +80,373 @@ SUPPORTED_CONFIGS = [
     "setup.py",
     "requirements.txt",
 ]
+# Configs that make the index itself a package to install
+PACKAGE_CONFIGS = [
+    "pyproject.toml",
+    "setup.py",
+]
+
+# "worker" serves calls from a long-lived process per index venv
+# "subprocess" starts a fresh interpreter for every call
+# "forkserver" forks every call from a process with the tools imported
+SUPPORTED_EXECUTORS = [
+    "worker",
+    "subprocess",
+    "forkserver",
+]
+DEFAULT_EXECUTOR = "worker"
+
+# Installers used to create index venvs and install their dependencies, by
+# default uv when it is on PATH and otherwise pip
+SUPPORTED_INSTALLERS = [
+    "uv",
+    "pip",
+]
+
+# Types and parameter kinds by the names used in signatures
+TYPES = {name: typ for typ, name in TYPE_NAMES.items()}
+PARAMETER_KINDS = {kind.name: kind for kind in inspect._ParameterKind}
+
+# Seconds allowed for a venv interpreter to import a tool and report its
+# signature
+SIGNATURE_TIMEOUT = 120
+
+
+def get_installer(installer: str | None = None) -> str:
+    """
+    Resolve the installer backend, preferring uv when it is on PATH
+    """
+    if installer is None:
+        return "uv" if shutil.which("uv") else "pip"
+    if installer not in SUPPORTED_INSTALLERS:
+        raise ValueError(f"Unsupported installer: {installer}")
+    if installer == "uv" and not shutil.which("uv"):
+        raise RuntimeError("Unable to use installer uv - uv is not on PATH")
+    return installer
 
 
-def get_pip_command(venv_path: os.PathLike, config_file: str) -> list[str]:
+def get_pip_path(venv_path: os.PathLike) -> Path:
     venv_path = Path(venv_path).resolve()
     if os.name == "nt":
-        pip_path = venv_path / "Scripts" / "pip.exe"
+        return venv_path / "Scripts" / "pip.exe"
+    else:
+        return venv_path / "bin" / "pip"
+
+
+def get_install_command(
+    venv_path: os.PathLike,
+    installer: str = "pip",
+    wheelhouse: os.PathLike | None = None,
+) -> list[str]:
+    if installer == "uv":
+        command = ["uv", "pip", "install", "--python", get_python_command(venv_path)]
     else:
-        pip_path = venv_path / "bin" / "pip"
+        command = [str(get_pip_path(venv_path)), "install"]
+    if wheelhouse is not None:
+        # Resolve from local files only
+        command += ["--no-index", "--find-links", str(wheelhouse)]
+    return command
 
-    if config_file in {"pyproject.toml", "setup.py"}:
-        return [str(pip_path), "install", "."]
+
+def get_install_spec(config_file: str) -> list[str]:
+    if config_file in PACKAGE_CONFIGS:
+        return ["."]
     elif config_file == "requirements.txt":
-        return [str(pip_path), "install", "-r", "requirements.txt"]
+        return ["-r", "requirements.txt"]
+    elif config_file == LOCK_FILENAME:
+        # Locked dependencies are complete, including those of the index
+        # itself if it is installed alongside
+        return ["--no-deps", "-r", LOCK_FILENAME]
     else:
         raise ValueError(f"Unsupported config file: {config_file}")
 
 
+def get_install_specs(config_files: list[str]) -> list[str]:
+    specs = []
+    for config_file in config_files:
+        spec = get_install_spec(config_file)
+        # pyproject.toml and setup.py both install the index itself
+        if spec != ["."] or "." not in specs:
+            specs += spec
+    return specs
+
+
+def get_pip_command(
+    venv_path: os.PathLike,
+    config_file: str | list[str],
+    installer: str = "pip",
+    wheelhouse: os.PathLike | None = None,
+) -> list[str]:
+    config_files = [config_file] if isinstance(config_file, str) else config_file
+    return get_install_command(venv_path, installer, wheelhouse) + get_install_specs(
+        config_files
+    )
+
+
+def get_uninstall_command(venv_path: os.PathLike, installer: str = "pip"):
+    if installer == "uv":
+        return ["uv", "pip", "uninstall", "--python", get_python_command(venv_path)]
+    else:
+        return [str(get_pip_path(venv_path)), "uninstall", "--yes"]
+
+
+def ensure_pip(venv_path: os.PathLike):
+    if not get_pip_path(venv_path).exists():
+        # The venv was created without pip, e.g. by uv
+        subprocess.check_call([get_python_command(venv_path), "-m", "ensurepip"])
+
+
+def get_wheelhouse(wheelhouse: os.PathLike) -> Path:
+    """
+    Return the folder of wheels at wheelhouse, extracting it first if it is a
+    prefetched archive
+    """
+    wheelhouse = Path(wheelhouse)
+    if wheelhouse.is_dir():
+        return wheelhouse
+    if not wheelhouse.exists():
+        raise FileNotFoundError(f"Wheelhouse {wheelhouse} does not exist")
+
+    digest = hashlib.sha256()
+    with open(wheelhouse, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    extract_path = WHEELHOUSE_DIR / digest.hexdigest()[:16]
+    if not extract_path.exists():
+        WHEELHOUSE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = extract_path.with_name(f"{extract_path.name}.{os.getpid()}")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        shutil.unpack_archive(wheelhouse, tmp_path)
+        try:
+            os.rename(tmp_path, extract_path)
+        except OSError:
+            # Another process extracted the same archive first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+    # Archives of a wheelhouse folder contain just that folder
+    contents = list(extract_path.iterdir())
+    if len(contents) == 1 and contents[0].is_dir():
+        return contents[0]
+    return extract_path
+
+
+def get_build_requires(index_folder: os.PathLike) -> list[str]:
+    """
+    Return the requirements of the build backend of an index package
+    """
+    pyproject_path = Path(index_folder) / "pyproject.toml"
+    if pyproject_path.exists():
+        with open(pyproject_path, "rb") as f:
+            build_system = tomllib.load(f).get("build-system")
+        if build_system is not None:
+            return build_system.get("requires", [])
+    # Projects without a build system are built with setuptools
+    return ["setuptools>=40.8.0", "wheel"]
+
+
+def fill_wheelhouse(
+    index_folder: os.PathLike, wheelhouse: os.PathLike, venv: str = VENV_NAME
+) -> Path:
+    """
+    Resolve the dependencies of an index, pin them in LOCK_FILENAME and save
+    their wheels to wheelhouse so that the index can be installed offline
+
+    Wheels of the build backend are saved too if the index is a package, so
+    that the index itself can be built offline.
+    """
+    index_folder = Path(index_folder)
+    venv_path = index_folder / venv
+    config_files = get_config_files(index_folder)
+    if not config_files:
+        raise ValueError(f"Unable to lock {index_folder} - no dependencies declared")
+
+    ensure_pip(venv_path)
+    resolved = resolve_deps(index_folder, config_files, venv=venv)
+    requirements = [f"{name}=={version}" for name, version in resolved.items()]
+    wheel_command = [get_python_command(venv_path), "-m", "pip", "wheel"]
+    wheel_command += ["--wheel-dir", str(Path(wheelhouse).absolute())]
+    if requirements:
+        subprocess.check_call(
+            wheel_command + ["--no-deps"] + requirements, cwd=index_folder
+        )
+    if any(c in PACKAGE_CONFIGS for c in config_files):
+        # Build requirements are not locked, so their dependencies are saved
+        # as resolved now
+        subprocess.check_call(
+            wheel_command + get_build_requires(index_folder), cwd=index_folder
+        )
+
+    lock_path = index_folder / LOCK_FILENAME
+    with open(lock_path, "w") as f:
+        f.write(f"# Generated by stores wheelhouse from {', '.join(config_files)}\n")
+        f.writelines(f"{requirement}\n" for requirement in requirements)
+    return lock_path
+
+
+def init_venv(
+    venv_path: os.PathLike,
+    sys_executable: str | None = None,
+    installer: str | None = None,
+):
+    """
+    Create a venv at venv_path with the given installer backend
+    """
+    installer = get_installer(installer)
+    if installer == "uv":
+        # uv installs into the venv itself, so pip is not seeded
+        subprocess.run(
+            [
+                "uv",
+                "venv",
+                "--quiet",
+                "--python",
+                sys_executable or sys.executable,
+                str(venv_path),
+            ],
+            check=True,
+        )
+    elif os.name == "nt":
+        # Windows launchers embed the venv path in binaries, so venvs are
+        # always created from scratch
+        create_pip_venv(venv_path, sys_executable)
+    else:
+        clone_venv(get_venv_template(sys_executable), venv_path)
+
+
+def create_pip_venv(venv_path: os.PathLike, sys_executable: str | None = None):
+    if sys_executable:
+        subprocess.run([sys_executable, "-m", "venv", str(venv_path)], check=True)
+    else:
+        # The bundled pip is recent enough to install the index, so it is not
+        # upgraded from the network
+        venv.create(venv_path, symlinks=True, with_pip=True)
+
+
+def get_interpreter_key(sys_executable: str | None = None) -> str:
+    """
+    Identify the interpreter venvs are created with, changing whenever it is
+    reinstalled
+    """
+    executable = shutil.which(sys_executable or sys.executable)
+    if executable is None:
+        raise FileNotFoundError(f"Python interpreter {sys_executable} not found")
+    executable = Path(executable).resolve()
+    return f"{executable}:{executable.stat().st_mtime_ns}"
+
+
+def get_deps_fingerprint(
+    index_folder: os.PathLike, sys_executable: str | None = None
+) -> str:
+    """
+    Identify the dependencies of an index together with the interpreter they
+    are installed for
+    """
+    fingerprint = f"{get_interpreter_key(sys_executable)}:{get_deps_hash(index_folder)}"
+    return hashlib.sha256(fingerprint.encode()).hexdigest()[:16]
+
+
+def init_shared_venv(
+    index_folder: os.PathLike,
+    venvs_dir: os.PathLike,
+    sys_executable: str | None = None,
+    installer: str | None = None,
+) -> Path:
+    """
+    Link the venv of index_folder to a venv in venvs_dir shared by every index
+    with the same dependencies, creating it if needed
+
+    Indexes that are packages get a venv of their own, since the index itself
+    is installed into it.
+    """
+    venv_path = Path(index_folder) / VENV_NAME
+    if any(c in PACKAGE_CONFIGS for c in get_config_files(index_folder)):
+        if venv_path.is_symlink():
+            venv_path.unlink()
+        if not venv_path.exists():
+            init_venv(venv_path, sys_executable=sys_executable, installer=installer)
+        return venv_path
+    shared_path = Path(venvs_dir).absolute() / get_deps_fingerprint(
+        index_folder, sys_executable
+    )
+    if venv_path.is_symlink():
+        if venv_path.resolve() == shared_path.resolve() and shared_path.exists():
+            return shared_path
+        venv_path.unlink()
+    elif venv_path.exists():
+        # The index has a venv of its own
+        return venv_path
+
+    if not shared_path.exists():
+        init_venv(shared_path, sys_executable=sys_executable, installer=installer)
+    try:
+        os.symlink(shared_path, venv_path, target_is_directory=True)
+    except OSError:
+        # e.g. symlinks are not permitted on Windows
+        init_venv(venv_path, sys_executable=sys_executable, installer=installer)
+        return venv_path
+    return shared_path
+
+
+def get_venv_template(sys_executable: str | None = None) -> Path:
+    """
+    Return a venv with pip for sys_executable to clone index venvs from,
+    creating it the first time the interpreter is used
+    """
+    template_key = get_interpreter_key(sys_executable)
+    template_name = hashlib.sha256(template_key.encode()).hexdigest()[:16]
+    template_path = VENV_TEMPLATE_DIR / template_name
+    if template_path.exists():
+        return template_path
+
+    VENV_TEMPLATE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = template_path.with_name(f"{template_name}.{os.getpid()}")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    create_pip_venv(tmp_path, sys_executable)
+    # Scripts refer to the path the template was built at
+    (tmp_path / TEMPLATE_FILE).write_text(str(tmp_path.absolute()))
+    try:
+        os.rename(tmp_path, template_path)
+    except OSError:
+        # Another process completed the template first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return template_path
+
+
+def clone_venv(template_path: os.PathLike, venv_path: os.PathLike):
+    """
+    Copy a venv template to venv_path by hardlinking its files, rewriting the
+    scripts and configuration that refer to the template path
+    """
+    template_path = Path(template_path)
+    venv_path = Path(venv_path).absolute()
+    source = (template_path / TEMPLATE_FILE).read_bytes()
+    target = str(venv_path).encode()
+    for root, dirs, files in os.walk(template_path):
+        root = Path(root)
+        dest_root = venv_path / root.relative_to(template_path)
+        dest_root.mkdir(parents=True, exist_ok=True)
+        for name in list(dirs):
+            if (root / name).is_symlink():
+                # e.g. lib64 -> lib
+                os.symlink(os.readlink(root / name), dest_root / name)
+                dirs.remove(name)
+        for name in files:
+            src, dest = root / name, dest_root / name
+            if src.is_symlink():
+                os.symlink(os.readlink(src), dest)
+            elif name == TEMPLATE_FILE:
+                continue
+            elif root.name == "bin" or name == "pyvenv.cfg":
+                content = src.read_bytes()
+                dest.write_bytes(content.replace(source, target))
+                shutil.copymode(src, dest)
+            else:
+                try:
+                    os.link(src, dest)
+                except OSError:
+                    # e.g. venv_path is on another filesystem
+                    shutil.copy2(src, dest)
+
+
 def get_python_command(venv_path: os.PathLike) -> list[str]:
     venv_path = Path(venv_path).resolve()
     if os.name == "nt":
@@ -61,49 +456,560 @@ def get_python_command(venv_path: os.PathLike) -> list[str]:
     return str(executable)
 
 
-def has_installed(config_path: os.PathLike):
+def get_distributions(venv_path: os.PathLike) -> dict[str, str]:
+    """
+    Map the normalized names of distributions installed in a venv to their
+    versions
+    """
+    distributions = {}
+    for site_packages in get_site_packages(venv_path):
+        for dist_info in site_packages.glob("*.dist-info"):
+            name, _, version = dist_info.stem.partition("-")
+            distributions[normalize_name(name)] = version
+    return distributions
+
+
+def get_new_distributions(venv_path: os.PathLike, before: dict[str, str]):
+    """
+    Map distributions installed in a venv since get_distributions returned
+    before to their versions, not including those installed from a local
+    folder such as the index itself
+    """
+    distributions = {}
+    for site_packages in get_site_packages(venv_path):
+        for dist_info in site_packages.glob("*.dist-info"):
+            name, _, version = dist_info.stem.partition("-")
+            name = normalize_name(name)
+            if before.get(name) == version:
+                continue
+            try:
+                with open(dist_info / "direct_url.json") as f:
+                    if "dir_info" in json.load(f):
+                        continue
+            except (FileNotFoundError, ValueError):
+                pass
+            distributions[name] = version
+    return distributions
+
+
+def get_base_layer(
+    packages: list[str],
+    venv_path: os.PathLike,
+    installer: str | None = None,
+    wheelhouse: os.PathLike | None = None,
+) -> Path:
+    """
+    Return a venv with packages installed for the interpreter of venv_path,
+    creating it if no index on the host has used the same layer before
+    """
+    installer = get_installer(installer)
+    layer_key = json.dumps([sorted(packages), get_python_version(venv_path)])
+    layer_name = hashlib.sha256(layer_key.encode()).hexdigest()[:16]
+    base_path = BASE_LAYER_DIR / layer_name
+    if base_path.exists():
+        return base_path
+
+    # The layer is built aside and moved into place once complete. Only its
+    # site-packages are used, so scripts pointing at the build path are fine
+    BASE_LAYER_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = base_path.with_name(f"{layer_name}.{os.getpid()}")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    init_venv(
+        tmp_path, sys_executable=get_python_command(venv_path), installer=installer
+    )
+    subprocess.check_call(
+        get_install_command(tmp_path, installer, wheelhouse) + list(packages)
+    )
+    compile_bytecode(tmp_path, get_site_packages(tmp_path))
+    try:
+        os.rename(tmp_path, base_path)
+    except OSError:
+        # Another process completed the same layer first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    logger.info(f"Created base layer {base_path} with {', '.join(packages)}")
+    return base_path
+
+
+def link_base_layer(venv_path: os.PathLike, base_path: os.PathLike | None) -> bool:
+    """
+    Chain the site-packages of base_path after those of venv_path with a .pth
+    file, or remove the chain if base_path is None
+
+    Returns whether the layer of venv_path changed.
+    """
+    pth_paths = [p / BASE_LAYER_FILE for p in get_site_packages(venv_path)]
+    if base_path is None:
+        linked = [p for p in pth_paths if p.exists()]
+        for pth_path in linked:
+            pth_path.unlink()
+        return bool(linked)
+    pth_path = pth_paths[0]
+    content = "".join(f"{p}\n" for p in get_site_packages(base_path))
+    if pth_path.exists() and pth_path.read_text() == content:
+        return False
+    pth_path.write_text(content)
+    return True
+
+
+def get_config_files(index_folder: os.PathLike) -> list[str]:
+    return [c for c in SUPPORTED_CONFIGS if (Path(index_folder) / c).exists()]
+
+
+def get_deps_hash(index_folder: os.PathLike) -> str:
+    """
+    Hash every file that determines the dependencies of an index
+    """
+    index_folder = Path(index_folder)
+    digest = hashlib.sha256()
+    for config_file in SUPPORTED_CONFIGS + [LOCK_FILENAME]:
+        config_path = index_folder / config_file
+        if config_path.exists():
+            digest.update(f"\0{config_file}\0".encode())
+            digest.update(config_path.read_bytes())
+    return digest.hexdigest()
+
+
+def set_pycache_prefix(venv_path: os.PathLike, pycache_prefix: os.PathLike | None):
+    """
+    Make the venv interpreter keep bytecode under pycache_prefix instead of
+    __pycache__ folders, like PYTHONPYCACHEPREFIX does
+
+    Returns whether the prefix of venv_path changed.
+    """
+    pth_paths = [p / PYCACHE_PREFIX_FILE for p in get_site_packages(venv_path)]
+    if pycache_prefix is None:
+        linked = [p for p in pth_paths if p.exists()]
+        for pth_path in linked:
+            pth_path.unlink()
+        return bool(linked)
+    pth_path = pth_paths[0]
+    # Import lines in .pth files run as the interpreter starts
+    content = (
+        f"import sys; sys.pycache_prefix = {str(Path(pycache_prefix).absolute())!r}\n"
+    )
+    if pth_path.exists() and pth_path.read_text() == content:
+        return False
+    pth_path.write_text(content)
+    return True
+
+
+def compile_bytecode(
+    venv_path: os.PathLike, paths: list[os.PathLike], exclude: str | None = None
+):
+    """
+    Compile sources under paths with the venv interpreter, so that workers do
+    not compile them on first import
+
+    Up to date bytecode is skipped, and sources that fail to compile are left
+    to fail on import instead.
+    """
+    command = [get_python_command(venv_path), "-m", "compileall", "-q", "-j", "0"]
+    if exclude:
+        command += ["-x", exclude]
+    result = subprocess.run(
+        command + [str(p) for p in paths],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    if result.returncode != 0:
+        logger.warning(f"Unable to compile some sources:\n{result.stdout}")
+
+
+def compile_index(index_folder: os.PathLike, venv_path: os.PathLike):
+    compile_bytecode(
+        venv_path,
+        [index_folder],
+        # Installed packages are compiled separately
+        exclude=rf"[/\\]{re.escape(VENV_NAME)}([/\\]|$)",
+    )
+
+
+def has_installed(index_folder: os.PathLike, hash_path: os.PathLike | None = None):
     """
     Read hash file to check if dependencies have been installed
     """
-    with open(config_path, "rb") as f:
-        config_hash = hashlib.sha256(f.read()).hexdigest()
-    hash_path = config_path.parent / HASH_FILE
+    hash_path = Path(hash_path or Path(index_folder) / HASH_FILE)
     if hash_path.exists():
         with open(hash_path) as f:
-            return config_hash == f.read().strip()
+            return get_deps_hash(index_folder) == f.read().strip()
     else:
         return False
 
 
-def write_hash(config_path: os.PathLike):
+def write_hash(index_folder: os.PathLike, hash_path: os.PathLike | None = None):
     """
     Write hash file once dependencies have been installed
     """
-    with open(config_path, "rb") as f:
-        config_hash = hashlib.sha256(f.read()).hexdigest()
-    hash_path = config_path.parent / HASH_FILE
+    hash_path = hash_path or Path(index_folder) / HASH_FILE
     with open(hash_path, "w") as f:
-        f.write(config_hash)
+        f.write(get_deps_hash(index_folder))
+
+
+def normalize_name(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def parse_requirements(text: str) -> dict[str, str]:
+    """
+    Map the names of pinned requirements to their versions
+    """
+    requirements = {}
+    for line in text.splitlines():
+        line = line.split("#")[0].split(";")[0].strip()
+        if "==" in line:
+            name, _, version = line.partition("==")
+            requirements[normalize_name(name)] = version.split()[0]
+    return requirements
 
 
-def install_venv_deps(index_folder: os.PathLike):
+def resolve_deps(
+    index_folder: os.PathLike,
+    config_files: list[str],
+    installer: str = "pip",
+    wheelhouse: os.PathLike | None = None,
+    venv: str = VENV_NAME,
+) -> dict[str, str]:
+    """
+    Resolve the full set of distributions the config files of an index
+    depend on, not including the index itself
+    """
     index_folder = Path(index_folder)
+    if LOCK_FILENAME in config_files:
+        return parse_requirements((index_folder / LOCK_FILENAME).read_text())
+
+    python = get_python_command(index_folder / venv)
+    index_args = ["--no-index", "--find-links", str(wheelhouse)] if wheelhouse else []
+    if installer == "uv":
+        output = subprocess.check_output(
+            ["uv", "pip", "compile", "--quiet", "--no-header", "--no-annotate"]
+            + ["--python", python]
+            + index_args
+            + config_files,
+            cwd=index_folder,
+            text=True,
+        )
+        return parse_requirements(output)
+    report = subprocess.check_output(
+        [python, "-m", "pip", "install", "--dry-run", "--ignore-installed"]
+        + ["--quiet", "--report", "-"]
+        + index_args
+        + get_install_specs(config_files),
+        cwd=index_folder,
+    )
+    return {
+        normalize_name(item["metadata"]["name"]): item["metadata"]["version"]
+        for item in json.loads(report)["install"]
+        # Skip the index itself
+        if "dir_info" not in item.get("download_info", {})
+    }
 
-    for config_file in SUPPORTED_CONFIGS:
-        config_path = index_folder / config_file
-        if config_path.exists():
-            # Check if already installed
-            if has_installed(config_path):
-                return "Already installed"
-            pip_command = get_pip_command(index_folder / VENV_NAME, config_file)
+
+def load_resolved(venv_path: os.PathLike) -> dict[str, str] | None:
+    """
+    Read the distributions last installed in a venv from its config files
+    """
+    try:
+        with open(Path(venv_path) / RESOLVED_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_resolved(venv_path: os.PathLike, resolved: dict[str, str]):
+    with open(Path(venv_path) / RESOLVED_FILE, "w") as f:
+        json.dump(resolved, f, indent=2, sort_keys=True)
+
+
+def get_git_commit(index_folder: os.PathLike) -> str | None:
+    """
+    Return the commit checked out in index_folder, if it is a git repo
+    """
+    try:
+        return Repo(index_folder).head.commit.hexsha
+    except (InvalidGitRepositoryError, NoSuchPathError, ValueError):
+        return None
+
+
+def get_python_version(venv_path: os.PathLike) -> str | None:
+    """
+    Read the interpreter version of a venv from its pyvenv.cfg
+    """
+    config_path = Path(venv_path) / "pyvenv.cfg"
+    if not config_path.exists():
+        return None
+    config = {}
+    with open(config_path) as f:
+        for line in f:
+            key, _, value = line.partition("=")
+            config[key.strip()] = value.strip()
+    return config.get("version_info") or config.get("version")
+
+
+def get_module_hash(index_folder: os.PathLike, module_name: str) -> str | None:
+    """
+    Hash the source file of a module within index_folder
+    """
+    module_path = get_module_path(index_folder, module_name)
+    if module_path is None:
+        return None
+    with open(module_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_signature_cache_key(index_folder: os.PathLike, venv: str = VENV_NAME):
+    """
+    Identify everything outside of tool modules that signatures depend on
+    """
+    index_folder = Path(index_folder)
+    hash_path = index_folder / HASH_FILE
+    deps_hash = hash_path.read_text().strip() if hash_path.exists() else None
+    return (
+        SIGNATURE_SCHEMA_VERSION,
+        get_git_commit(index_folder),
+        deps_hash,
+        get_python_version(index_folder / venv),
+    )
+
+
+def load_signature_cache(index_folder: os.PathLike, cache_key: tuple) -> dict:
+    """
+    Read cached signatures, discarding them if cache_key has changed
+    """
+    cache_path = Path(index_folder) / SIGNATURE_CACHE_FILE
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception:
+        logger.warning(f"Ignoring invalid signature cache {cache_path}")
+        return {}
+    if cache.get("key") != list(cache_key):
+        return {}
+    return cache.get("tools", {})
+
+
+def write_signature_cache(index_folder: os.PathLike, cache_key: tuple, tools: dict):
+    """
+    Write signatures keyed by tool_id, each stored with the hash of its
+    module
+    """
+    cache_path = Path(index_folder) / SIGNATURE_CACHE_FILE
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}")
+    with open(tmp_path, "w") as f:
+        json.dump({"key": cache_key, "tools": tools}, f)
+    # Concurrent processes never read a partially written cache
+    os.replace(tmp_path, cache_path)
+
+
+def load_published_signatures(index_folder: os.PathLike) -> dict:
+    """
+    Read signatures shipped with the index, in the same form as cache entries
+    """
+    signatures_path = Path(index_folder) / SIGNATURES_FILENAME
+    try:
+        with open(signatures_path) as f:
+            published = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception:
+        logger.warning(f"Ignoring invalid signature file {signatures_path}")
+        return {}
+    if published.get("schema_version") != SIGNATURE_SCHEMA_VERSION:
+        logger.warning(
+            f"Ignoring {signatures_path} with unsupported schema version "
+            f"{published.get('schema_version')}"
+        )
+        return {}
+    modules = published.get("modules", {})
+    return {
+        tool_id: {
+            "module_hash": modules.get(tool_id.rsplit(".", 1)[0]),
+            "signature": tool_sig,
+        }
+        for tool_id, tool_sig in published.get("tools", {}).items()
+    }
+
+
+def publish_signatures(
+    index_folder: os.PathLike,
+    venv: str = VENV_NAME,
+    env_var: dict | None = None,
+) -> Path:
+    """
+    Extract the signatures of every tool in the manifest and write them to
+    SIGNATURES_FILENAME, together with the hash of each tool module, so that
+    loading the index does not need to introspect tools
+    """
+    index_folder = Path(index_folder)
+    with open(index_folder / TOOLS_CONFIG_FILENAME, "rb") as file:
+        manifest = tomllib.load(file)["index"]
+    tool_ids = manifest.get("tools", [])
+    signatures, errors = get_tool_signatures(
+        tool_ids, index_folder, venv=venv, env_var=env_var
+    )
+    if errors:
+        raise RuntimeError("\n\n".join(errors.values()))
+    modules = {}
+    for tool_id in tool_ids:
+        module_name = tool_id.rsplit(".", 1)[0]
+        modules[module_name] = get_module_hash(index_folder, module_name)
+
+    signatures_path = index_folder / SIGNATURES_FILENAME
+    with open(signatures_path, "w") as f:
+        json.dump(
+            {
+                "schema_version": SIGNATURE_SCHEMA_VERSION,
+                "modules": modules,
+                "tools": {tool_id: signatures[tool_id] for tool_id in tool_ids},
+            },
+            f,
+            indent=2,
+        )
+        f.write("\n")
+    return signatures_path
+
+
+def install_venv_deps(
+    index_folder: os.PathLike,
+    installer: str | None = None,
+    package_store: bool = False,
+    base_layer: list[str] | None = None,
+    wheelhouse: os.PathLike | None = None,
+    precompile: bool = True,
+    pycache_prefix: os.PathLike | None = None,
+):
+    index_folder = Path(index_folder)
+    venv_path = index_folder / VENV_NAME
+    if wheelhouse is not None:
+        wheelhouse = get_wheelhouse(wheelhouse)
+    prefix_changed = set_pycache_prefix(venv_path, pycache_prefix)
+
+    base_path = (
+        get_base_layer(base_layer, venv_path, installer, wheelhouse)
+        if base_layer
+        else None
+    )
+    if link_base_layer(venv_path, base_path):
+        # Dependencies provided by the previous layer may now be missing
+        for path in [index_folder / HASH_FILE, venv_path / HASH_FILE]:
+            path.unlink(missing_ok=True)
+        (venv_path / RESOLVED_FILE).unlink(missing_ok=True)
+
+    config_files = get_config_files(index_folder)
+    if not config_files:
+        return
+    # Check if already installed
+    if has_installed(index_folder):
+        if precompile and prefix_changed:
+            compile_bytecode(venv_path, get_site_packages(venv_path))
+            compile_index(index_folder, venv_path)
+        return "Already installed"
+    if has_installed(index_folder, venv_path / HASH_FILE):
+        # The venv is shared with another version of the index
+        write_hash(index_folder)
+        if precompile:
+            compile_index(index_folder, venv_path)
+        return "Already installed"
+    installer = get_installer(installer)
+    if installer == "pip":
+        ensure_pip(venv_path)
+    if wheelhouse is not None and (index_folder / LOCK_FILENAME).exists():
+        # Dependencies are installed as locked, and the index itself without
+        # them if it is a package
+        config_files = [LOCK_FILENAME] + [
+            c for c in config_files if c in PACKAGE_CONFIGS
+        ]
+
+    installed = load_resolved(venv_path)
+    pip_command = None
+    removed = []
+    if installed is None:
+        before = get_distributions(venv_path)
+        pip_command = get_pip_command(venv_path, config_files, installer, wheelhouse)
+        subprocess.check_call(
+            pip_command,
+            cwd=index_folder,
+        )
+        # What was installed is recorded instead of resolving it separately
+        resolved = get_new_distributions(venv_path, before)
+    else:
+        # Only distributions that changed since the last install are updated
+        resolved = resolve_deps(index_folder, config_files, installer, wheelhouse)
+        removed = [name for name in installed if name not in resolved]
+        changed = [
+            f"{name}=={version}"
+            for name, version in resolved.items()
+            if installed.get(name) != version
+        ]
+        if any(c in PACKAGE_CONFIGS for c in config_files):
+            # The metadata of the index itself may have changed
+            changed.append(".")
+        if removed:
+            subprocess.check_call(get_uninstall_command(venv_path, installer) + removed)
+        if changed:
+            pip_command = get_install_command(venv_path, installer, wheelhouse) + [
+                "--no-deps",
+                *changed,
+            ]
             subprocess.check_call(
                 pip_command,
                 cwd=index_folder,
             )
-            write_hash(config_path)
-            message = f'Installed with "{" ".join(pip_command)}"'
-            logger.info(message)
-            return message
+    write_resolved(venv_path, resolved)
+    if base_path and installer == "uv":
+        # uv does not consider packages on .pth paths installed, so
+        # copies of packages from the base layer are removed again
+        base_distributions = get_distributions(base_path)
+        duplicates = [
+            name
+            for name, version in get_distributions(venv_path).items()
+            if base_distributions.get(name) == version
+        ]
+        if duplicates:
+            subprocess.check_call(
+                get_uninstall_command(venv_path, installer) + duplicates
+            )
+    if package_store and installer == "pip":
+        # uv already links installed files from its own cache
+        saved = link_venv(venv_path)
+        logger.info(f"Linked {saved} bytes to package store")
+    if precompile:
+        compile_bytecode(venv_path, get_site_packages(venv_path))
+        compile_index(index_folder, venv_path)
+    write_hash(index_folder)
+    write_hash(index_folder, venv_path / HASH_FILE)
+    # Running workers imported the previous dependencies
+    close_workers(index_folder)
+    messages = []
+    if removed:
+        messages.append(f"Uninstalled {', '.join(removed)}")
+    if pip_command:
+        messages.append(f'Installed with "{" ".join(pip_command)}"')
+    message = "; ".join(messages) or "Up to date"
+    logger.info(message)
+    return message
+
+
+def get_tool_timeout(
+    tool_id: str, manifest: dict, timeout: float | None = None
+) -> float | None:
+    """
+    Return the timeout of a tool, declared by the index per tool or for the
+    whole index. An index may shorten the timeout of the caller, but never
+    extend it.
+    """
+    declared = manifest.get("timeouts", {}).get(tool_id, manifest.get("timeout"))
+    return min_timeout(declared, timeout)
+
+
+def min_timeout(*timeouts: float | None) -> float | None:
+    """
+    Return the shortest of timeouts, where None means no timeout
+    """
+    timeouts = [t for t in timeouts if t is not None]
+    return min(timeouts) if timeouts else None
 
 
 def init_venv_tools(
@@ -111,6 +1017,10 @@ def init_venv_tools(
     env_var: dict | None = None,
     include: list[str] | None = None,
     exclude: list[str] | None = None,
+    executor: str = DEFAULT_EXECUTOR,
+    timeout: float | None = None,
+    static_signatures: bool = False,
+    allow_pickle: bool = True,
 ):
     index_folder = Path(index_folder)
     env_var = env_var or {}
@@ -120,22 +1030,98 @@ def init_venv_tools(
     index_manifest = index_folder / TOOLS_CONFIG_FILENAME
     with open(index_manifest, "rb") as file:
         manifest = tomllib.load(file)["index"]
+    codec = manifest.get("codec", DEFAULT_CODEC)
+    if codec not in CODECS:
+        raise ValueError(f"Unsupported codec in {index_manifest}: {codec}")
+    if codec == "pickle" and not allow_pickle:
+        # Unpickling results runs code chosen by the index
+        raise ValueError(
+            f"Index {index_folder} uses the pickle codec, which needs allow_pickle=True"
+        )
 
-    tools = []
-    for tool_id in include or manifest.get("tools", []):
-        if tool_id in exclude:
-            continue
-        tool_sig = get_tool_signature(
-            tool_id=tool_id,
+    if executor == "forkserver":
+        # Start the fork server with tool modules and declared heavy
+        # dependencies imported so that calls are forked from a warm process
+        modules = [".".join(t.split(".")[:-1]) for t in manifest.get("tools", [])]
+        get_fork_server(
+            get_python_command(index_folder / VENV_NAME),
+            index_folder,
+            env_var=env_var,
+            preload=list(dict.fromkeys(manifest.get("preload", []) + modules)),
+        )
+
+    # Signatures published with the index are used as long as tool modules
+    # are unchanged, otherwise they are only extracted again when the index
+    # has changed
+    published = load_published_signatures(index_folder)
+    cache_key = get_signature_cache_key(index_folder)
+    cached = load_signature_cache(index_folder, cache_key)
+    updated = {}
+
+    tool_ids = [t for t in include or manifest.get("tools", []) if t not in exclude]
+    signatures = {}
+    module_hashes = {}
+    for tool_id in tool_ids:
+        module_hash = get_module_hash(index_folder, tool_id.rsplit(".", 1)[0])
+        for source in (published, cached):
+            entry = source.get(tool_id)
+            if entry and module_hash and entry["module_hash"] == module_hash:
+                signatures[tool_id] = entry["signature"]
+                break
+        else:
+            module_hashes[tool_id] = module_hash
+            if tool_id in published:
+                logger.warning(
+                    f"Published signature of {tool_id} does not match its source"
+                )
+    if manifest.get("static_signatures", static_signatures) and module_hashes:
+        # Read what signatures we can from source without starting the venv
+        # interpreter, leaving the rest to the dynamic runner
+        extracted = get_static_signatures(
+            list(module_hashes),
+            index_folder,
+            python_version=get_python_version(index_folder / VENV_NAME),
+        )
+        signatures.update(extracted)
+        for tool_id, tool_sig in extracted.items():
+            updated[tool_id] = {
+                "module_hash": module_hashes.pop(tool_id),
+                "signature": tool_sig,
+            }
+    errors = {}
+    if module_hashes:
+        # Remaining signatures are extracted together in one subprocess
+        extracted, errors = get_tool_signatures(
+            list(module_hashes),
             index_folder=index_folder,
             venv=VENV_NAME,
             env_var=env_var,
         )
+        signatures.update(extracted)
+        for tool_id, tool_sig in extracted.items():
+            updated[tool_id] = {
+                "module_hash": module_hashes[tool_id],
+                "signature": tool_sig,
+            }
+    if updated:
+        try:
+            write_signature_cache(index_folder, cache_key, {**cached, **updated})
+        except OSError:
+            logger.warning(f"Unable to cache signatures in {index_folder}")
+    if errors:
+        raise RuntimeError("\n\n".join(errors.values()))
+
+    tools = []
+    for tool_id in tool_ids:
+        tool_sig = signatures[tool_id]
         tool = parse_tool_signature(
             signature_dict=tool_sig,
             index_folder=index_folder,
             venv=VENV_NAME,
             env_var=env_var,
+            executor=executor,
+            codec=codec,
+            timeout=get_tool_timeout(tool_id, manifest, timeout),
         )
         tools.append(tool)
     return tools
@@ -147,131 +1133,114 @@ def get_tool_signature(
     index_folder: os.PathLike,
     venv: str = VENV_NAME,
     env_var: dict | None = None,
+    transport: str | None = None,
+    timeout: float | None = SIGNATURE_TIMEOUT,
 ):
-    module_name = ".".join(tool_id.split(".")[:-1])
-    tool_name = tool_id.split(".")[-1]
+    signatures, errors = get_tool_signatures(
+        [tool_id],
+        index_folder,
+        venv=venv,
+        env_var=env_var,
+        transport=transport,
+        timeout=timeout,
+    )
+    if tool_id in errors:
+        raise RuntimeError(errors[tool_id])
+    return signatures[tool_id]
+
+
+def get_tool_signatures(
+    tool_ids: list[str],
+    index_folder: os.PathLike,
+    venv: str = VENV_NAME,
+    env_var: dict | None = None,
+    transport: str | None = None,
+    timeout: float | None = SIGNATURE_TIMEOUT,
+) -> tuple[dict[str, dict], dict[str, str]]:
+    """
+    Extract the signatures of tool_ids in a single subprocess, importing each
+    module once
+
+    Returns signatures and error messages, each keyed by tool_id, so that a
+    broken tool does not prevent loading the others.
+    """
     env_var = env_var or {}
 
     # We use sockets to pass pass function metadata
-    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    listener.bind(("localhost", 0))
-    listener.listen(1)
-    _, port = listener.getsockname()
+    channel = Transport(transport)
 
     runner = f"""
-import pickle, sys, traceback, inspect, enum, socket
-from typing import Any, Dict, List, Literal, Tuple, Union, get_args, get_origin, get_type_hints
-import types as T
+import importlib, traceback
 
+{RUNTIME_IMPORT}
 
-def extract_type_info(typ, custom_types: list[str] | None = None):
-    custom_types = custom_types or []
-    if hasattr(typ, "__name__") and typ.__name__ in custom_types:
-        return typ.__name__
-    origin = get_origin(typ)
-    args = list(get_args(typ))
-    if origin is Literal:
-        return {{"type": "Literal", "values": args}}
-    elif inspect.isclass(typ) and issubclass(typ, enum.Enum):
-        custom_types.append(typ.__name__)
-        return {{
-            "type": "Enum",
-            "type_name": typ.__name__,
-            "values": {{v.name: v.value for v in typ}},
-        }}
-    elif isinstance(typ, type) and typ.__class__.__name__ == "_TypedDictMeta":
-        custom_types.append(typ.__name__)
-        hints = get_type_hints(typ)
-        return {{
-            "type": "TypedDict",
-            "type_name": typ.__name__,
-            "fields": {{k: extract_type_info(v, custom_types) for k, v in hints.items()}}
-        }}
-    elif origin in (list, List) or typ is list:
-        return {{
-            "type": "List",
-            "item_type": extract_type_info(args[0], custom_types) if args else {{"type": Any}}
-        }}
-    elif origin in (dict, Dict) or typ is dict:
-        return {{
-            "type": "Dict",
-            "key_type": extract_type_info(args[0], custom_types) if args else {{"type": Any}},
-            "value_type": extract_type_info(args[1], custom_types) if len(args) > 1 else {{"type": Any}}
-        }}
-    elif origin in (tuple, Tuple) or typ is tuple:
-        return {{
-            "type": "Tuple",
-            "item_types": [extract_type_info(arg, custom_types) for arg in args] if args else [{{"type": Any}}]
-        }}
-    elif origin is Union or origin is T.UnionType:
-        return {{
-            "type": "Union",
-            "options": [extract_type_info(arg, custom_types) for arg in args]
-        }}
-    else:
-        return {{"type": typ}}
-
-try:
-    from {module_name} import {tool_name}
-    func = {tool_name}
-    sig = inspect.signature(func)
-    hints = get_type_hints(func)
-    params = {{}}
-    for name, param in sig.parameters.items():
-        hint = hints.get(name, param.annotation)
-        param_info = extract_type_info(hint)
-        param_info["kind"] = param.kind
-        param_info["default"] = param.default
-        params[name] = param_info
-    return_type = hints.get('return', sig.return_annotation)
-    return_info = extract_type_info(return_type)
-
-    payload = {{
-        "ok": True,
-        "result": {{
-            "tool_id": "{tool_id}",
-            "params": params,
-            "return": return_info,
-            "iscoroutinefunction": inspect.iscoroutinefunction(func),
-            "isgeneratorfunction": inspect.isgeneratorfunction(func),
-            "isasyncgenfunction": inspect.isasyncgenfunction(func),
-            "doc": inspect.getdoc(func),
-        }},
-    }}
-except Exception as e:
-    payload = {{"ok": False, "error": traceback.format_exc()}}
-
-with socket.create_connection(("localhost", {port})) as s:
-    s.sendall(pickle.dumps(payload))
+with runtime.connect("{channel.address}") as s:
+    for tool_id in {list(tool_ids)!r}:
+        module_name, _, tool_name = tool_id.rpartition(".")
+        try:
+            # Modules are cached in sys.modules so each one is only imported once
+            func = getattr(importlib.import_module(module_name), tool_name)
+            result = runtime.get_signature(tool_id, func)
+            payload = {{"tool_id": tool_id, "ok": True, "result": result}}
+        except Exception as e:
+            payload = {{"tool_id": tool_id, "ok": False, "error": traceback.format_exc()}}
+        runtime.send_message(s, payload)
+    runtime.send_message(s, {{"done": True}})
 """
-    proc = subprocess.Popen(
-        [get_python_command(Path(index_folder) / venv), "-c", runner],
-        cwd=index_folder,
-        env=env_var or None,
-    )
-
-    conn, _ = listener.accept()
-    with conn:
-        data = b""
-        while True:
-            chunk = conn.recv(4096)
-            if not chunk:
-                break
-            data += chunk
-
-    listener.close()
-    proc.wait()
-
+    stderr = StderrTail()
     try:
-        response = pickle.loads(data)
-    except ModuleNotFoundError as e:
-        raise RuntimeError(
-            f"Error loading tool {tool_id}:\nThe tool most likely has a parameter of a custom type that cannot be exported"
-        ) from e
-    if response.get("ok"):
-        return response["result"]
-    else:
-        raise RuntimeError(f"Error loading tool {tool_id}:\n{response['error']}")
+        proc = subprocess.Popen(
+            [get_python_command(Path(index_folder) / venv), "-c", runner],
+            cwd=index_folder,
+            stderr=stderr.write_fd,
+            env=env_var or None,
+            pass_fds=channel.pass_fds,
+        )
+    except Exception:
+        channel.close()
+        stderr.close()
+        raise
+    stderr.start()
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    responses = {}
+    finished = False
+    try:
+        with channel.accept(timeout=timeout, exit_code=proc.poll) as conn:
+            reader = MessageReader(conn)
+            while not finished:
+                msg = reader.read(timeout=remaining(deadline))
+                if msg is None:
+                    break
+                finished = bool(msg.get("done"))
+                if "tool_id" in msg:
+                    responses[msg["tool_id"]] = msg
+    except ChildProcessError:
+        pass
+    except TimeoutError:
+        raise TimeoutError(
+            f"Loading tools {', '.join(tool_ids)} timed out after {timeout}s"
+        ) from None
+    finally:
+        if proc.poll() is None and not finished:
+            proc.kill()
+        proc.wait()
+
+    signatures = {}
+    errors = {}
+    for tool_id in tool_ids:
+        response = responses.get(tool_id)
+        if response is None:
+            errors[tool_id] = process_error(
+                f"Error loading tool {tool_id}:\nSubprocess exited without a response",
+                proc.returncode,
+                stderr,
+            )
+        elif not response["ok"]:
+            errors[tool_id] = f"Error loading tool {tool_id}:\n{response['error']}"
+        else:
+            signatures[tool_id] = response["result"]
+    return signatures, errors
 
 
 def parse_param_type(param_info: dict, custom_types: list[str] | None = None):
@@ -280,8 +1249,8 @@ def parse_param_type(param_info: dict, custom_types: list[str] | None = None):
     param_type = param_info["type"]
     if param_type in custom_types:
         return param_type
-    if not isinstance(param_type, str):
-        return param_type
+    if param_type in TYPES:
+        return TYPES[param_type]
     if param_type == "Literal":
         return Literal.__getitem__(tuple(param_info["values"]))
     elif param_type == "Enum":
@@ -317,17 +1286,27 @@ def parse_tool_signature(
     index_folder: os.PathLike,
     venv: str = VENV_NAME,
     env_var: dict | None = None,
+    executor: str = DEFAULT_EXECUTOR,
+    codec: str = DEFAULT_CODEC,
+    timeout: float | None = None,
 ):
     """
     Create a wrapper function that replicates the remote tool
     given its signature
+
+    Calls are bounded by timeout, and by the timeout passed to the execute
+    methods of an index if that is shorter.
     """
     env_var = env_var or {}
+    schema_version = signature_dict.get("schema_version")
+    if schema_version != SIGNATURE_SCHEMA_VERSION:
+        raise ValueError(
+            f"Unsupported signature schema version {schema_version} for {signature_dict.get('tool_id')}, expected {SIGNATURE_SCHEMA_VERSION}"
+        )
 
     if signature_dict.get("isasyncgenfunction"):
 
         async def func_handler(*args, **kwargs):
-            # TODO: Make this truly async
             async for value in run_remote_tool(
                 tool_id=signature_dict["tool_id"],
                 index_folder=index_folder,
@@ -336,59 +1315,39 @@ def parse_tool_signature(
                 venv=venv,
                 env_var=env_var,
                 stream=True,
+                executor=executor,
+                codec=codec,
+                timeout=min_timeout(timeout, CALL_TIMEOUT.get()),
             ):
                 yield value
     elif signature_dict.get("isgeneratorfunction"):
 
         def func_handler(*args, **kwargs):
-            q = queue.Queue()
-            sentinel = object()
-
-            def run():
-                async def runner():
-                    try:
-                        async for item in run_remote_tool(
-                            tool_id=signature_dict["tool_id"],
-                            index_folder=index_folder,
-                            args=args,
-                            kwargs=kwargs,
-                            venv=venv,
-                            env_var=env_var,
-                            stream=True,
-                        ):
-                            q.put(item)
-                    except Exception as e:
-                        q.put(e)
-                    finally:
-                        q.put(sentinel)
-
-                asyncio.run(runner())
-
-            t = threading.Thread(target=run)
-            t.start()
-
-            while True:
-                item = q.get()
-                if item is sentinel:
-                    break
-                elif isinstance(item, Exception):
-                    raise item
-                else:
-                    yield item
-
-            t.join()
+            yield from stream_remote_tool(
+                tool_id=signature_dict["tool_id"],
+                index_folder=index_folder,
+                args=args,
+                kwargs=kwargs,
+                venv=venv,
+                env_var=env_var,
+                executor=executor,
+                codec=codec,
+                timeout=min_timeout(timeout, CALL_TIMEOUT.get()),
+            )
 
     elif signature_dict.get("iscoroutinefunction"):
 
         async def func_handler(*args, **kwargs):
-            # TODO: Make this truly async
-            return run_remote_tool(
+            return await arun_remote_tool(
                 tool_id=signature_dict["tool_id"],
                 index_folder=index_folder,
                 args=args,
                 kwargs=kwargs,
                 venv=venv,
                 env_var=env_var,
+                executor=executor,
+                codec=codec,
+                timeout=min_timeout(timeout, CALL_TIMEOUT.get()),
             )
     else:
 
@@ -400,6 +1359,9 @@ def parse_tool_signature(
                 kwargs=kwargs,
                 venv=venv,
                 env_var=env_var,
+                executor=executor,
+                codec=codec,
+                timeout=min_timeout(timeout, CALL_TIMEOUT.get()),
             )
 
     # Reconstruct signature from list of args
@@ -408,8 +1370,8 @@ def parse_tool_signature(
         params.append(
             inspect.Parameter(
                 name=param_name,
-                kind=param_info["kind"],
-                default=param_info["default"],
+                kind=PARAMETER_KINDS[param_info["kind"]],
+                default=param_info.get("default", inspect.Parameter.empty),
                 annotation=parse_param_type(param_info),
             )
         )
@@ -426,6 +1388,291 @@ def parse_tool_signature(
     return func
 
 
+def _tool_runner(
+    tool_id: str,
+    index_folder: os.PathLike,
+    address: str,
+    codec: str = DEFAULT_CODEC,
+    shared_memory_threshold: int | None = DEFAULT_SHARED_MEMORY_THRESHOLD,
+) -> str:
+    """
+    Script that runs a single tool call in a fresh interpreter, receiving
+    args and kwargs as the first message from address and sending results
+    back to it
+    """
+    return f"""
+import sys
+sys.path.insert(0, "{index_folder}")
+
+{RUNTIME_IMPORT}
+
+with runtime.connect("{address}") as sock:
+    runtime.run_tool(sock, "{tool_id}", "{codec}", {shared_memory_threshold!r})
+"""
+
+
+def _subprocess_messages(
+    tool_id: str,
+    index_folder: os.PathLike,
+    args: list,
+    kwargs: dict,
+    venv: str = VENV_NAME,
+    env_var: dict | None = None,
+    transport: str | None = None,
+    codec: str = DEFAULT_CODEC,
+    shared_memory_threshold: int | None = DEFAULT_SHARED_MEMORY_THRESHOLD,
+    timeout: float | None = None,
+    stream: bool = False,
+    fork_server: ForkServer | None = None,
+):
+    """
+    Run a tool in a fresh interpreter, or a child forked by fork_server, and
+    yield its messages
+
+    Messages are read from the socket as they are consumed, so a slow
+    consumer blocks the tool once the socket buffer is full. TimeoutError is
+    raised if the call takes longer than timeout seconds, or with stream set,
+    if the tool takes longer than timeout seconds to produce a message.
+    """
+    # We use sockets to pass function output
+    channel = Transport("socketpair" if fork_server else transport)
+    stderr = StderrTail()
+    try:
+        if fork_server:
+            proc = fork_server.fork(
+                tool_id,
+                channel.pass_fds[0],
+                stderr.write_fd,
+                codec,
+                shared_memory_threshold,
+            )
+        else:
+            proc = subprocess.Popen(
+                [
+                    get_python_command(Path(index_folder) / venv),
+                    "-c",
+                    _tool_runner(
+                        tool_id,
+                        index_folder,
+                        channel.address,
+                        codec,
+                        shared_memory_threshold,
+                    ),
+                ],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=stderr.write_fd,
+                env=env_var or None,
+                pass_fds=channel.pass_fds,
+            )
+    except Exception:
+        channel.close()
+        stderr.close()
+        raise
+    stderr.start()
+
+    deadline = None if stream or timeout is None else time.monotonic() + timeout
+
+    def wait_time():
+        return timeout if stream else remaining(deadline)
+
+    finished = False
+    shared_paths = []
+    try:
+        # Fail as soon as the child exits instead of waiting for it
+        with channel.accept(timeout=wait_time(), exit_code=proc.poll) as conn:
+            send_message(
+                conn,
+                {"args": args, "kwargs": kwargs},
+                codec,
+                shared_memory_threshold,
+                shared_paths,
+            )
+            reader = MessageReader(conn, codec)
+            while not finished:
+                msg = reader.read(timeout=wait_time())
+                if msg is None:
+                    break
+                finished = "error" in msg or bool(msg.get("done"))
+                yield msg
+    except ChildProcessError:
+        pass
+    except TimeoutError:
+        raise TimeoutError(f"Tool {tool_id} timed out after {timeout}s") from None
+    finally:
+        channel.close()
+        if not finished and proc.poll() is None:
+            # Call was abandoned or timed out - it is no longer wanted
+            proc.kill()
+        proc.wait()
+        remove_shared(proc.pid)
+        # Params the child did not read before exiting
+        unlink_shared(shared_paths)
+    if not finished:
+        yield {
+            "ok": False,
+            "error": process_error(
+                "Subprocess exited unexpectedly", proc.returncode, stderr
+            ),
+        }
+
+
+async def _asubprocess_messages(
+    tool_id: str,
+    index_folder: os.PathLike,
+    args: list,
+    kwargs: dict,
+    venv: str = VENV_NAME,
+    env_var: dict | None = None,
+    transport: str | None = None,
+    codec: str = DEFAULT_CODEC,
+    shared_memory_threshold: int | None = DEFAULT_SHARED_MEMORY_THRESHOLD,
+    timeout: float | None = None,
+    stream: bool = False,
+    fork_server: ForkServer | None = None,
+):
+    """
+    Asynchronous version of _subprocess_messages that does not block the
+    event loop
+    """
+    loop = asyncio.get_running_loop()
+    channel = Transport("socketpair" if fork_server else transport)
+    stderr = StderrTail()
+    try:
+        if fork_server:
+            proc = await loop.run_in_executor(
+                None,
+                fork_server.fork,
+                tool_id,
+                channel.pass_fds[0],
+                stderr.write_fd,
+                codec,
+                shared_memory_threshold,
+            )
+
+            async def wait():
+                return await loop.run_in_executor(None, proc.wait)
+        else:
+            proc = await asyncio.create_subprocess_exec(
+                get_python_command(Path(index_folder) / venv),
+                "-c",
+                _tool_runner(
+                    tool_id,
+                    index_folder,
+                    channel.address,
+                    codec,
+                    shared_memory_threshold,
+                ),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=stderr.write_fd,
+                env=env_var or None,
+                pass_fds=channel.pass_fds,
+            )
+            wait = proc.wait
+    except Exception:
+        channel.close()
+        stderr.close()
+        raise
+    stderr.start()
+
+    deadline = None if stream or timeout is None else time.monotonic() + timeout
+
+    def wait_time():
+        return timeout if stream else remaining(deadline)
+
+    finished = False
+    shared_paths = []
+    try:
+        conn = await channel.aaccept(
+            loop, timeout=wait_time(), exit_code=lambda: proc.returncode
+        )
+        with conn:
+            await asend_message(
+                loop,
+                conn,
+                {"args": args, "kwargs": kwargs},
+                codec,
+                shared_memory_threshold,
+                shared_paths,
+            )
+            reader = MessageReader(conn, codec)
+            while not finished:
+                msg = await asyncio.wait_for(reader.aread(loop), wait_time())
+                if msg is None:
+                    break
+                finished = "error" in msg or bool(msg.get("done"))
+                yield msg
+    except ChildProcessError:
+        pass
+    except (TimeoutError, asyncio.TimeoutError):
+        raise TimeoutError(f"Tool {tool_id} timed out after {timeout}s") from None
+    finally:
+        channel.close()
+        if not finished and proc.returncode is None:
+            # Call was abandoned, cancelled or timed out
+            proc.kill()
+        await wait()
+        remove_shared(proc.pid)
+        unlink_shared(shared_paths)
+    if not finished:
+        yield {
+            "ok": False,
+            "error": process_error(
+                "Subprocess exited unexpectedly", proc.returncode, stderr
+            ),
+        }
+
+
+def _stream_values(messages):
+    try:
+        for msg in messages:
+            if msg.get("ok") and "stream" in msg:
+                yield msg["stream"]
+            elif msg.get("ok") and "result" in msg:
+                yield msg["result"]
+            elif "error" in msg:
+                raise RuntimeError(f"Subprocess error:\n{msg['error']}")
+    finally:
+        messages.close()
+
+
+async def _astream_values(messages):
+    try:
+        async for msg in messages:
+            if msg.get("ok") and "stream" in msg:
+                yield msg["stream"]
+            elif msg.get("ok") and "result" in msg:
+                yield msg["result"]
+            elif "error" in msg:
+                raise RuntimeError(f"Subprocess error:\n{msg['error']}")
+    finally:
+        await messages.aclose()
+
+
+def _fork_server(
+    executor: str,
+    index_folder: os.PathLike,
+    venv: str,
+    env_var: dict,
+    transport: str | None,
+) -> ForkServer | None:
+    """
+    Retrieve the fork server to run calls with, or None when each call
+    starts a fresh interpreter
+    """
+    if executor == "subprocess":
+        return None
+    elif executor != "forkserver":
+        raise ValueError(f"Unsupported executor: {executor}")
+    if transport not in [None, "socketpair"]:
+        # Connections are handed to forked children over a Unix socket
+        raise ValueError("The forkserver executor only supports socketpair")
+    return get_fork_server(
+        get_python_command(Path(index_folder) / venv), index_folder, env_var=env_var
+    )
+
+
 # TODO: Sanitize tool_id, args, and kwargs
 def run_remote_tool(
     tool_id: str,
@@ -435,151 +1682,166 @@ def run_remote_tool(
     venv: str = VENV_NAME,
     env_var: dict | None = None,
     stream: bool = False,
+    executor: str = DEFAULT_EXECUTOR,
+    transport: str | None = None,
+    codec: str = DEFAULT_CODEC,
+    shared_memory_threshold: int | None = DEFAULT_SHARED_MEMORY_THRESHOLD,
+    stream_window: int | None = DEFAULT_STREAM_WINDOW,
+    timeout: float | None = None,
 ):
+    """
+    Run a tool in the index venv
+
+    TimeoutError is raised if the call takes longer than timeout seconds,
+    or with stream set, if the tool takes longer than timeout seconds to
+    produce a value.
+    """
     args = args or []
     kwargs = kwargs or {}
     env_var = env_var or {}
 
-    module_name = ".".join(tool_id.split(".")[:-1])
-    tool_name = tool_id.split(".")[-1]
-    payload = json.dumps(
-        {
-            "args": args,
-            "kwargs": kwargs,
-        }
-    ).encode("utf-8")
+    if executor == "worker":
+        worker = get_worker(
+            get_python_command(Path(index_folder) / venv),
+            index_folder,
+            env_var=env_var,
+            transport=transport,
+            codec=codec,
+            shared_memory_threshold=shared_memory_threshold,
+        )
+        if stream:
+            return worker.astream(
+                tool_id, args, kwargs, window=stream_window, timeout=timeout
+            )
+        else:
+            return worker.call(tool_id, args, kwargs, timeout=timeout)
+
+    options = {
+        "venv": venv,
+        "env_var": env_var,
+        "transport": transport,
+        "codec": codec,
+        "shared_memory_threshold": shared_memory_threshold,
+        "timeout": timeout,
+        "fork_server": _fork_server(executor, index_folder, venv, env_var, transport),
+    }
+    if stream:
+        return _astream_values(
+            _asubprocess_messages(
+                tool_id, index_folder, args, kwargs, stream=True, **options
+            )
+        )
+    result_data = {}
+    for msg in _subprocess_messages(tool_id, index_folder, args, kwargs, **options):
+        collect_response(msg, result_data)
+    return unpack_result(result_data)
 
-    # We use sockets to pass function output
-    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    listener.bind(("localhost", 0))
-    listener.listen(1)
-    _, port = listener.getsockname()
 
-    result_data = {}
+async def arun_remote_tool(
+    tool_id: str,
+    index_folder: os.PathLike,
+    args: list | None = None,
+    kwargs: dict | None = None,
+    venv: str = VENV_NAME,
+    env_var: dict | None = None,
+    executor: str = DEFAULT_EXECUTOR,
+    transport: str | None = None,
+    codec: str = DEFAULT_CODEC,
+    shared_memory_threshold: int | None = DEFAULT_SHARED_MEMORY_THRESHOLD,
+    timeout: float | None = None,
+):
+    """
+    Asynchronous version of run_remote_tool that awaits the result without
+    blocking the event loop, so concurrent calls overlap
 
-    def handle_connection_sync():
-        conn, _ = listener.accept()
-        with conn:
-            buffer = ""
-            while True:
-                chunk = conn.recv(4096).decode("utf-8")
-                if not chunk:
-                    break
-                buffer += chunk
-                while "\n" in buffer:
-                    line, buffer = buffer.split("\n", 1)
-                    if not line.strip():
-                        continue
-                    msg = json.loads(line)
-                    if msg.get("ok") and "stream" in msg:
-                        result_data.setdefault("stream", []).append(msg["stream"])
-                    elif msg.get("ok") and "result" in msg:
-                        result_data["result"] = msg["result"]
-                    elif "error" in msg:
-                        result_data["error"] = msg["error"]
-                    elif msg.get("done"):
-                        return
-
-    async def handle_connection_async():
-        loop = asyncio.get_running_loop()
-        conn, _ = await loop.sock_accept(listener)
-        conn.setblocking(False)
-        buffer = ""
-        try:
-            while True:
-                chunk = await loop.sock_recv(conn, 4096)
-                if not chunk:
-                    break
-                buffer += chunk.decode("utf-8")
-                while "\n" in buffer:
-                    line, buffer = buffer.split("\n", 1)
-                    if not line.strip():
-                        continue
-                    msg = json.loads(line)
-                    if msg.get("ok") and "stream" in msg:
-                        yield msg["stream"]
-                    elif msg.get("ok") and "result" in msg:
-                        yield msg["result"]
-                    elif "error" in msg:
-                        raise RuntimeError(f"Subprocess error:\n{msg['error']}")
-                    elif msg.get("done"):
-                        return
-        finally:
-            conn.close()
-
-    if not stream:
-        thread = threading.Thread(target=lambda: handle_connection_sync())
-        thread.start()
+    Cancelling the awaiting task stops the tool.
+    """
+    args = args or []
+    kwargs = kwargs or {}
+    env_var = env_var or {}
 
-    runner = f"""
-import asyncio, inspect, json, socket, sys, traceback
-sys.path.insert(0, "{index_folder}")
+    if executor == "worker":
+        worker = get_worker(
+            get_python_command(Path(index_folder) / venv),
+            index_folder,
+            env_var=env_var,
+            transport=transport,
+            codec=codec,
+            shared_memory_threshold=shared_memory_threshold,
+        )
+        return await worker.acall(tool_id, args, kwargs, timeout=timeout)
+    fork_server = _fork_server(executor, index_folder, venv, env_var, transport)
 
-def send(sock, payload):
-    sock.sendall((json.dumps(payload) + "\\n").encode("utf-8"))
-
-sock = socket.create_connection(("localhost", {port}))
-
-try:
-    from {module_name} import {tool_name}
-    params = json.load(sys.stdin)
-    args = params.get("args", [])
-    kwargs = params.get("kwargs", {{}})
-
-    func = {tool_name}
-
-    if inspect.isasyncgenfunction(func):
-        async def run():
-            async for value in func(*args, **kwargs):
-                send(sock, {{"ok": True, "stream": value}})
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(run())
-    elif inspect.isgeneratorfunction(func):
-        for value in func(*args, **kwargs):
-            send(sock, {{"ok": True, "stream": value}})
-    elif inspect.iscoroutinefunction(func):
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        result = loop.run_until_complete(func(*args, **kwargs))
-        send(sock, {{"ok": True, "result": result}})
-    else:
-        result = func(*args, **kwargs)
-        send(sock, {{"ok": True, "result": result}})
-    send(sock, {{"done": True}})
-except Exception as e:
-    err = traceback.format_exc()
-    try:
-        send(sock, {{"ok": False, "error": err}})
-    except:
-        pass
-finally:
-    try:
-        sock.close()
-    except:
-        pass
-"""
+    result_data = {}
+    async for msg in _asubprocess_messages(
+        tool_id,
+        index_folder,
+        args,
+        kwargs,
+        venv=venv,
+        env_var=env_var,
+        transport=transport,
+        codec=codec,
+        shared_memory_threshold=shared_memory_threshold,
+        timeout=timeout,
+        fork_server=fork_server,
+    ):
+        collect_response(msg, result_data)
+    return unpack_result(result_data)
+
+
+def stream_remote_tool(
+    tool_id: str,
+    index_folder: os.PathLike,
+    args: list | None = None,
+    kwargs: dict | None = None,
+    venv: str = VENV_NAME,
+    env_var: dict | None = None,
+    executor: str = DEFAULT_EXECUTOR,
+    transport: str | None = None,
+    codec: str = DEFAULT_CODEC,
+    shared_memory_threshold: int | None = DEFAULT_SHARED_MEMORY_THRESHOLD,
+    stream_window: int | None = DEFAULT_STREAM_WINDOW,
+    timeout: float | None = None,
+):
+    """
+    Synchronous version of run_remote_tool with stream=True
 
-    proc = subprocess.Popen(
-        [get_python_command(Path(index_folder) / venv), "-c", runner],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.PIPE,
-        env=env_var or None,
+    At most stream_window values are produced ahead of the consumer and
+    closing the generator early stops the tool.
+    """
+    args = args or []
+    kwargs = kwargs or {}
+    env_var = env_var or {}
+
+    if executor == "worker":
+        worker = get_worker(
+            get_python_command(Path(index_folder) / venv),
+            index_folder,
+            env_var=env_var,
+            transport=transport,
+            codec=codec,
+            shared_memory_threshold=shared_memory_threshold,
+        )
+        yield from worker.stream(
+            tool_id, args, kwargs, window=stream_window, timeout=timeout
+        )
+        return
+    fork_server = _fork_server(executor, index_folder, venv, env_var, transport)
+
+    yield from _stream_values(
+        _subprocess_messages(
+            tool_id,
+            index_folder,
+            args,
+            kwargs,
+            venv=venv,
+            env_var=env_var,
+            transport=transport,
+            codec=codec,
+            shared_memory_threshold=shared_memory_threshold,
+            timeout=timeout,
+            stream=True,
+            fork_server=fork_server,
+        )
     )
-    proc.stdin.write(payload)
-    proc.stdin.close()
-
-    if not stream:
-        thread.join()
-
-        if "error" in result_data:
-            raise RuntimeError(f"Subprocess failed with error:\n{result_data['error']}")
-        elif "result" in result_data:
-            return result_data["result"]
-        elif "stream" in result_data:
-            return result_data["stream"]
-        else:
-            raise RuntimeError("Subprocess completed without returning data.")
-    else:
-        return handle_connection_async()
@@ -0,0 +1,1023 @@
+import asyncio
+import atexit
+import itertools
+import json
+import logging
+import os
+import queue
+import signal
+import socket
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+from stores.indexes import worker_runtime
+from stores.indexes.transport import EXIT_POLL_INTERVAL, Transport
+from stores.indexes.worker_runtime import (
+    DEFAULT_CODEC,
+    DEFAULT_SHARED_MEMORY_THRESHOLD,
+    MAX_DATAGRAM,
+    MessageDecodeError,
+    MessageReader,
+    remove_shared,
+    send_message,
+    unlink_shared,
+)
+
+logging.basicConfig()
+logger = logging.getLogger("stores.indexes.worker_pool")
+logger.setLevel(logging.INFO)
+
+# Seconds a worker may stay idle before it is shut down
+DEFAULT_IDLE_TIMEOUT = 300
+# Workers exit on their own slightly after the parent stops reusing them
+# so that orphaned workers do not linger
+IDLE_GRACE_PERIOD = 5
+STARTUP_TIMEOUT = 60
+# Number of streamed values a worker may send ahead of the consumer
+DEFAULT_STREAM_WINDOW = 16
+# Seconds a cancelled call has to stop before its worker is retired
+CANCEL_GRACE_PERIOD = 2
+# Bytes of stderr kept to explain why a process failed
+STDERR_TAIL_SIZE = 4096
+WORKER_SCRIPT = str(Path(worker_runtime.__file__).resolve())
+
+
+class PendingCall:
+    """
+    Responses of a single request, delivered by the connection reader thread
+
+    Async callers pass their event loop so that responses are handed over
+    with call_soon_threadsafe and can be awaited without blocking the loop.
+    """
+
+    def __init__(self, call_id: int, loop: asyncio.AbstractEventLoop | None = None):
+        self.id = call_id
+        self.loop = loop
+        if loop is None:
+            self.queue = queue.SimpleQueue()
+        else:
+            self.queue = asyncio.Queue()
+
+    def put(self, msg: dict):
+        if self.loop is None:
+            self.queue.put(msg)
+        else:
+            try:
+                self.loop.call_soon_threadsafe(self.queue.put_nowait, msg)
+            except RuntimeError:
+                # Event loop was closed while the call was pending
+                pass
+
+    def get(self, timeout: float | None = None) -> dict:
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError from None
+
+    async def aget(self, timeout: float | None = None) -> dict:
+        if timeout is None:
+            return await self.queue.get()
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError from None
+
+
+def collect_response(msg: dict, result_data: dict) -> bool:
+    """
+    Accumulate a response into result_data and return True once the
+    call has finished
+    """
+    if msg.get("ok") and "stream" in msg:
+        result_data.setdefault("stream", []).append(msg["stream"])
+    elif msg.get("ok") and "result" in msg:
+        result_data["result"] = msg["result"]
+    elif "error" in msg:
+        result_data["error"] = msg["error"]
+        return True
+    elif msg.get("done"):
+        return True
+    return False
+
+
+def unpack_result(result_data: dict):
+    if "error" in result_data:
+        raise RuntimeError(f"Subprocess failed with error:\n{result_data['error']}")
+    elif "result" in result_data:
+        return result_data["result"]
+    elif "stream" in result_data:
+        return result_data["stream"]
+    else:
+        raise RuntimeError("Subprocess completed without returning data.")
+
+
+def remaining(deadline: float | None) -> float | None:
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0)
+
+
+class StderrTail:
+    """
+    Pipe for the stderr of a child process that keeps its last bytes
+
+    Spawn the child with stderr=tail.write_fd, then call start to drain the
+    pipe in the background.
+    """
+
+    def __init__(self, size: int = STDERR_TAIL_SIZE):
+        self.size = size
+        self.data = bytearray()
+        self.read_fd, self.write_fd = os.pipe()
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+
+    def start(self):
+        # Only the child holds the write end so that its exit ends the pipe
+        os.close(self.write_fd)
+        self._thread.start()
+
+    def close(self):
+        for fd in (self.read_fd, self.write_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _drain(self):
+        try:
+            while chunk := os.read(self.read_fd, 65536):
+                self.data += chunk
+                if len(self.data) > 2 * self.size:
+                    del self.data[: -self.size]
+        except OSError:
+            pass
+        finally:
+            os.close(self.read_fd)
+
+    def text(self, wait: float = 1) -> str:
+        # Output of a process that just exited may still be in the pipe
+        self._thread.join(wait)
+        return bytes(self.data[-self.size :]).decode("utf-8", errors="replace").strip()
+
+
+def process_error(message: str, returncode: int | None, stderr: StderrTail) -> str:
+    """
+    Describe a failed child process with its exit code and stderr
+    """
+    if returncode is not None:
+        message += f" (exit code {returncode})"
+    output = stderr.text()
+    if output:
+        message += f":\n{output}"
+    return message
+
+
+class WorkerProcess:
+    """
+    A running worker and its connection
+
+    Requests are tagged with an id and a reader thread routes every response
+    to the PendingCall of its request, so any number of calls can be in
+    flight at the same time.
+    """
+
+    def __init__(
+        self,
+        python: str,
+        index_folder: os.PathLike,
+        env_var: dict | None = None,
+        idle_timeout: float | None = None,
+        transport: str | None = None,
+        codec: str = DEFAULT_CODEC,
+        shared_memory_threshold: int | None = DEFAULT_SHARED_MEMORY_THRESHOLD,
+    ):
+        self.index_folder = Path(index_folder)
+        self.codec = codec
+        self.shared_memory_threshold = shared_memory_threshold
+        self.pending: dict[int, PendingCall] = {}
+        self.closed = False
+        self.retired = False
+        self._cancelling: set[int] = set()
+        # Shared files written for the params of calls, by call id
+        self._shared: dict[int, list[str]] = {}
+        self.last_used = time.monotonic()
+        self._ids = itertools.count()
+        self._send_lock = threading.Lock()
+
+        channel = Transport(transport)
+        command = [
+            python,
+            WORKER_SCRIPT,
+            "--address",
+            channel.address,
+            "--codec",
+            codec,
+        ]
+        if idle_timeout is not None:
+            command += ["--idle-timeout", str(idle_timeout + IDLE_GRACE_PERIOD)]
+        if shared_memory_threshold is not None:
+            command += ["--shared-memory-threshold", str(shared_memory_threshold)]
+        self.stderr = StderrTail()
+        try:
+            self.proc = subprocess.Popen(
+                command,
+                cwd=self.index_folder,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=self.stderr.write_fd,
+                env=env_var or None,
+                pass_fds=channel.pass_fds,
+            )
+        except Exception:
+            channel.close()
+            self.stderr.close()
+            raise
+        self.stderr.start()
+        try:
+            # Fail as soon as the worker exits instead of waiting for it
+            self.sock = channel.accept(
+                timeout=STARTUP_TIMEOUT, exit_code=self.proc.poll
+            )
+            reader = MessageReader(self.sock, codec)
+            msg = reader.read(timeout=STARTUP_TIMEOUT)
+        except OSError as e:
+            self.kill()
+            raise RuntimeError(
+                self._exit_message(f"Worker for {self.index_folder} failed to start")
+            ) from e
+        if not msg or not msg.get("ready"):
+            self.kill()
+            raise RuntimeError(
+                self._exit_message(f"Worker for {self.index_folder} failed to start")
+            )
+        threading.Thread(target=self._read_loop, args=(reader,), daemon=True).start()
+        logger.debug(f"Started worker {self.proc.pid} for {self.index_folder}")
+
+    @property
+    def pid(self) -> int:
+        return self.proc.pid
+
+    def is_alive(self) -> bool:
+        return not self.closed and not self.retired and self.proc.poll() is None
+
+    def _exit_message(self, message: str) -> str:
+        try:
+            returncode = self.proc.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            returncode = None
+        return process_error(message, returncode, self.stderr)
+
+    def is_idle(self, idle_timeout: float | None) -> bool:
+        return (
+            idle_timeout is not None
+            and not self.pending
+            and time.monotonic() - self.last_used >= idle_timeout
+        )
+
+    def _read_loop(self, reader: MessageReader):
+        try:
+            while True:
+                try:
+                    msg = reader.read()
+                except MessageDecodeError as e:
+                    if e.message_id is None:
+                        raise
+                    # Only the call the message belongs to fails, e.g. on a
+                    # result of a class that only exists in the index venv
+                    msg = {"id": e.message_id, "ok": False, "error": str(e)}
+                    try:
+                        # A stream would otherwise go on without a reader
+                        self.send({"op": "cancel", "id": e.message_id})
+                    except OSError:
+                        pass
+                if msg is None:
+                    break
+                call_id = msg.get("id")
+                pending = self.pending.get(call_id)
+                if pending is not None:
+                    pending.put(msg)
+                elif call_id in self._cancelling and (
+                    msg.get("done") or "error" in msg
+                ):
+                    # Cancelled call has stopped
+                    self._cancelling.discard(call_id)
+                    unlink_shared(self._shared.pop(call_id, []))
+        except (OSError, ValueError):
+            pass
+        finally:
+            # Fail every call that is still waiting on this worker
+            self.closed = True
+            if self.pending:
+                error = self._exit_message(
+                    f"Worker for {self.index_folder} exited unexpectedly"
+                )
+                for call_id, pending in list(self.pending.items()):
+                    pending.put({"id": call_id, "ok": False, "error": error})
+
+    def send(self, payload: dict, shared_paths: list[str] | None = None):
+        with self._send_lock:
+            send_message(
+                self.sock,
+                payload,
+                self.codec,
+                self.shared_memory_threshold,
+                shared_paths,
+            )
+
+    def request(
+        self, payload: dict, loop: asyncio.AbstractEventLoop | None = None
+    ) -> PendingCall:
+        pending = PendingCall(next(self._ids), loop=loop)
+        # Register before sending so that no response can be missed
+        self.pending[pending.id] = pending
+        try:
+            if self.closed:
+                raise OSError("Connection closed")
+            self._shared[pending.id] = []
+            self.send({**payload, "id": pending.id}, self._shared[pending.id])
+        except OSError as e:
+            self.pending.pop(pending.id, None)
+            unlink_shared(self._shared.pop(pending.id, []))
+            if self.closed or self.proc.poll() is not None:
+                raise RuntimeError(
+                    f"Worker for {self.index_folder} exited unexpectedly"
+                ) from e
+            raise RuntimeError(
+                f"Unable to send call to worker for {self.index_folder}: {e}"
+            ) from e
+        return pending
+
+    def release(self, pending: PendingCall, cancel: bool = False):
+        """
+        Stop tracking a call, cancelling it in the worker if it has not
+        finished. Calls that do not stop within CANCEL_GRACE_PERIOD, such as
+        sync tools that cannot be interrupted, retire the worker.
+        """
+        self.pending.pop(pending.id, None)
+        self.last_used = time.monotonic()
+        if not cancel or self.closed:
+            # A call that has not stopped may not have read its params yet
+            unlink_shared(self._shared.pop(pending.id, []))
+        if cancel and not self.closed:
+            self._cancelling.add(pending.id)
+            try:
+                self.send({"op": "cancel", "id": pending.id})
+            except OSError:
+                pass
+            timer = threading.Timer(
+                CANCEL_GRACE_PERIOD, self._check_cancelled, args=(pending.id,)
+            )
+            timer.daemon = True
+            timer.start()
+        if self.retired and not self.pending:
+            self.kill()
+
+    def _check_cancelled(self, call_id: int):
+        if call_id in self._cancelling and not self.closed:
+            logger.warning(
+                f"Call did not stop after being cancelled, retiring worker {self.pid}"
+            )
+            self.retire()
+
+    def retire(self):
+        """
+        Stop accepting calls and kill the worker once in-flight calls finish
+        """
+        self.retired = True
+        if not self.pending:
+            self.kill()
+
+    def grant(self, pending: PendingCall, n: int):
+        """
+        Allow the worker to stream n more values for a call
+        """
+        try:
+            self.send({"op": "credit", "id": pending.id, "n": n})
+        except OSError:
+            # Reader thread fails the call if the worker is gone
+            pass
+
+    def ping(self, timeout: float = 5) -> bool:
+        pending = self.request({"op": "ping"})
+        try:
+            return bool(pending.get(timeout=timeout).get("pong"))
+        except TimeoutError:
+            return False
+        finally:
+            self.release(pending)
+
+    def kill(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        # Results the worker wrote but that were never read, and params it
+        # never read
+        remove_shared(self.proc.pid)
+        for call_id in list(self._shared):
+            unlink_shared(self._shared.pop(call_id, []))
+        sock = getattr(self, "sock", None)
+        if sock is not None:
+            sock.close()
+
+    def close(self):
+        try:
+            self.send({"op": "shutdown"})
+            self.proc.wait(timeout=1)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        self.kill()
+
+
+class VenvWorker:
+    """
+    Long-lived process that serves tool calls using the interpreter of an
+    index venv. Tool modules are imported once and reused across calls.
+
+    The process is started lazily on the first call and restarted
+    transparently if it dies or has been idle for longer than idle_timeout.
+    """
+
+    def __init__(
+        self,
+        python: str,
+        index_folder: os.PathLike,
+        env_var: dict | None = None,
+        idle_timeout: float | None = DEFAULT_IDLE_TIMEOUT,
+        transport: str | None = None,
+        codec: str = DEFAULT_CODEC,
+        shared_memory_threshold: int | None = DEFAULT_SHARED_MEMORY_THRESHOLD,
+    ):
+        self.python = python
+        self.index_folder = Path(index_folder)
+        self.env_var = env_var or {}
+        self.idle_timeout = idle_timeout
+        self.transport = transport
+        self.codec = codec
+        self.shared_memory_threshold = shared_memory_threshold
+        self._lock = threading.Lock()
+        self._process: WorkerProcess | None = None
+        # Retired processes that still serve in-flight calls
+        self._retired: list[WorkerProcess] = []
+
+    @property
+    def pid(self) -> int | None:
+        return self._process.pid if self.is_alive() else None
+
+    def is_alive(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+    def _get_process(self) -> WorkerProcess:
+        with self._lock:
+            process = self._process
+            if (
+                process is None
+                or not process.is_alive()
+                or process.is_idle(self.idle_timeout)
+            ):
+                if process is not None and process.retired:
+                    self._retired = [p for p in self._retired if p.proc.poll() is None]
+                    self._retired.append(process)
+                elif process is not None:
+                    process.close()
+                self._process = None
+                process = WorkerProcess(
+                    self.python,
+                    self.index_folder,
+                    env_var=self.env_var,
+                    idle_timeout=self.idle_timeout,
+                    transport=self.transport,
+                    codec=self.codec,
+                    shared_memory_threshold=self.shared_memory_threshold,
+                )
+                self._process = process
+            return process
+
+    def ping(self, timeout: float = 5) -> bool:
+        """
+        Check that the worker process is alive and responsive
+        """
+        process = self._process
+        if process is None or not process.is_alive():
+            return False
+        try:
+            return process.ping(timeout=timeout)
+        except RuntimeError:
+            return False
+
+    def _call_payload(
+        self,
+        tool_id: str,
+        args: list | None,
+        kwargs: dict | None,
+        window: int | None = None,
+    ):
+        payload = {
+            "op": "call",
+            "tool_id": tool_id,
+            "args": args or [],
+            "kwargs": kwargs or {},
+        }
+        if window is not None:
+            if window < 1:
+                raise ValueError(f"Stream window must be at least 1, got {window}")
+            payload["window"] = window
+        return payload
+
+    def call(
+        self,
+        tool_id: str,
+        args: list | None = None,
+        kwargs: dict | None = None,
+        timeout: float | None = None,
+    ):
+        """
+        Run a tool and return its result, raising TimeoutError if it does not
+        finish within timeout seconds
+        """
+        process = self._get_process()
+        pending = process.request(self._call_payload(tool_id, args, kwargs))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        result_data = {}
+        finished = False
+        try:
+            while not finished:
+                try:
+                    msg = pending.get(timeout=remaining(deadline))
+                except TimeoutError:
+                    raise TimeoutError(
+                        f"Tool {tool_id} timed out after {timeout}s"
+                    ) from None
+                finished = collect_response(msg, result_data)
+        finally:
+            process.release(pending, cancel=not finished)
+        return unpack_result(result_data)
+
+    async def acall(
+        self,
+        tool_id: str,
+        args: list | None = None,
+        kwargs: dict | None = None,
+        timeout: float | None = None,
+    ):
+        """
+        Awaitable version of call that does not block the event loop
+        while the tool runs
+        """
+        loop = asyncio.get_running_loop()
+        process = await loop.run_in_executor(None, self._get_process)
+        pending = process.request(self._call_payload(tool_id, args, kwargs), loop=loop)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        result_data = {}
+        finished = False
+        try:
+            while not finished:
+                try:
+                    msg = await pending.aget(timeout=remaining(deadline))
+                except TimeoutError:
+                    raise TimeoutError(
+                        f"Tool {tool_id} timed out after {timeout}s"
+                    ) from None
+                finished = collect_response(msg, result_data)
+        finally:
+            # Stop the tool if the awaiting task was cancelled
+            process.release(pending, cancel=not finished)
+        return unpack_result(result_data)
+
+    def stream(
+        self,
+        tool_id: str,
+        args: list | None = None,
+        kwargs: dict | None = None,
+        window: int | None = DEFAULT_STREAM_WINDOW,
+        timeout: float | None = None,
+    ):
+        """
+        Yield values as the tool produces them
+
+        The worker runs at most window values ahead of the consumer, so a slow
+        consumer pauses the tool instead of buffering its output. Closing the
+        generator early stops the tool. TimeoutError is raised if the tool
+        takes longer than timeout seconds to produce a value.
+        """
+        process = self._get_process()
+        pending = process.request(
+            self._call_payload(tool_id, args, kwargs, window=window)
+        )
+        finished = False
+        consumed = 0
+        try:
+            while True:
+                try:
+                    msg = pending.get(timeout=timeout)
+                except TimeoutError:
+                    raise TimeoutError(
+                        f"Tool {tool_id} timed out after {timeout}s"
+                    ) from None
+                if msg.get("ok") and "stream" in msg:
+                    yield msg["stream"]
+                    # Grant credits in batches to limit messages
+                    consumed += 1
+                    if window is not None and consumed >= max(window // 2, 1):
+                        process.grant(pending, consumed)
+                        consumed = 0
+                elif msg.get("ok") and "result" in msg:
+                    yield msg["result"]
+                elif "error" in msg:
+                    finished = True
+                    raise RuntimeError(f"Subprocess error:\n{msg['error']}")
+                elif msg.get("done"):
+                    finished = True
+                    return
+        finally:
+            # Ask the worker to stop producing if the stream was abandoned
+            process.release(pending, cancel=not finished)
+
+    async def astream(
+        self,
+        tool_id: str,
+        args: list | None = None,
+        kwargs: dict | None = None,
+        window: int | None = DEFAULT_STREAM_WINDOW,
+        timeout: float | None = None,
+    ):
+        """
+        Asynchronous version of stream
+        """
+        loop = asyncio.get_running_loop()
+        process = await loop.run_in_executor(None, self._get_process)
+        pending = process.request(
+            self._call_payload(tool_id, args, kwargs, window=window), loop=loop
+        )
+        finished = False
+        consumed = 0
+        try:
+            while True:
+                try:
+                    msg = await pending.aget(timeout=timeout)
+                except TimeoutError:
+                    raise TimeoutError(
+                        f"Tool {tool_id} timed out after {timeout}s"
+                    ) from None
+                if msg.get("ok") and "stream" in msg:
+                    yield msg["stream"]
+                    consumed += 1
+                    if window is not None and consumed >= max(window // 2, 1):
+                        process.grant(pending, consumed)
+                        consumed = 0
+                elif msg.get("ok") and "result" in msg:
+                    yield msg["result"]
+                elif "error" in msg:
+                    finished = True
+                    raise RuntimeError(f"Subprocess error:\n{msg['error']}")
+                elif msg.get("done"):
+                    finished = True
+                    return
+        finally:
+            # Ask the worker to stop producing if the stream was abandoned
+            process.release(pending, cancel=not finished)
+
+    def close(self):
+        with self._lock:
+            if self._process is not None:
+                self._process.close()
+                self._process = None
+            for process in self._retired:
+                process.kill()
+            self._retired = []
+
+
+class ForkedProcess:
+    """
+    Child forked by a ForkServer, with the part of the Popen interface used
+    to supervise a tool call
+    """
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.returncode = None
+        self._exited = threading.Event()
+
+    def poll(self) -> int | None:
+        return self.returncode
+
+    def wait(self, timeout: float | None = None) -> int | None:
+        if not self._exited.wait(timeout):
+            raise subprocess.TimeoutExpired(str(self.pid), timeout)
+        return self.returncode
+
+    def kill(self):
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def set_exited(self, returncode: int):
+        self.returncode = returncode
+        self._exited.set()
+
+
+class ForkServer:
+    """
+    Long-lived process in an index venv that has imported tool modules and
+    forks a child for every call
+
+    Children start with the modules already in memory, copy-on-write, instead
+    of importing them in a fresh interpreter. Each call gets its own
+    connection, passed to the child over the Unix socket shared with the
+    server, so calls are isolated from each other as with the subprocess
+    executor.
+    """
+
+    def __init__(
+        self,
+        python: str,
+        index_folder: os.PathLike,
+        env_var: dict | None = None,
+        preload: list[str] | None = None,
+    ):
+        self.index_folder = Path(index_folder)
+        self.closed = False
+        self.pending: dict[int, PendingCall] = {}
+        self.children: dict[int, ForkedProcess] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+        self.sock, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        command = [
+            python,
+            WORKER_SCRIPT,
+            "--address",
+            f"fd:{child.fileno()}",
+            "--fork-server",
+        ]
+        for module in preload or []:
+            command += ["--preload", module]
+        self.stderr = StderrTail()
+        try:
+            self.proc = subprocess.Popen(
+                command,
+                cwd=self.index_folder,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=self.stderr.write_fd,
+                env=env_var or None,
+                pass_fds=(child.fileno(),),
+            )
+        except Exception:
+            self.sock.close()
+            self.stderr.close()
+            raise
+        finally:
+            child.close()
+        self.stderr.start()
+
+        # Fail as soon as the server exits instead of waiting for it
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        msg = None
+        while msg is None and self.proc.poll() is None:
+            if time.monotonic() > deadline:
+                break
+            self.sock.settimeout(EXIT_POLL_INTERVAL)
+            try:
+                msg = json.loads(self.sock.recv(MAX_DATAGRAM))
+            except socket.timeout:
+                continue
+        self.sock.settimeout(None)
+        if not msg or not msg.get("ready"):
+            self.kill()
+            raise RuntimeError(
+                self._exit_message(
+                    f"Fork server for {self.index_folder} failed to start"
+                )
+            )
+        threading.Thread(target=self._read_loop, daemon=True).start()
+        threading.Thread(target=self._watch, daemon=True).start()
+        logger.debug(f"Started fork server {self.proc.pid} for {self.index_folder}")
+
+    @property
+    def pid(self) -> int:
+        return self.proc.pid
+
+    def is_alive(self) -> bool:
+        return not self.closed and self.proc.poll() is None
+
+    def _exit_message(self, message: str) -> str:
+        try:
+            returncode = self.proc.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            returncode = None
+        return process_error(message, returncode, self.stderr)
+
+    def _watch(self):
+        # Datagram sockets are not notified when the peer exits
+        self.proc.wait()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _read_loop(self):
+        try:
+            while data := self.sock.recv(MAX_DATAGRAM):
+                msg = json.loads(data)
+                if "exit" in msg:
+                    child = self.children.pop(msg["exit"], None)
+                    if child is not None:
+                        child.set_exited(msg["returncode"])
+                    continue
+                pending = self.pending.get(msg.get("id"))
+                if pending is None:
+                    continue
+                if "pid" in msg:
+                    child = ForkedProcess(msg["pid"])
+                    self.children[child.pid] = child
+                    pending.put({"process": child})
+                else:
+                    pending.put(msg)
+        except OSError:
+            pass
+        finally:
+            if not self.closed:
+                logger.warning(
+                    self._exit_message(
+                        f"Fork server {self.proc.pid} for {self.index_folder} exited"
+                    )
+                )
+            self.closed = True
+            error = {"error": "Fork server exited"}
+            for pending in list(self.pending.values()):
+                pending.put(error)
+            # Orphaned children can no longer be reaped by the server
+            for child in list(self.children.values()):
+                child.kill()
+                child.set_exited(-signal.SIGKILL)
+            self.children.clear()
+
+    def fork(
+        self,
+        tool_id: str,
+        conn_fd: int,
+        stderr_fd: int,
+        codec: str = DEFAULT_CODEC,
+        shared_memory_threshold: int | None = DEFAULT_SHARED_MEMORY_THRESHOLD,
+    ) -> ForkedProcess:
+        """
+        Fork a child that runs tool_id, exchanging messages over the socket
+        conn_fd as a tool runner subprocess would
+        """
+        pending = PendingCall(next(self._ids))
+        request = {
+            "op": "fork",
+            "id": pending.id,
+            "tool_id": tool_id,
+            "codec": codec,
+            "shared_memory_threshold": shared_memory_threshold,
+        }
+        self.pending[pending.id] = pending
+        try:
+            if self.closed:
+                raise RuntimeError(f"Fork server for {self.index_folder} is closed")
+            with self._lock:
+                socket.send_fds(
+                    self.sock,
+                    [json.dumps(request).encode()],
+                    [conn_fd, stderr_fd],
+                )
+            msg = pending.get(timeout=STARTUP_TIMEOUT)
+        finally:
+            self.pending.pop(pending.id, None)
+        if "error" in msg:
+            raise RuntimeError(f"Unable to fork {tool_id}:\n{msg['error']}")
+        return msg["process"]
+
+    def kill(self):
+        self.closed = True
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        self.sock.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            with self._lock:
+                self.sock.send(json.dumps({"op": "shutdown"}).encode())
+            self.proc.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        self.kill()
+
+
+_workers: dict[tuple, VenvWorker] = {}
+_fork_servers: dict[tuple, ForkServer] = {}
+_workers_lock = threading.Lock()
+# Number of open indexes using the workers of each index folder
+_workers_users: dict[str, int] = {}
+
+
+def get_worker(
+    python: str,
+    index_folder: os.PathLike,
+    env_var: dict | None = None,
+    idle_timeout: float | None = DEFAULT_IDLE_TIMEOUT,
+    transport: str | None = None,
+    codec: str = DEFAULT_CODEC,
+    shared_memory_threshold: int | None = DEFAULT_SHARED_MEMORY_THRESHOLD,
+) -> VenvWorker:
+    """
+    Retrieve the shared worker for an index venv, creating it if needed
+    """
+    index_folder = Path(index_folder).resolve()
+    key = (
+        str(python),
+        str(index_folder),
+        tuple(sorted((env_var or {}).items())),
+        transport,
+        codec,
+        shared_memory_threshold,
+    )
+    with _workers_lock:
+        if key not in _workers:
+            _workers[key] = VenvWorker(
+                python,
+                index_folder,
+                env_var=env_var,
+                idle_timeout=idle_timeout,
+                transport=transport,
+                codec=codec,
+                shared_memory_threshold=shared_memory_threshold,
+            )
+        return _workers[key]
+
+
+def get_fork_server(
+    python: str,
+    index_folder: os.PathLike,
+    env_var: dict | None = None,
+    preload: list[str] | None = None,
+) -> ForkServer:
+    """
+    Retrieve the shared fork server for an index venv, starting it with
+    preload imported if needed
+    """
+    index_folder = Path(index_folder).resolve()
+    key = (str(python), str(index_folder), tuple(sorted((env_var or {}).items())))
+    with _workers_lock:
+        server = _fork_servers.get(key)
+        if server is None or not server.is_alive():
+            if server is not None:
+                server.kill()
+            server = ForkServer(python, index_folder, env_var=env_var, preload=preload)
+            _fork_servers[key] = server
+        return server
+
+
+def close_workers(index_folder: os.PathLike | None = None):
+    """
+    Shut down workers and fork servers serving index_folder, or all of them
+    if not specified
+    """
+    if index_folder is not None:
+        index_folder = str(Path(index_folder).resolve())
+    with _workers_lock:
+        keys = [k for k in _workers if index_folder is None or k[1] == index_folder]
+        workers = [_workers.pop(k) for k in keys]
+        keys = [
+            k for k in _fork_servers if index_folder is None or k[1] == index_folder
+        ]
+        workers += [_fork_servers.pop(k) for k in keys]
+    for worker in workers:
+        worker.close()
+
+
+def acquire_workers(index_folder: os.PathLike):
+    """
+    Register an index using the workers and fork servers of index_folder, so
+    that they are kept until every index using them has released them
+    """
+    index_folder = str(Path(index_folder).resolve())
+    with _workers_lock:
+        _workers_users[index_folder] = _workers_users.get(index_folder, 0) + 1
+
+
+def release_workers(index_folder: os.PathLike):
+    """
+    Release the workers of index_folder acquired by an index, shutting them
+    down once no other index uses them
+    """
+    key = str(Path(index_folder).resolve())
+    with _workers_lock:
+        users = _workers_users.get(key, 0) - 1
+        if users > 0:
+            _workers_users[key] = users
+            return
+        _workers_users.pop(key, None)
+    close_workers(index_folder)
+
+
+atexit.register(close_workers)
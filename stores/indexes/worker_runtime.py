@@ -0,0 +1,967 @@
+"""
+Entrypoint of long-lived tool workers
+
+This module is executed with the interpreter of an index venv, where stores
+itself is not installed, so it must only depend on the standard library.
+
+Messages are length-prefixed frames encoded with a codec agreed on at
+startup. Every request carries an "id" that is echoed on each of its
+responses so that concurrent calls can share a single connection. Large
+messages are written to a memory-backed file and only its path is sent.
+
+With --fork-server the process instead imports tool modules once and forks
+a child for every call, which runs it with run_tool.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import enum
+import importlib
+import inspect
+import io
+import json
+import mmap
+import os
+import pickle
+import select
+import signal
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import traceback
+import types
+from typing import (
+    Any,
+    Dict,
+    List,
+    Literal,
+    Tuple,
+    Union,
+    get_args,
+    get_origin,
+    get_type_hints,
+)
+
+
+def connect(address: str) -> socket.socket:
+    """
+    Connect to the parent process given an address of the form
+    fd:<inherited socket fd>, unix:<socket path> or tcp:<host>:<port>
+    """
+    kind, _, target = address.partition(":")
+    if kind == "fd":
+        return socket.socket(fileno=int(target))
+    elif kind == "unix":
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(target)
+        return sock
+    elif kind == "tcp":
+        host, _, port = target.rpartition(":")
+        sock = socket.create_connection((host, int(port)))
+        # Messages are small and latency sensitive
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+    else:
+        raise ValueError(f"Unsupported address: {address}")
+
+
+# Frame header: message length, number of out-of-band buffers that follow
+# the message, each prefixed with its own length, and flags
+HEADER = struct.Struct("!IIB")
+BUFFER_HEADER = struct.Struct("!Q")
+READ_SIZE = 65536
+
+# The message and its buffers are stored in a shared file and the frame
+# only contains the file path
+FLAG_SHARED = 1
+SHARED_MEMORY_PREFIX = "stores-"
+if os.path.isdir("/dev/shm"):
+    SHARED_MEMORY_DIR = "/dev/shm"
+    # Messages larger than this many bytes are passed via shared memory
+    DEFAULT_SHARED_MEMORY_THRESHOLD = 1 << 20
+else:
+    SHARED_MEMORY_DIR = tempfile.gettempdir()
+    DEFAULT_SHARED_MEMORY_THRESHOLD = None
+
+
+class MessageDecodeError(ValueError):
+    """
+    A message was received in full but could not be decoded, such as a
+    pickled instance of a class that only exists in the sending interpreter.
+    message_id is the id of the message if it could still be read.
+    """
+
+    def __init__(self, error: str, message_id=None):
+        super().__init__(error)
+        self.message_id = message_id
+
+
+class _Placeholder:
+    """
+    Stands in for every class and function referenced by a pickle, so that
+    the plain values around them can be read without running any code
+    """
+
+    def __new__(cls, *args, **kwargs):
+        return object.__new__(cls)
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __setstate__(self, state):
+        pass
+
+
+class _PlaceholderUnpickler(pickle.Unpickler):
+    def find_class(self, module: str, name: str):
+        return _Placeholder
+
+
+def _json_dumps(payload) -> tuple[bytes, list]:
+    return json.dumps(payload).encode("utf-8"), []
+
+
+def _json_loads(data: memoryview, buffers: list):
+    return json.loads(str(data, "utf-8"))
+
+
+def _pickle_dumps(payload) -> tuple[bytes, list]:
+    # Objects supporting pickle protocol 5 (e.g. numpy arrays) hand over
+    # their memory as out-of-band buffers instead of being copied inline
+    buffers = []
+    data = pickle.dumps(payload, protocol=5, buffer_callback=buffers.append)
+    return data, [b.raw() for b in buffers]
+
+
+def _pickle_loads(data: memoryview, buffers: list):
+    try:
+        return pickle.loads(data, buffers=buffers)
+    except Exception as e:
+        try:
+            envelope = _PlaceholderUnpickler(io.BytesIO(data), buffers=buffers).load()
+            message_id = envelope.get("id")
+        except Exception:
+            message_id = None
+        raise MessageDecodeError(
+            f"Unable to unpickle message: {e!r}", message_id
+        ) from e
+
+
+CODECS = {
+    "json": (_json_dumps, _json_loads),
+    "pickle": (_pickle_dumps, _pickle_loads),
+}
+DEFAULT_CODEC = "json"
+
+
+def write_shared(parts: list) -> str:
+    """
+    Write parts to a new memory-backed file, each prefixed with its length
+    """
+    fd, path = tempfile.mkstemp(
+        prefix=f"{SHARED_MEMORY_PREFIX}{os.getpid()}-", dir=SHARED_MEMORY_DIR
+    )
+    try:
+        with open(fd, "wb") as f:
+            for part in parts:
+                f.write(BUFFER_HEADER.pack(memoryview(part).nbytes))
+                f.write(part)
+    except BaseException:
+        # e.g. the memory-backed filesystem is full
+        os.unlink(path)
+        raise
+    return path
+
+
+def read_shared(path: str, count: int) -> tuple[memoryview, list]:
+    """
+    Map a file created by write_shared and return views of the message and
+    its count buffers. The file is deleted once mapped and the mapping is
+    released when the last view is garbage collected.
+    """
+    if os.path.dirname(path) != SHARED_MEMORY_DIR or not os.path.basename(
+        path
+    ).startswith(SHARED_MEMORY_PREFIX):
+        raise ValueError(f"Invalid shared memory path: {path}")
+    with open(path, "rb") as f:
+        if os.name == "nt":
+            # Files cannot be deleted on Windows while they are mapped
+            mapping = bytearray(f.read())
+        else:
+            # Copy-on-write keeps buffers writable without touching the file
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    os.unlink(path)
+    view = memoryview(mapping)
+    parts = []
+    pos = 0
+    for _ in range(count + 1):
+        (size,) = BUFFER_HEADER.unpack_from(view, pos)
+        pos += BUFFER_HEADER.size
+        parts.append(view[pos : pos + size])
+        pos += size
+    return parts[0], parts[1:]
+
+
+def remove_shared(pid: int):
+    """
+    Delete shared files left behind by a process that has exited
+    """
+    prefix = f"{SHARED_MEMORY_PREFIX}{pid}-"
+    try:
+        names = os.listdir(SHARED_MEMORY_DIR)
+    except OSError:
+        return
+    for name in names:
+        if name.startswith(prefix):
+            try:
+                os.unlink(os.path.join(SHARED_MEMORY_DIR, name))
+            except OSError:
+                pass
+
+
+def unlink_shared(paths: list[str]):
+    """
+    Delete shared files written by this process, unless the receiver already
+    has
+    """
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def encode_message(
+    payload,
+    codec: str = DEFAULT_CODEC,
+    shared_memory_threshold: int | None = None,
+    shared_paths: list[str] | None = None,
+) -> list:
+    """
+    Encode payload into the chunks of a frame
+
+    The path of a shared file written for the frame is appended to
+    shared_paths, so that the sender can delete it should it never be read.
+    """
+    data, buffers = CODECS[codec][0](payload)
+    size = len(data) + sum(b.nbytes for b in buffers)
+    if shared_memory_threshold is not None and size > shared_memory_threshold:
+        try:
+            path = write_shared([data, *buffers])
+        except OSError:
+            # The message is sent through the socket instead
+            path = None
+        if path is not None:
+            if shared_paths is not None:
+                shared_paths.append(path)
+            path = path.encode("utf-8")
+            return [HEADER.pack(len(path), len(buffers), FLAG_SHARED) + path]
+    chunks = [HEADER.pack(len(data), len(buffers), 0), data]
+    for buffer in buffers:
+        chunks += [BUFFER_HEADER.pack(buffer.nbytes), buffer]
+    if size <= READ_SIZE:
+        return [b"".join(chunks)]
+    # Avoid copying large payloads just to prepend headers
+    return chunks
+
+
+def send_message(
+    sock: socket.socket,
+    payload,
+    codec: str = DEFAULT_CODEC,
+    shared_memory_threshold: int | None = None,
+    shared_paths: list[str] | None = None,
+):
+    for chunk in encode_message(payload, codec, shared_memory_threshold, shared_paths):
+        sock.sendall(chunk)
+
+
+async def asend_message(
+    loop: asyncio.AbstractEventLoop,
+    sock: socket.socket,
+    payload,
+    codec: str = DEFAULT_CODEC,
+    shared_memory_threshold: int | None = None,
+    shared_paths: list[str] | None = None,
+):
+    for chunk in encode_message(payload, codec, shared_memory_threshold, shared_paths):
+        await loop.sock_sendall(sock, chunk)
+
+
+class MessageReader:
+    """
+    Read length-prefixed messages from a socket
+
+    Data is received with recv_into directly into a reusable buffer that
+    grows geometrically to fit large messages, so reading is linear in the
+    message size. A message is only consumed once it has been received in
+    full, so raising socket.timeout when no data arrives within the timeout
+    leaves the reader in a consistent state.
+    """
+
+    def __init__(self, sock: socket.socket, codec: str = DEFAULT_CODEC):
+        if codec not in CODECS:
+            raise ValueError(f"Unsupported codec: {codec}")
+        self.sock = sock
+        self.loads = CODECS[codec][1]
+        self.buffer = bytearray(READ_SIZE)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def _parse(self) -> tuple[bool, object]:
+        """
+        Decode the next message if it has been received in full, otherwise
+        return the minimum number of bytes it spans
+        """
+        pos = self.start + HEADER.size
+        if self.end < pos:
+            return False, HEADER.size
+        length, count, flags = HEADER.unpack_from(self.buffer, self.start)
+        parts = [(pos, pos + length)]
+        pos += length
+        for _ in range(0 if flags & FLAG_SHARED else count):
+            if self.end < pos + BUFFER_HEADER.size:
+                return False, pos + BUFFER_HEADER.size - self.start
+            (size,) = BUFFER_HEADER.unpack_from(self.buffer, pos)
+            pos += BUFFER_HEADER.size
+            parts.append((pos, pos + size))
+            pos += size
+        if self.end < pos:
+            return False, pos - self.start
+        self.start = pos
+        a, b = parts[0]
+        if flags & FLAG_SHARED:
+            data, buffers = read_shared(str(self.view[a:b], "utf-8"), count)
+        else:
+            data = self.view[a:b]
+            # Out-of-band buffers outlive the read buffer, which is reused
+            buffers = [bytearray(self.view[a:b]) for a, b in parts[1:]]
+        error = None
+        try:
+            message = self.loads(data, buffers)
+        except MessageDecodeError as e:
+            error = e
+        except Exception as e:
+            error = MessageDecodeError(f"Unable to decode message: {e!r}")
+        if self.start == self.end:
+            self.start = self.end = 0
+            if len(self.buffer) > 16 * READ_SIZE:
+                # Release memory held after a large message
+                self._resize(READ_SIZE)
+        if error is not None:
+            # The frame has been consumed, so reading can go on
+            raise error
+        return True, message
+
+    def _resize(self, size: int):
+        unread = self.end - self.start
+        buffer = bytearray(size)
+        buffer[:unread] = self.view[self.start : self.end]
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        self.start, self.end = 0, unread
+
+    def _reserve(self, needed: int):
+        """
+        Make room to receive a message spanning at least needed bytes
+        """
+        unread = self.end - self.start
+        needed = max(needed, unread + 1)
+        if self.start + needed <= len(self.buffer):
+            return
+        if needed <= len(self.buffer):
+            # Move unread data to the front
+            self.view[:unread] = self.view[self.start : self.end]
+            self.start, self.end = 0, unread
+        else:
+            self._resize(max(needed, 2 * len(self.buffer)))
+
+    def read(self, timeout: float | None = None):
+        while True:
+            complete, value = self._parse()
+            if complete:
+                return value
+            self._reserve(value)
+            if timeout is not None:
+                ready, _, _ = select.select([self.sock], [], [], timeout)
+                if not ready:
+                    raise socket.timeout
+            received = self.sock.recv_into(self.view[self.end :])
+            if not received:
+                return None
+            self.end += received
+
+    async def aread(self, loop: asyncio.AbstractEventLoop):
+        """
+        Read the next message from a non-blocking socket within an event loop
+        """
+        while True:
+            complete, value = self._parse()
+            if complete:
+                return value
+            self._reserve(value)
+            received = await loop.sock_recv_into(self.sock, self.view[self.end :])
+            if not received:
+                return None
+            self.end += received
+
+
+def load_tool(tool_id: str):
+    module_name = ".".join(tool_id.split(".")[:-1])
+    tool_name = tool_id.split(".")[-1]
+    # Modules are cached in sys.modules so each one is only imported once
+    module = importlib.import_module(module_name)
+    return getattr(module, tool_name)
+
+
+def run_tool(
+    sock: socket.socket,
+    tool_id: str,
+    codec: str = DEFAULT_CODEC,
+    shared_memory_threshold: int | None = None,
+):
+    """
+    Run a single tool call, receiving args and kwargs as the first message on
+    sock and sending results back on it
+    """
+
+    def send(payload: dict):
+        send_message(sock, payload, codec, shared_memory_threshold)
+
+    try:
+        # Params are read first so that their shared file is removed even if
+        # the tool fails to import
+        params = MessageReader(sock, codec).read()
+        func = load_tool(tool_id)
+        args = params.get("args", [])
+        kwargs = params.get("kwargs", {})
+
+        if inspect.isasyncgenfunction(func):
+
+            async def run():
+                async for value in func(*args, **kwargs):
+                    send({"ok": True, "stream": value})
+
+            asyncio.run(run())
+        elif inspect.isgeneratorfunction(func):
+            for value in func(*args, **kwargs):
+                send({"ok": True, "stream": value})
+        elif inspect.iscoroutinefunction(func):
+            result = asyncio.run(func(*args, **kwargs))
+            send({"ok": True, "result": result})
+        else:
+            result = func(*args, **kwargs)
+            send({"ok": True, "result": result})
+        send({"done": True})
+    except Exception:
+        try:
+            send({"ok": False, "error": traceback.format_exc()})
+        except OSError:
+            pass
+
+
+# Version of the signature format returned by get_signature, bumped whenever
+# a change would break parse_tool_signature in an older stores
+SIGNATURE_SCHEMA_VERSION = 1
+# Names of the types found at the leaves of a type description
+TYPE_NAMES = {
+    str: "str",
+    int: "int",
+    float: "float",
+    bool: "bool",
+    bytes: "bytes",
+    type(None): "None",
+    Any: "Any",
+    Ellipsis: "...",
+    inspect.Parameter.empty: "empty",
+}
+
+
+def extract_type_info(typ, custom_types: list[str] | None = None):
+    """
+    Describe a type annotation with plain values that can be sent to the parent
+    """
+    custom_types = custom_types or []
+    if hasattr(typ, "__name__") and typ.__name__ in custom_types:
+        return typ.__name__
+    origin = get_origin(typ)
+    args = list(get_args(typ))
+    if origin is Literal:
+        return {"type": "Literal", "values": args}
+    elif inspect.isclass(typ) and issubclass(typ, enum.Enum):
+        custom_types.append(typ.__name__)
+        return {
+            "type": "Enum",
+            "type_name": typ.__name__,
+            "values": {v.name: v.value for v in typ},
+        }
+    elif isinstance(typ, type) and typ.__class__.__name__ == "_TypedDictMeta":
+        custom_types.append(typ.__name__)
+        hints = get_type_hints(typ)
+        return {
+            "type": "TypedDict",
+            "type_name": typ.__name__,
+            "fields": {k: extract_type_info(v, custom_types) for k, v in hints.items()},
+        }
+    elif origin in (list, List) or typ is list:
+        return {
+            "type": "List",
+            "item_type": extract_type_info(args[0], custom_types)
+            if args
+            else {"type": "Any"},
+        }
+    elif origin in (dict, Dict) or typ is dict:
+        return {
+            "type": "Dict",
+            "key_type": extract_type_info(args[0], custom_types)
+            if args
+            else {"type": "Any"},
+            "value_type": extract_type_info(args[1], custom_types)
+            if len(args) > 1
+            else {"type": "Any"},
+        }
+    elif origin in (tuple, Tuple) or typ is tuple:
+        return {
+            "type": "Tuple",
+            "item_types": [extract_type_info(arg, custom_types) for arg in args]
+            if args
+            else [{"type": "Any"}],
+        }
+    elif origin is Union or origin is types.UnionType:
+        return {
+            "type": "Union",
+            "options": [extract_type_info(arg, custom_types) for arg in args],
+        }
+    try:
+        return {"type": TYPE_NAMES[typ]}
+    except (KeyError, TypeError):
+        raise TypeError(
+            f"Unsupported type {typ!r}, custom types other than Enum and TypedDict cannot be exported"
+        ) from None
+
+
+def get_param_info(hint, kind: inspect._ParameterKind, default) -> dict:
+    param_info = extract_type_info(hint)
+    param_info["kind"] = kind.name
+    # Parameters without a default have no "default" key
+    if default is not inspect.Parameter.empty:
+        param_info["default"] = default
+    return param_info
+
+
+def check_signature(signature: dict) -> dict:
+    """
+    Return a signature as it reads after being encoded as JSON
+    """
+    try:
+        return json.loads(json.dumps(signature))
+    except (TypeError, ValueError) as e:
+        raise TypeError(
+            f"Signature of {signature['tool_id']} cannot be encoded as JSON: {e}"
+        ) from e
+
+
+def get_signature(tool_id: str, func) -> dict:
+    """
+    Describe the parameters and return type of a tool with plain JSON values
+    """
+    sig = inspect.signature(func)
+    hints = get_type_hints(func)
+    params = {}
+    for name, param in sig.parameters.items():
+        hint = hints.get(name, param.annotation)
+        params[name] = get_param_info(hint, param.kind, param.default)
+    return_type = hints.get("return", sig.return_annotation)
+    return_info = extract_type_info(return_type)
+    return check_signature(
+        {
+            "schema_version": SIGNATURE_SCHEMA_VERSION,
+            "tool_id": tool_id,
+            "params": params,
+            "return": return_info,
+            "iscoroutinefunction": inspect.iscoroutinefunction(func),
+            "isgeneratorfunction": inspect.isgeneratorfunction(func),
+            "isasyncgenfunction": inspect.isasyncgenfunction(func),
+            "doc": inspect.getdoc(func),
+        }
+    )
+
+
+class Call:
+    """
+    State of a call in progress
+
+    Streaming calls may carry a window, the number of values that can be
+    sent before the parent has consumed them. The parent grants more
+    credits as it consumes values and the tool is paused while it has none.
+    """
+
+    def __init__(
+        self, loop: asyncio.AbstractEventLoop | None = None, window: int | None = None
+    ):
+        self.cancelled = False
+        self.future: concurrent.futures.Future | None = None
+        self.loop = loop
+        self.credits = window
+        self.condition = threading.Condition()
+        self.waiter: asyncio.Future | None = None
+
+    def _wake(self):
+        with self.condition:
+            self.condition.notify_all()
+            waiter = self.waiter
+        if waiter is not None:
+            self.loop.call_soon_threadsafe(
+                lambda: waiter.done() or waiter.set_result(None)
+            )
+
+    def add_credits(self, n: int):
+        with self.condition:
+            if self.credits is not None:
+                self.credits += n
+        self._wake()
+
+    def cancel(self):
+        self.cancelled = True
+        self._wake()
+        if self.future is not None:
+            self.future.cancel()
+
+    def _take_credit(self) -> bool:
+        if self.credits is None:
+            return True
+        if self.credits > 0:
+            self.credits -= 1
+            return True
+        return False
+
+    def acquire(self) -> bool:
+        """
+        Wait for a credit to send a value, returning False if cancelled
+        """
+        with self.condition:
+            while not self.cancelled and not self._take_credit():
+                self.condition.wait()
+            return not self.cancelled
+
+    async def aacquire(self) -> bool:
+        """
+        Version of acquire for tools running in the event loop
+        """
+        while True:
+            with self.condition:
+                if self.cancelled:
+                    return False
+                if self._take_credit():
+                    return True
+                self.waiter = self.loop.create_future()
+            await self.waiter
+
+
+class ToolServer:
+    """
+    Serve tool calls concurrently over a single connection
+
+    Sync tools run in their own thread while coroutines and async generators
+    share an event loop running in a background thread.
+    """
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        idle_timeout: float | None = None,
+        codec: str = DEFAULT_CODEC,
+        shared_memory_threshold: int | None = None,
+    ):
+        self.sock = sock
+        self.idle_timeout = idle_timeout
+        self.codec = codec
+        self.shared_memory_threshold = shared_memory_threshold
+        self.send_lock = threading.Lock()
+        self.calls: dict[int, Call] = {}
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+    def send(self, payload: dict):
+        with self.send_lock:
+            send_message(self.sock, payload, self.codec, self.shared_memory_threshold)
+
+    def serve(self):
+        reader = MessageReader(self.sock, self.codec)
+        while True:
+            try:
+                msg = reader.read(timeout=self.idle_timeout)
+            except socket.timeout:
+                if self.calls:
+                    continue
+                # Idle for too long - exit to release memory
+                break
+            except MessageDecodeError as e:
+                if e.message_id is None:
+                    raise
+                # e.g. args of a class that does not exist in this venv
+                self.send({"id": e.message_id, "ok": False, "error": str(e)})
+                continue
+            if msg is None:
+                # Parent closed the connection
+                break
+            op = msg.get("op")
+            if op == "ping":
+                self.send({"id": msg.get("id"), "pong": True})
+            elif op == "shutdown":
+                break
+            elif op == "call":
+                self.calls[msg["id"]] = Call(self.loop, msg.get("window"))
+                threading.Thread(target=self.run_call, args=(msg,), daemon=True).start()
+            elif op == "cancel":
+                call = self.calls.get(msg["id"])
+                if call is not None:
+                    call.cancel()
+            elif op == "credit":
+                call = self.calls.get(msg["id"])
+                if call is not None:
+                    call.add_credits(msg.get("n", 1))
+            else:
+                self.send(
+                    {"id": msg.get("id"), "ok": False, "error": f"Unknown op {op}"}
+                )
+
+    def run_call(self, msg: dict):
+        call_id = msg["id"]
+        call = self.calls[call_id]
+        args = msg.get("args", [])
+        kwargs = msg.get("kwargs", {})
+        try:
+            func = load_tool(msg["tool_id"])
+            if inspect.isasyncgenfunction(func):
+
+                async def run():
+                    generator = func(*args, **kwargs)
+                    try:
+                        # Only produce a value once it may be sent
+                        while await call.aacquire():
+                            try:
+                                value = await generator.__anext__()
+                            except StopAsyncIteration:
+                                break
+                            self.send({"id": call_id, "ok": True, "stream": value})
+                    finally:
+                        await generator.aclose()
+
+                self.run_coroutine(call, run())
+            elif inspect.isgeneratorfunction(func):
+                generator = func(*args, **kwargs)
+                try:
+                    while call.acquire():
+                        try:
+                            value = next(generator)
+                        except StopIteration:
+                            break
+                        self.send({"id": call_id, "ok": True, "stream": value})
+                finally:
+                    generator.close()
+            elif inspect.iscoroutinefunction(func):
+                result = self.run_coroutine(call, func(*args, **kwargs))
+                self.send({"id": call_id, "ok": True, "result": result})
+            else:
+                result = func(*args, **kwargs)
+                self.send({"id": call_id, "ok": True, "result": result})
+            self.send({"id": call_id, "done": True})
+        except concurrent.futures.CancelledError:
+            self.send({"id": call_id, "done": True})
+        except BaseException:
+            # Includes SystemExit, which would otherwise end this thread
+            # silently and leave the caller waiting
+            try:
+                self.send({"id": call_id, "ok": False, "error": traceback.format_exc()})
+            except OSError:
+                pass
+        finally:
+            self.calls.pop(call_id, None)
+
+    def run_coroutine(self, call: Call, coroutine):
+        call.future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        if call.cancelled:
+            call.future.cancel()
+        return call.future.result()
+
+
+# Fork requests and replies are small JSON datagrams
+MAX_DATAGRAM = 65536
+# Interval at which the fork server checks whether its parent is alive
+PARENT_CHECK_INTERVAL = 1
+
+
+class ForkServer:
+    """
+    Fork a child for every tool call from a process that has already
+    imported tool modules, so calls start without importing them again
+
+    Requests arrive as datagrams on a Unix socket together with the file
+    descriptors of the call connection and of the stderr of the child. The
+    pid of every child is sent back and its exit status follows once it has
+    been reaped.
+    """
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.children: set[int] = set()
+
+    def send(self, payload: dict):
+        self.sock.send(json.dumps(payload).encode())
+
+    def preload(self, modules: list[str]):
+        for module in modules:
+            try:
+                importlib.import_module(module)
+            except BaseException:
+                # Children import the module again and report the error
+                pass
+
+    def serve(self):
+        parent = os.getppid()
+        # SIGCHLD wakes the loop up so exits are reported straight away
+        wakeup, wakeup_write = socket.socketpair()
+        wakeup.setblocking(False)
+        wakeup_write.setblocking(False)
+        signal.set_wakeup_fd(wakeup_write.fileno())
+        signal.signal(signal.SIGCHLD, lambda *_: None)
+        try:
+            while True:
+                ready, _, _ = select.select(
+                    [self.sock, wakeup], [], [], PARENT_CHECK_INTERVAL
+                )
+                if wakeup in ready:
+                    while True:
+                        try:
+                            wakeup.recv(4096)
+                        except BlockingIOError:
+                            break
+                self.reap()
+                if self.sock in ready:
+                    data, fds, _, _ = socket.recv_fds(self.sock, MAX_DATAGRAM, 2)
+                    msg = json.loads(data) if data else {"op": "shutdown"}
+                    if msg.get("op") == "fork" and len(fds) == 2:
+                        self.fork(msg, *fds)
+                        continue
+                    for fd in fds:
+                        os.close(fd)
+                    if msg.get("op") == "shutdown":
+                        break
+                elif os.getppid() != parent:
+                    # Parent exited without shutting the server down
+                    break
+        finally:
+            signal.set_wakeup_fd(-1)
+            wakeup.close()
+            wakeup_write.close()
+
+    def fork(self, msg: dict, conn_fd: int, stderr_fd: int):
+        tool_id = msg["tool_id"]
+        # Later children inherit modules imported here
+        self.preload([".".join(tool_id.split(".")[:-1])])
+        try:
+            pid = os.fork()
+        except OSError:
+            os.close(conn_fd)
+            os.close(stderr_fd)
+            self.send({"id": msg["id"], "error": traceback.format_exc()})
+            return
+        if pid == 0:
+            code = 1
+            try:
+                signal.set_wakeup_fd(-1)
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                self.sock.close()
+                os.dup2(stderr_fd, 2)
+                os.close(stderr_fd)
+                code = self.run_child(msg, conn_fd)
+            finally:
+                os._exit(code)
+        os.close(conn_fd)
+        os.close(stderr_fd)
+        self.children.add(pid)
+        self.send({"id": msg["id"], "pid": pid})
+
+    def run_child(self, msg: dict, conn_fd: int) -> int:
+        try:
+            with socket.socket(fileno=conn_fd) as sock:
+                run_tool(
+                    sock,
+                    msg["tool_id"],
+                    msg.get("codec", DEFAULT_CODEC),
+                    msg.get("shared_memory_threshold"),
+                )
+            return 0
+        except SystemExit as e:
+            # Exit the same way an interpreter would
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            print(e.code, file=sys.stderr)
+            return 1
+        except BaseException:
+            traceback.print_exc()
+            return 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+
+    def reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            self.children.discard(pid)
+            self.send({"exit": pid, "returncode": os.waitstatus_to_exitcode(status)})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--address", required=True)
+    parser.add_argument("--idle-timeout", type=float, default=None)
+    parser.add_argument("--codec", choices=list(CODECS), default=DEFAULT_CODEC)
+    parser.add_argument("--shared-memory-threshold", type=int, default=None)
+    parser.add_argument("--fork-server", action="store_true")
+    parser.add_argument("--preload", action="append", default=[])
+    options = parser.parse_args()
+
+    # Tool modules are resolved against the index folder (the working
+    # directory), never against the folder containing this script
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path = [p for p in sys.path if os.path.abspath(p or ".") != script_dir]
+    sys.path.insert(0, os.getcwd())
+
+    sock = connect(options.address)
+    if options.fork_server:
+        try:
+            server = ForkServer(sock)
+            server.preload(options.preload)
+            server.send({"ready": True, "pid": os.getpid()})
+            server.serve()
+        finally:
+            sock.close()
+        return
+    send_message(sock, {"ready": True, "pid": os.getpid()}, options.codec)
+    try:
+        ToolServer(
+            sock,
+            idle_timeout=options.idle_timeout,
+            codec=options.codec,
+            shared_memory_threshold=options.shared_memory_threshold,
+        ).serve()
+    finally:
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import enum
+import typing as t
+from enum import Enum
+from typing import Any, Dict, List, Literal, Optional, Tuple, TypedDict, Union
+
+
+class Color(Enum):
+    """Primary colors"""
+
+    RED = "red"
+    GREEN = "green"
+    CRIMSON = "red"
+
+    def describe(self):
+        return self.value
+
+
+class Size(int, enum.Enum):
+    SMALL = 1
+    LARGE = 2
+
+
+class Point(TypedDict):
+    x: int
+    y: int
+    label: "Optional[str]"
+
+
+class Shape(TypedDict, total=False):
+    points: List[Point]
+    color: Color
+
+
+def plain(a: str, b: int = 1, *args: float, c: bool = True, **kwargs: bytes) -> str:
+    """
+    Plain builtin annotations
+
+    With a longer description
+    """
+    return a
+
+
+def unannotated(a, b=None, /, c=(1, 2)):
+    return a
+
+
+def generics(
+    a: List[int],
+    b: dict[str, list[float]],
+    c: Tuple[int, ...],
+    d: tuple[str, int],
+    e: t.Dict[str, Any],
+    f: list,
+    g: Dict,
+) -> Dict[str, List[int]]:
+    return {}
+
+
+def unions(
+    a: Optional[int],
+    b: Union[str, int, None] = None,
+    c: str | None = None,
+    d: "int | float" = 1,
+    e: str = None,
+) -> Union[int, str]:
+    return 1
+
+
+def literals(a: Literal["a", "b"], b: Literal[1, -1, None] = -1) -> None:
+    pass
+
+
+def customs(color: Color, size: Size, shapes: List[Shape], point: Point) -> Color:
+    return color
+
+
+async def coroutine(a: str) -> str:
+    return a
+
+
+def generator(n: int):
+    yield from range(n)
+
+
+async def async_generator(n: int):
+    for i in range(n):
+        yield i
+
+
+def nested_yield(n: int) -> list:
+    def inner():
+        yield n
+
+    return list(inner())
+
+
+def decorated_inner(x: int) -> int:
+    return x
+
+
+decorated = staticmethod(decorated_inner)
+
+
+def rebound(x: int) -> int:
+    return x
+
+
+def rebound(x: str) -> str:  # noqa: F811
+    return x
+
+
+class Custom:
+    pass
+
+
+def custom_class(x: Custom) -> int:
+    return 1
+
+
+def non_literal_default(x: int = len("abc")) -> int:
+    return x
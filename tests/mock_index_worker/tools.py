@@ -0,0 +1,33 @@
+import asyncio
+import os
+import time
+
+
+def sleep_echo(bar: str, delay: float = 0.5):
+    time.sleep(delay)
+    return bar
+
+
+async def async_sleep_echo(bar: str, delay: float = 0.5):
+    await asyncio.sleep(delay)
+    return bar
+
+
+def count(limit: int = -1, delay: float = 0.0):
+    i = 0
+    while limit < 0 or i < limit:
+        yield i
+        i += 1
+        time.sleep(delay)
+
+
+async def async_count(limit: int = -1, delay: float = 0.0):
+    i = 0
+    while limit < 0 or i < limit:
+        yield i
+        i += 1
+        await asyncio.sleep(delay)
+
+
+def exit_now(code: int = 3):
+    os._exit(code)
@@ -1,18 +1,23 @@
 import inspect
+import json
 import logging
 import os
 import shutil
+import threading
 import venv
 from enum import Enum
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from inspect import Parameter
 from pathlib import Path
 from typing import Optional, TypedDict, Union
 
 import pytest
 
-from stores.constants import VENV_NAME
+from stores.constants import LOCK_FILENAME, VENV_NAME
 from stores.format import ProviderFormat
-from stores.indexes.venv_utils import HASH_FILE
+from stores.indexes import remote_index
+from stores.indexes.venv_utils import HASH_FILE, SIGNATURE_CACHE_FILE
+from stores.indexes.worker_pool import close_workers
 
 logging.basicConfig()
 logger = logging.getLogger("stores.test_indexes.conftest")
@@ -32,6 +37,76 @@ def local_tools(request):
     yield request.params
 
 
+@pytest.fixture()
+def worker_index_folder():
+    return Path("./tests/mock_index_worker")
+
+
+@pytest.fixture()
+def bare_venv(tmp_path):
+    # A venv without pip is enough to run tools without dependencies
+    venv_folder = tmp_path / "venv"
+    venv.create(venv_folder, symlinks=True, with_pip=False)
+    yield venv_folder
+    close_workers()
+
+
+class Registry(ThreadingHTTPServer):
+    """
+    Stand-in for the stores registry, serving lookups from indexes, a dict of
+    "index_id:index_version" to metadata, and recording the request bodies
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), RegistryHandler)
+        self.indexes = {}
+        self.requests = []
+        self.batch = True
+        # Status to answer every request with, e.g. to simulate rate limits
+        self.status = None
+
+    def lookup(self, index: dict) -> dict | None:
+        return self.indexes.get(f"{index['index_id']}:{index['index_version']}")
+
+
+class RegistryHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["content-length"])))
+        self.server.requests.append(body)
+        if self.server.status is not None:
+            status, result = self.server.status, {"error": "Unavailable"}
+        elif "indexes" in body and self.server.batch:
+            status, result = 200, [self.server.lookup(i) for i in body["indexes"]]
+        elif "indexes" in body:
+            status, result = 400, {"error": "Missing index_id"}
+        else:
+            result = self.server.lookup(body)
+            status = 200 if result else 404
+        data = json.dumps(result).encode()
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture()
+def registry(tmp_path, monkeypatch):
+    server = Registry()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(
+        remote_index, "INDEX_LOOKUP_URL", f"http://127.0.0.1:{server.server_port}/"
+    )
+    monkeypatch.setattr(remote_index, "LOOKUP_CACHE_FILE", tmp_path / "lookups.json")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
 config_files = [
     "pyproject.toml",
     "requirements.txt",
@@ -57,12 +132,14 @@ def remote_index_folder(request):
     # venv_folder = index_folder / VENV_NAME
     # venv.create(venv_folder, symlinks=True, with_pip=True)
     yield index_folder
-    # Clean up venv folder after tests
+    # Clean up workers and venv folder after tests
+    close_workers(index_folder)
     shutil.rmtree(index_folder / VENV_NAME, ignore_errors=True)
-    try:
-        os.remove(index_folder / HASH_FILE)
-    except FileNotFoundError:
-        pass
+    for filename in [HASH_FILE, SIGNATURE_CACHE_FILE, LOCK_FILENAME]:
+        try:
+            os.remove(index_folder / filename)
+        except FileNotFoundError:
+            pass
 
     # Reinstate moved_files
     for src, dst in moved_files:
@@ -325,12 +402,14 @@ def index_folder_custom_class(request):
     venv_folder = index_folder / VENV_NAME
     venv.create(venv_folder, symlinks=True, with_pip=True)
     yield index_folder
-    # Clean up venv folder after tests
+    # Clean up workers and venv folder after tests
+    close_workers(index_folder)
     shutil.rmtree(venv_folder)
-    try:
-        os.remove(index_folder / HASH_FILE)
-    except FileNotFoundError:
-        pass
+    for filename in [HASH_FILE, SIGNATURE_CACHE_FILE]:
+        try:
+            os.remove(index_folder / filename)
+        except FileNotFoundError:
+            pass
 
 
 @pytest.fixture(params=["./tests/mock_index_function_error"])
@@ -340,12 +419,14 @@ def index_folder_function_error(request):
     venv_folder = index_folder / VENV_NAME
     venv.create(venv_folder, symlinks=True, with_pip=True)
     yield index_folder
-    # Clean up venv folder after tests
+    # Clean up workers and venv folder after tests
+    close_workers(index_folder)
     shutil.rmtree(venv_folder)
-    try:
-        os.remove(index_folder / HASH_FILE)
-    except FileNotFoundError:
-        pass
+    for filename in [HASH_FILE, SIGNATURE_CACHE_FILE]:
+        try:
+            os.remove(index_folder / filename)
+        except FileNotFoundError:
+            pass
 
 
 @pytest.fixture(params=ProviderFormat)
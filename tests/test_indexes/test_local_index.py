@@ -1,7 +1,11 @@
+import concurrent.futures
 import json
+import shutil
+import time
 
 import pytest
 
+import stores.indexes.worker_pool as worker_pool
 from stores.indexes import LocalIndex
 
 
@@ -65,9 +69,22 @@ def test_local_index_with_deps(remote_index_folder):
     with pytest.raises(ModuleNotFoundError):
         LocalIndex(remote_index_folder, exclude=["mock_index.not_a_function"])
     # LocalIndex can load index folder with deps if create_venv=True
-    LocalIndex(
+    with LocalIndex(
         remote_index_folder, exclude=["mock_index.not_a_function"], create_venv=True
-    )
+    ):
+        pass
+
+
+def test_local_index_close(remote_index_folder):
+    with LocalIndex(
+        remote_index_folder, exclude=["mock_index.not_a_function"], create_venv=True
+    ) as index:
+        assert index.execute("mock_index.get_package") == "pip_install_test"
+        assert index.execute("mock_index.typed_function", {"bar": "a"}) == "a"
+        index_folder = str(remote_index_folder.resolve())
+        assert any(k[1] == index_folder for k in worker_pool._workers)
+    # Exiting the context should shut down the index workers
+    assert not any(k[1] == index_folder for k in worker_pool._workers)
 
 
 def test_local_index_with_env_var():
@@ -76,3 +93,52 @@ def test_local_index_with_env_var():
         match="Environment variables will only be restricted if create_venv=True when initializing LocalIndex",
     ):
         LocalIndex("", create_venv=False, env_var={"foo": "bar"})
+
+
+async def test_local_index_call_timeout(worker_index_folder, tmp_path):
+    index_folder = tmp_path / "index"
+    shutil.copytree(worker_index_folder, index_folder)
+    with LocalIndex(index_folder, create_venv=True, timeout=30) as index:
+        assert index.execute("tools.sleep_echo", {"bar": "a", "delay": 0}) == "a"
+        # Each call can set a shorter timeout than the index
+        with pytest.raises(TimeoutError):
+            index.execute("tools.sleep_echo", {"bar": "a", "delay": 10}, timeout=0.2)
+        with pytest.raises(TimeoutError):
+            await index.aexecute(
+                "tools.async_sleep_echo", {"bar": "a", "delay": 10}, timeout=0.2
+            )
+        stream = index.stream_execute(
+            "tools.count", {"limit": 3, "delay": 10}, timeout=0.2
+        )
+        assert next(stream) == 0
+        with pytest.raises(TimeoutError):
+            next(stream)
+        stream = index.astream_execute(
+            "tools.async_count", {"limit": 3, "delay": 10}, timeout=0.2
+        )
+        assert await stream.__anext__() == 0
+        with pytest.raises(TimeoutError):
+            await stream.__anext__()
+    # But not a longer one
+    with LocalIndex(index_folder, create_venv=True, timeout=0.2) as index:
+        with pytest.raises(TimeoutError):
+            index.execute("tools.sleep_echo", {"bar": "a", "delay": 10}, timeout=30)
+
+
+def test_local_index_shared_workers(worker_index_folder, tmp_path):
+    index_folder = tmp_path / "index"
+    shutil.copytree(worker_index_folder, index_folder)
+    index = LocalIndex(index_folder, create_venv=True)
+    other = LocalIndex(index_folder, create_venv=True)
+    with concurrent.futures.ThreadPoolExecutor() as pool:
+        call = pool.submit(
+            index.execute, "tools.sleep_echo", {"bar": "a", "delay": 0.5}
+        )
+        time.sleep(0.2)
+        # Closing one index keeps the workers the other is using
+        other.close()
+        other.close()
+        assert call.result() == "a"
+    assert worker_pool._workers
+    index.close()
+    assert not worker_pool._workers
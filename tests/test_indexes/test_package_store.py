@@ -0,0 +1,48 @@
+import os
+
+from stores.indexes.package_store import get_site_packages, link_venv
+
+
+def make_venv(venv_path, files: dict[str, bytes]):
+    site_packages = venv_path / "lib" / "python3.10" / "site-packages"
+    for name, content in files.items():
+        path = site_packages / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+    return site_packages
+
+
+def test_link_venv(tmp_path):
+    store_dir = tmp_path / "store"
+    files = {"pkg/__init__.py": b"x = 1\n", "pkg/data.txt": b"data" * 100}
+    first = make_venv(tmp_path / "first", files)
+    second = make_venv(tmp_path / "second", {**files, "other.py": b"y = 2\n"})
+    (second / "pkg" / "__pycache__").mkdir()
+    (second / "pkg" / "__pycache__" / "__init__.cpython-310.pyc").write_bytes(b"")
+    assert get_site_packages(tmp_path / "first") == [first]
+
+    # The first venv populates the store
+    assert link_venv(tmp_path / "first", store_dir) == 0
+    assert link_venv(tmp_path / "first", store_dir) == 0
+    # Identical files in other venvs are replaced with links to it
+    assert link_venv(tmp_path / "second", store_dir) == 406
+    for name, content in files.items():
+        assert os.path.samefile(first / name, second / name)
+        assert (second / name).read_bytes() == content
+    assert os.stat(second / "other.py").st_nlink == 2
+    assert (
+        os.stat(second / "pkg" / "__pycache__" / "__init__.cpython-310.pyc").st_nlink
+        == 1
+    )
+
+
+def test_link_venv_keeps_modes_apart(tmp_path):
+    store_dir = tmp_path / "store"
+    first = make_venv(tmp_path / "first", {"tool": b"#!/bin/sh\n"})
+    second = make_venv(tmp_path / "second", {"tool": b"#!/bin/sh\n"})
+    os.chmod(second / "tool", 0o755)
+    link_venv(tmp_path / "first", store_dir)
+    assert link_venv(tmp_path / "second", store_dir) == 0
+    assert not os.path.samefile(first / "tool", second / "tool")
+    assert os.access(second / "tool", os.X_OK)
+    assert not os.access(first / "tool", os.X_OK)
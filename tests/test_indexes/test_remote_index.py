@@ -1,7 +1,10 @@
 import logging
 import shutil
+import tarfile
 
 import pytest
+import requests
+from git import GitCommandError, Repo
 
 import stores.indexes
 
@@ -21,6 +24,106 @@ def test_lookup_index():
     }
 
 
+def test_lookup_cache(registry, monkeypatch):
+    metadata = {
+        "clone_url": "https://github.com/silanthro/send-gmail.git",
+        "commit": "9cde5755e9ecd627a6f303421031d2a7fef9427d",
+        "version": "0.1.0",
+    }
+    registry.indexes["silanthro/send-gmail:0.1.0"] = metadata
+    lookup_index = stores.indexes.remote_index.lookup_index
+    assert lookup_index("silanthro/send-gmail", "0.1.0") == metadata
+    assert lookup_index("silanthro/send-gmail", "0.1.0") == metadata
+    assert len(registry.requests) == 1
+
+    # Misses are cached too
+    for _ in range(2):
+        with pytest.raises(ValueError, match="not found in database"):
+            lookup_index("no_such_index")
+    assert len(registry.requests) == 2
+
+    # Until they expire
+    monkeypatch.setattr(stores.indexes.remote_index, "NEGATIVE_LOOKUP_TTL", 0)
+    with pytest.raises(ValueError, match="not found in database"):
+        lookup_index("no_such_index")
+    assert lookup_index("silanthro/send-gmail", "0.1.0") == metadata
+    assert len(registry.requests) == 3
+
+
+@pytest.mark.parametrize("status", [401, 429, 500])
+def test_lookup_error_not_cached(registry, status):
+    registry.indexes["silanthro/send-gmail:None"] = {"commit": "abc"}
+    registry.status = status
+    with pytest.raises(requests.HTTPError):
+        stores.indexes.remote_index.lookup_index("silanthro/send-gmail")
+    # Errors are not mistaken for indexes missing from the registry
+    registry.status = None
+    assert stores.indexes.remote_index.lookup_index("silanthro/send-gmail") == {
+        "commit": "abc"
+    }
+    assert len(registry.requests) == 2
+
+
+def test_remote_index_lookup_error(registry, tmp_path):
+    registry.status = 429
+    # The index is not fetched from GitHub instead, which may be another repo
+    with pytest.raises(requests.HTTPError):
+        stores.indexes.RemoteIndex("silanthro/send-gmail", cache_dir=tmp_path)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_index_invalid_id(registry, tmp_path):
+    with pytest.raises(ValueError, match='Unable to load index "a:b:c"'):
+        stores.indexes.Index(["a:b:c", "silanthro/send-gmail"], cache_dir=tmp_path)
+    assert registry.requests == []
+
+
+@pytest.mark.parametrize("batch", [True, False])
+def test_lookup_indexes(registry, batch):
+    registry.batch = batch
+    registry.indexes["silanthro/send-gmail:None"] = {"commit": "abc"}
+    registry.indexes["silanthro/filesystem:0.2.0"] = {"commit": "def"}
+    indexes = [
+        ("silanthro/send-gmail", None),
+        ("silanthro/filesystem", "0.2.0"),
+        ("no_such_index", None),
+    ]
+    results = stores.indexes.remote_index.lookup_indexes(indexes)
+    assert results == {
+        indexes[0]: {"commit": "abc"},
+        indexes[1]: {"commit": "def"},
+        indexes[2]: None,
+    }
+    # One batch request, or one request per index if batches are unsupported
+    assert len(registry.requests) == (1 if batch else 4)
+    assert stores.indexes.remote_index.lookup_indexes(indexes) == results
+    assert len(registry.requests) == (1 if batch else 4)
+
+
+def test_index_lookup_batch(registry, tmp_path, monkeypatch):
+    registry.indexes["silanthro/send-gmail:None"] = {"commit": "abc"}
+    registry.indexes["silanthro/filesystem:0.2.0"] = {"commit": "def"}
+    looked_up = []
+
+    class FakeRemoteIndex(stores.indexes.BaseIndex):
+        def __init__(self, index_id, **kwargs):
+            index_id, index_version = stores.indexes.remote_index.split_index_id(
+                index_id
+            )
+            looked_up.append(
+                stores.indexes.remote_index.lookup_index(index_id, index_version)
+            )
+            super().__init__([])
+
+    monkeypatch.setattr(stores.indexes.index, "RemoteIndex", FakeRemoteIndex)
+    stores.indexes.Index(
+        ["silanthro/send-gmail", "silanthro/filesystem:0.2.0"],
+        cache_dir=tmp_path / "cache",
+    )
+    assert looked_up == [{"commit": "abc"}, {"commit": "def"}]
+    assert len(registry.requests) == 1
+
+
 async def test_fake_remote_index():
     fake_index = "no_such_index"
     with pytest.raises(ValueError, match=f"Index {fake_index} not found"):
@@ -55,3 +158,102 @@ async def test_remote_index_2():
         env_var={"ALLOWED_DIR": "./test"},
     )
     shutil.rmtree(stores.indexes.remote_index.CACHE_DIR / "silanthro/filesystem:0.2.0")
+
+
+@pytest.fixture
+def index_repo(tmp_path):
+    repo = Repo.init(tmp_path / "repo")
+    commits = []
+    for version in ["0.1.0", "0.2.0"]:
+        (tmp_path / "repo" / "tools.py").write_text(f'VERSION = "{version}"\n')
+        repo.index.add(["tools.py"])
+        commits.append(repo.index.commit(version).hexsha)
+        repo.create_tag(version)
+    return (tmp_path / "repo").as_uri(), commits
+
+
+@pytest.mark.parametrize("ref", ["full_hash", "tag", "short_hash", None])
+def test_fetch_worktree(index_repo, tmp_path, ref):
+    repo_url, commits = index_repo
+    commit_like = {
+        "full_hash": commits[0],
+        "tag": "0.1.0",
+        "short_hash": commits[0][:7],
+        None: None,
+    }[ref]
+    mirrors_dir = tmp_path / "mirrors"
+    repo = stores.indexes.remote_index.fetch_worktree(
+        repo_url, tmp_path / "index", commit_like, mirrors_dir
+    )
+    expected = commits[-1] if ref is None else commits[0]
+    assert repo.head.commit.hexsha == expected
+    (mirror_path,) = mirrors_dir.iterdir()
+    mirror = Repo(mirror_path)
+    if ref != "short_hash":
+        # Only the requested commit is fetched
+        assert mirror.git.rev_parse("--is-shallow-repository") == "true"
+        assert int(mirror.git.rev_list("--count", "--all", expected)) == 1
+
+
+def test_fetch_worktree_versions(index_repo, tmp_path):
+    repo_url, commits = index_repo
+    mirrors_dir = tmp_path / "mirrors"
+    index_folders = [tmp_path / f"index:{version}" for version in ["0.1.0", "0.2.0"]]
+    for index_folder, commit in zip(index_folders, commits, strict=True):
+        repo = stores.indexes.remote_index.fetch_worktree(
+            repo_url, index_folder, commit, mirrors_dir
+        )
+        assert repo.head.commit.hexsha == commit
+        assert (index_folder / "tools.py").exists()
+    # Both versions share one mirror
+    (mirror_path,) = mirrors_dir.iterdir()
+    worktrees = Repo(mirror_path).git.worktree("list", "--porcelain")
+    assert worktrees.count("worktree ") == 3
+
+    # Failed fetches do not leave empty mirrors behind
+    with pytest.raises(GitCommandError):
+        stores.indexes.remote_index.fetch_worktree(
+            (tmp_path / "missing").as_uri(), tmp_path / "missing", None, mirrors_dir
+        )
+    assert list(mirrors_dir.iterdir()) == [mirror_path]
+
+    # A deleted version can be checked out again
+    shutil.rmtree(index_folders[0])
+    repo = stores.indexes.remote_index.fetch_worktree(
+        repo_url, index_folders[0], commits[0], mirrors_dir
+    )
+    assert repo.head.commit.hexsha == commits[0]
+
+
+def test_download_tarball(tmp_path, monkeypatch):
+    source = tmp_path / "send-gmail-9cde575"
+    source.mkdir()
+    (source / "tools.py").write_text("VERSION = '0.1.0'\n")
+    archive = tmp_path / "archive.tar.gz"
+    with tarfile.open(archive, "w:gz") as tar:
+        tar.add(source, arcname=source.name)
+
+    requested = []
+
+    def get(url, **kwargs):
+        requested.append(url)
+        response = requests.Response()
+        response.status_code = 200
+        response.raw = open(archive, "rb")
+        return response
+
+    monkeypatch.setattr(stores.indexes.remote_index.requests, "get", get)
+    index_folder = tmp_path / "cache" / "silanthro" / "send-gmail"
+    stores.indexes.remote_index.download_tarball(
+        "https://github.com/silanthro/send-gmail.git", index_folder, "9cde575"
+    )
+    assert requested == [
+        "https://codeload.github.com/silanthro/send-gmail/tar.gz/9cde575"
+    ]
+    assert (index_folder / "tools.py").read_text() == "VERSION = '0.1.0'\n"
+    assert list(index_folder.parent.iterdir()) == [index_folder]
+
+    with pytest.raises(ValueError, match="Unable to download"):
+        stores.indexes.remote_index.download_tarball(
+            "https://gitlab.com/silanthro/send-gmail.git", tmp_path / "other", None
+        )
@@ -0,0 +1,81 @@
+import shutil
+import sys
+import venv
+from pathlib import Path
+
+import pytest
+
+import stores.indexes.venv_utils as venv_utils
+from stores.constants import VENV_NAME
+from stores.indexes.static_signatures import get_static_signatures
+from stores.indexes.worker_pool import close_workers
+
+PYTHON_VERSION = "{}.{}".format(*sys.version_info)
+STATIC_TOOLS = [
+    "tools.plain",
+    "tools.unannotated",
+    "tools.generics",
+    "tools.unions",
+    "tools.literals",
+    "tools.customs",
+    "tools.coroutine",
+    "tools.generator",
+    "tools.async_generator",
+    "tools.nested_yield",
+]
+DYNAMIC_TOOLS = [
+    "tools.decorated",
+    "tools.rebound",
+    "tools.custom_class",
+    "tools.non_literal_default",
+    "missing.tool",
+]
+
+
+@pytest.fixture()
+def static_index_folder():
+    return Path("./tests/mock_index_static")
+
+
+def test_static_signatures_match_dynamic(static_index_folder, bare_venv):
+    signatures = get_static_signatures(
+        STATIC_TOOLS + DYNAMIC_TOOLS, static_index_folder, PYTHON_VERSION
+    )
+    # Anything that cannot be read from source is left to the dynamic runner
+    assert list(signatures) == STATIC_TOOLS
+    expected, errors = venv_utils.get_tool_signatures(
+        STATIC_TOOLS, static_index_folder, venv=str(bare_venv)
+    )
+    assert not errors
+    assert signatures == expected
+
+
+def test_static_signatures_python_version(static_index_folder):
+    def param_type(python_version):
+        signatures = get_static_signatures(
+            ["tools.unions"], static_index_folder, python_version
+        )
+        return signatures["tools.unions"]["params"]["e"]["type"]
+
+    # get_type_hints made parameters defaulting to None Optional until 3.11
+    assert param_type("3.10.4") == "Union"
+    assert param_type("3.11.2") == "str"
+    assert get_static_signatures(["tools.unions"], static_index_folder) == {}
+
+
+def test_init_venv_tools_static(static_index_folder, tmp_path, monkeypatch):
+    index_folder = tmp_path / "index"
+    shutil.copytree(static_index_folder, index_folder)
+    venv.create(index_folder / VENV_NAME, symlinks=True, with_pip=False)
+
+    def get_tool_signatures(tool_ids, **kwargs):
+        raise AssertionError(f"{tool_ids} were introspected in a subprocess")
+
+    monkeypatch.setattr(venv_utils, "get_tool_signatures", get_tool_signatures)
+    try:
+        tools = venv_utils.init_venv_tools(index_folder)
+        assert [t.__name__ for t in tools] == STATIC_TOOLS
+        assert tools[0]("a") == "a"
+        assert list(tools[7](3)) == [0, 1, 2]
+    finally:
+        close_workers(index_folder)
@@ -0,0 +1,197 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import stores.indexes.venv_utils as venv_utils
+from stores.indexes.transport import RUNTIME_IMPORT, SUPPORTED_TRANSPORTS, Transport
+from stores.indexes.worker_pool import VenvWorker
+
+TRANSPORTS = [
+    t
+    for t in SUPPORTED_TRANSPORTS
+    if os.name != "nt" or t not in ["socketpair", "unix"]
+]
+
+
+@pytest.fixture(params=TRANSPORTS)
+def transport(request):
+    yield request.param
+
+
+def test_transport_echo(transport):
+    channel = Transport(transport)
+    runner = f"""
+{RUNTIME_IMPORT}
+with runtime.connect("{channel.address}") as sock:
+    sock.sendall(sock.recv(1024).upper())
+"""
+    proc = subprocess.Popen([sys.executable, "-c", runner], pass_fds=channel.pass_fds)
+    with channel.accept(timeout=10) as sock:
+        sock.sendall(b"hello")
+        assert sock.recv(1024) == b"HELLO"
+    assert proc.wait() == 0
+
+
+def test_transport_invalid():
+    with pytest.raises(ValueError, match="Unsupported transport"):
+        Transport("carrier-pigeon")
+
+
+def test_worker_transport(local_index_folder, transport):
+    worker = VenvWorker(sys.executable, local_index_folder, transport=transport)
+    try:
+        assert worker.call("tools.foo", ["hello"]) == "hello"
+        assert worker.ping()
+    finally:
+        worker.close()
+
+
+async def test_subprocess_executor_transport(local_index_folder, bare_venv, transport):
+    kwargs = {
+        "index_folder": local_index_folder,
+        "venv": str(bare_venv),
+        "executor": "subprocess",
+        "transport": transport,
+    }
+    assert venv_utils.run_remote_tool("tools.foo", args=["a"], **kwargs) == "a"
+    assert await venv_utils.arun_remote_tool("tools.foo", args=["c"], **kwargs) == "c"
+    # Large arguments and results pass through shared memory
+    bar = "x" * 100_000
+    assert (
+        venv_utils.run_remote_tool(
+            "tools.foo", args=[bar], shared_memory_threshold=0, **kwargs
+        )
+        == bar
+    )
+    values = [
+        v
+        async for v in venv_utils.run_remote_tool(
+            "tools.stream_input", args=["b"], stream=True, **kwargs
+        )
+    ]
+    assert values == ["b"] * 3
+    values = list(
+        venv_utils.stream_remote_tool("tools.stream_input", args=["d"], **kwargs)
+    )
+    assert values == ["d"] * 3
+    signature = venv_utils.get_tool_signature(
+        "tools.foo", local_index_folder, venv=str(bare_venv), transport=transport
+    )
+    assert signature["tool_id"] == "tools.foo"
+
+
+async def test_subprocess_executor_concurrent(worker_index_folder, bare_venv):
+    start = time.monotonic()
+    results = await asyncio.gather(
+        *[
+            venv_utils.arun_remote_tool(
+                "tools.async_sleep_echo",
+                worker_index_folder,
+                args=[str(i), 1],
+                venv=str(bare_venv),
+                executor="subprocess",
+            )
+            for i in range(4)
+        ]
+    )
+    # Each call runs in its own interpreter without blocking the event loop
+    assert time.monotonic() - start < 3
+    assert results == [str(i) for i in range(4)]
+
+
+def test_transport_accept_child_exit(transport):
+    if transport == "socketpair":
+        pytest.skip("Socket pairs are connected before the child starts")
+    channel = Transport(transport)
+    proc = subprocess.Popen([sys.executable, "-c", "raise SystemExit(3)"])
+    start = time.monotonic()
+    with pytest.raises(ChildProcessError, match="code 3"):
+        channel.accept(timeout=30, exit_code=proc.poll)
+    assert time.monotonic() - start < 5
+
+
+async def test_subprocess_executor_timeout(worker_index_folder, bare_venv):
+    kwargs = {
+        "index_folder": worker_index_folder,
+        "venv": str(bare_venv),
+        "executor": "subprocess",
+        "timeout": 0.5,
+    }
+    start = time.monotonic()
+    with pytest.raises(TimeoutError, match="timed out after 0.5s"):
+        venv_utils.run_remote_tool("tools.sleep_echo", args=["a", 10], **kwargs)
+    with pytest.raises(TimeoutError):
+        await venv_utils.arun_remote_tool(
+            "tools.async_sleep_echo", args=["a", 10], **kwargs
+        )
+    with pytest.raises(TimeoutError):
+        list(venv_utils.stream_remote_tool("tools.count", args=[5, 10], **kwargs))
+    assert time.monotonic() - start < 10
+    assert (
+        venv_utils.run_remote_tool("tools.sleep_echo", args=["b", 0], **kwargs) == "b"
+    )
+
+
+async def test_forkserver_executor(worker_index_folder, bare_venv):
+    kwargs = {
+        "index_folder": worker_index_folder,
+        "venv": str(bare_venv),
+        "executor": "forkserver",
+    }
+    assert (
+        venv_utils.run_remote_tool("tools.sleep_echo", args=["a", 0], **kwargs) == "a"
+    )
+    assert (
+        await venv_utils.arun_remote_tool(
+            "tools.async_sleep_echo", args=["b", 0], **kwargs
+        )
+        == "b"
+    )
+    assert list(
+        venv_utils.stream_remote_tool("tools.count", args=[3], **kwargs)
+    ) == list(range(3))
+    values = [
+        v
+        async for v in venv_utils.run_remote_tool(
+            "tools.async_count", args=[3], stream=True, **kwargs
+        )
+    ]
+    assert values == list(range(3))
+    # Calls are forked from a running server instead of starting an interpreter
+    start = time.monotonic()
+    for _ in range(10):
+        venv_utils.run_remote_tool("tools.sleep_echo", args=["a", 0], **kwargs)
+    assert time.monotonic() - start < 1
+    with pytest.raises(RuntimeError, match="exit code 3"):
+        venv_utils.run_remote_tool("tools.exit_now", args=[3], **kwargs)
+    with pytest.raises(TimeoutError):
+        venv_utils.run_remote_tool(
+            "tools.sleep_echo", args=["a", 10], timeout=0.5, **kwargs
+        )
+    with pytest.raises(ValueError, match="socketpair"):
+        venv_utils.run_remote_tool(
+            "tools.sleep_echo", args=["a", 0], transport="tcp", **kwargs
+        )
+
+
+async def test_forkserver_executor_concurrent(worker_index_folder, bare_venv):
+    start = time.monotonic()
+    results = await asyncio.gather(
+        *[
+            venv_utils.arun_remote_tool(
+                "tools.sleep_echo",
+                worker_index_folder,
+                args=[str(i), 1],
+                venv=str(bare_venv),
+                executor="forkserver",
+            )
+            for i in range(4)
+        ]
+    )
+    # Sync tools run in separate children so they overlap
+    assert time.monotonic() - start < 3
+    assert results == [str(i) for i in range(4)]
@@ -1,12 +1,19 @@
 import inspect
+import json
 import logging
+import shutil
+import subprocess
 import venv
 from typing import get_args, get_origin, get_type_hints
 
 import pytest
 
 import stores.indexes.venv_utils as venv_utils
-from stores.constants import VENV_NAME
+from stores.cli import main
+from stores.constants import LOCK_FILENAME, SIGNATURES_FILENAME, VENV_NAME
+from stores.indexes.package_store import get_site_packages
+from stores.indexes.worker_pool import close_workers
+from stores.indexes.worker_runtime import SIGNATURE_SCHEMA_VERSION
 
 logging.basicConfig()
 logger = logging.getLogger("tests.test_indexes.test_venv_utils")
@@ -19,6 +26,212 @@ def test_init_venv_tools_without_venv(remote_index_folder):
         venv_utils.init_venv_tools(remote_index_folder)
 
 
+def test_get_installer(monkeypatch, tmp_path):
+    monkeypatch.setattr(venv_utils.shutil, "which", lambda cmd: None)
+    assert venv_utils.get_installer() == "pip"
+    with pytest.raises(RuntimeError, match="not on PATH"):
+        venv_utils.get_installer("uv")
+    with pytest.raises(ValueError, match="Unsupported installer"):
+        venv_utils.get_installer("conda")
+
+    monkeypatch.setattr(venv_utils.shutil, "which", lambda cmd: f"/usr/bin/{cmd}")
+    assert venv_utils.get_installer() == "uv"
+    assert venv_utils.get_installer("pip") == "pip"
+    venv_folder = tmp_path / VENV_NAME
+    assert venv_utils.get_pip_command(venv_folder, "requirements.txt", "uv") == [
+        "uv",
+        "pip",
+        "install",
+        "--python",
+        venv_utils.get_python_command(venv_folder),
+        "-r",
+        "requirements.txt",
+    ]
+
+
+def test_init_venv_with_pip(tmp_path, monkeypatch):
+    monkeypatch.setattr(venv_utils, "VENV_TEMPLATE_DIR", tmp_path / "templates")
+    venv_folder = tmp_path / VENV_NAME
+    venv_utils.init_venv(venv_folder, installer="pip")
+    assert venv_utils.get_pip_path(venv_folder).exists()
+
+    # Further venvs are cloned from the same template
+    clone_folder = tmp_path / "clone"
+    venv_utils.init_venv(clone_folder, installer="pip")
+    assert len(list((tmp_path / "templates").iterdir())) == 1
+    python = venv_utils.get_python_command(clone_folder)
+    prefix = subprocess.check_output([python, "-c", "import sys; print(sys.prefix)"])
+    assert prefix.decode().strip() == str(clone_folder)
+    pip_version = subprocess.check_output(
+        [str(venv_utils.get_pip_path(clone_folder)), "--version"]
+    )
+    assert str(clone_folder) in pip_version.decode()
+
+
+def test_base_layer(remote_index_folder, tmp_path, monkeypatch):
+    monkeypatch.setattr(venv_utils, "BASE_LAYER_DIR", tmp_path / "base")
+    venv_folder = remote_index_folder / VENV_NAME
+    venv_utils.init_venv(venv_folder, installer="pip")
+    venv_utils.install_venv_deps(
+        remote_index_folder, installer="pip", base_layer=["pip-install-test==0.5"]
+    )
+    # Dependencies provided by the base layer are not installed again
+    (base_path,) = (tmp_path / "base").iterdir()
+    assert venv_utils.get_distributions(base_path)["pip-install-test"] == "0.5"
+    assert "pip-install-test" not in venv_utils.get_distributions(venv_folder)
+    tools = venv_utils.init_venv_tools(
+        remote_index_folder, include=["mock_index.get_package"]
+    )
+    assert tools[0]() == "pip_install_test"
+
+    # Dropping the layer installs them into the venv instead
+    result = venv_utils.install_venv_deps(remote_index_folder, installer="pip")
+    assert result != "Already installed"
+    assert "pip-install-test" in venv_utils.get_distributions(venv_folder)
+
+
+def test_offline_install(remote_index_folder, tmp_path, monkeypatch):
+    monkeypatch.setattr(venv_utils, "WHEELHOUSE_DIR", tmp_path / "wheelhouses")
+    venv_folder = remote_index_folder / VENV_NAME
+    venv_utils.init_venv(venv_folder, installer="pip")
+    wheelhouse = tmp_path / "wheelhouse"
+    main(["wheelhouse", str(remote_index_folder), "--wheelhouse", str(wheelhouse)])
+    lock = (remote_index_folder / LOCK_FILENAME).read_text().splitlines()
+    assert lock[1:] == ["pip-install-test==0.5"]
+    wheels = {w.name.split("-")[0] for w in wheelhouse.iterdir()}
+    assert "pip_install_test" in wheels
+    # The build backend is saved to build packaged indexes offline
+    is_package = (remote_index_folder / "pyproject.toml").exists()
+    assert ("hatchling" in wheels) == is_package
+
+    # Install from an archive of the wheelhouse without reaching an index
+    archive = shutil.make_archive(
+        tmp_path / "wheelhouse", "gztar", tmp_path, "wheelhouse"
+    )
+    result = venv_utils.install_venv_deps(
+        remote_index_folder, installer="pip", wheelhouse=archive
+    )
+    assert "--no-index" in result
+    assert f"--no-deps -r {LOCK_FILENAME}" in result
+    assert result.endswith(' ."') == is_package
+    assert ("mock-index" in venv_utils.get_distributions(venv_folder)) == is_package
+    tools = venv_utils.init_venv_tools(
+        remote_index_folder, include=["mock_index.get_package"]
+    )
+    assert tools[0]() == "pip_install_test"
+
+
+def test_shared_venv(tmp_path, monkeypatch):
+    monkeypatch.setattr(venv_utils, "VENV_TEMPLATE_DIR", tmp_path / "templates")
+    venvs_dir = tmp_path / "venvs"
+    versions = []
+    for version in ["v1", "v2", "v3"]:
+        index_folder = tmp_path / version
+        shutil.copytree("tests/mock_index_w_deps", index_folder)
+        (index_folder / "pyproject.toml").unlink()
+        versions.append(index_folder)
+    with open(versions[1] / "mock_index" / "__init__.py", "a") as f:
+        f.write("\n# changed\n")
+    with open(versions[2] / "requirements.txt", "a") as f:
+        f.write("\n# changed\n")
+
+    v1_venv, v2_venv, v3_venv = [
+        venv_utils.init_shared_venv(v, venvs_dir, installer="pip") for v in versions
+    ]
+    # Versions with the same dependencies share a venv
+    assert v1_venv == v2_venv != v3_venv
+    assert (versions[1] / VENV_NAME).resolve() == v1_venv.resolve()
+    assert venv_utils.install_venv_deps(versions[0], installer="pip") != (
+        "Already installed"
+    )
+    assert venv_utils.install_venv_deps(versions[1], installer="pip") == (
+        "Already installed"
+    )
+    try:
+        tools = venv_utils.init_venv_tools(
+            versions[1], include=["mock_index.get_package"]
+        )
+        assert tools[0]() == "pip_install_test"
+    finally:
+        close_workers(versions[1])
+
+
+def test_shared_venv_package(tmp_path, monkeypatch):
+    monkeypatch.setattr(venv_utils, "VENV_TEMPLATE_DIR", tmp_path / "templates")
+    venvs_dir = tmp_path / "venvs"
+    versions = []
+    for version in ["v1", "v2"]:
+        index_folder = tmp_path / version
+        shutil.copytree("tests/mock_index_w_deps", index_folder)
+        (index_folder / "requirements.txt").unlink()
+        versions.append(index_folder)
+    # Indexes installed into their venv do not share it, even with the same
+    # dependencies
+    venvs = [
+        venv_utils.init_shared_venv(v, venvs_dir, installer="pip") for v in versions
+    ]
+    assert venvs == [v / VENV_NAME for v in versions]
+    assert not any(v.is_symlink() for v in venvs)
+    assert not venvs_dir.exists()
+
+
+def test_incremental_install(tmp_path, monkeypatch):
+    monkeypatch.setattr(venv_utils, "VENV_TEMPLATE_DIR", tmp_path / "templates")
+    index_folder = tmp_path / "index"
+    shutil.copytree("tests/mock_index_w_deps", index_folder)
+    venv_folder = index_folder / VENV_NAME
+    venv_utils.init_venv(venv_folder, installer="pip")
+    result = venv_utils.install_venv_deps(index_folder, installer="pip")
+    # Every config file is installed
+    assert result.endswith('install . -r requirements.txt"')
+    # The installed set is recorded without resolving dependencies again
+    assert venv_utils.load_resolved(venv_folder) == {"pip-install-test": "0.5"}
+
+    # Only changed requirements are installed again
+    (index_folder / "requirements.txt").write_text("pip-install-test==0.5\nsix\n")
+    result = venv_utils.install_venv_deps(index_folder, installer="pip")
+    assert "--no-deps six==" in result
+    assert "pip-install-test" not in result
+    # The index itself is reinstalled as its config changed
+    assert result.endswith(' ."')
+    assert "six" in venv_utils.get_distributions(venv_folder)
+
+    # Dropped requirements are removed
+    (index_folder / "requirements.txt").write_text("pip-install-test==0.5\n")
+    result = venv_utils.install_venv_deps(index_folder, installer="pip")
+    assert result.startswith("Uninstalled six; ")
+    assert "six" not in venv_utils.get_distributions(venv_folder)
+    assert venv_utils.install_venv_deps(index_folder) == "Already installed"
+
+
+def test_precompile(tmp_path, monkeypatch):
+    monkeypatch.setattr(venv_utils, "VENV_TEMPLATE_DIR", tmp_path / "templates")
+    index_folder = tmp_path / "index"
+    shutil.copytree("tests/mock_index_w_deps", index_folder)
+    (index_folder / "pyproject.toml").unlink()
+    venv_folder = index_folder / VENV_NAME
+    venv_utils.init_venv(venv_folder, installer="uv" if shutil.which("uv") else "pip")
+    venv_utils.install_venv_deps(index_folder)
+    # Index sources and installed packages are compiled after install
+    assert list((index_folder / "mock_index" / "__pycache__").glob("__init__.*.pyc"))
+    (site_packages,) = get_site_packages(venv_folder)
+    assert list((site_packages / "pip_install_test" / "__pycache__").glob("*.pyc"))
+
+    # Bytecode can be kept outside the venv and index folder
+    prefix = tmp_path / "pycache"
+    shutil.rmtree(index_folder / "mock_index" / "__pycache__")
+    (index_folder / venv_utils.HASH_FILE).unlink()
+    venv_utils.install_venv_deps(index_folder, pycache_prefix=prefix)
+    assert not (index_folder / "mock_index" / "__pycache__").exists()
+    cached = prefix / str(index_folder.absolute()).lstrip("/") / "mock_index"
+    assert list(cached.glob("__init__.*.pyc"))
+    python = venv_utils.get_python_command(venv_folder)
+    output = subprocess.check_output(
+        [python, "-c", "import sys; print(sys.pycache_prefix)"]
+    )
+    assert output.decode().strip() == str(prefix.absolute())
+
+
 def test_init_venv_tools_without_install(remote_index_folder):
     # Create venv
     venv_folder = remote_index_folder / VENV_NAME
@@ -38,10 +251,11 @@ async def test_install_venv_deps(remote_index_folder):
 
     for config_file in venv_utils.SUPPORTED_CONFIGS:
         if (remote_index_folder / config_file).exists():
-            assert result.endswith(
-                f'"{" ".join(venv_utils.get_pip_command(venv_folder, config_file))}"'
+            pip_command = venv_utils.get_pip_command(
+                venv_folder, config_file, venv_utils.get_installer()
             )
-            assert venv_utils.has_installed(remote_index_folder / config_file)
+            assert result.endswith(f'"{" ".join(pip_command)}"')
+            assert venv_utils.has_installed(remote_index_folder)
             break
 
     # Running install again should show "Already installed"
@@ -105,10 +319,11 @@ async def test_install_venv_deps_with_include(remote_index_folder):
 
     for config_file in venv_utils.SUPPORTED_CONFIGS:
         if (remote_index_folder / config_file).exists():
-            assert result.endswith(
-                f'"{" ".join(venv_utils.get_pip_command(venv_folder, config_file))}"'
+            pip_command = venv_utils.get_pip_command(
+                venv_folder, config_file, venv_utils.get_installer()
             )
-            assert venv_utils.has_installed(remote_index_folder / config_file)
+            assert result.endswith(f'"{" ".join(pip_command)}"')
+            assert venv_utils.has_installed(remote_index_folder)
             break
 
     # Running install again should show "Already installed"
@@ -143,7 +358,7 @@ def test_parse_param_type_with_forward_ref():
         "type": "TypedDict",
         "type_name": "Person",
         "fields": {
-            "name": {"type": str},
+            "name": {"type": "str"},
             "friends": {
                 "type": "List",
                 "item_type": {
@@ -172,3 +387,154 @@ def test_parse_param_type_with_forward_ref():
 def test_parse_param_type_with_invalid_type():
     with pytest.raises(TypeError, match="Invalid param type"):
         venv_utils.parse_param_type({"type": "not a type"})
+
+
+@pytest.mark.parametrize("executor", venv_utils.SUPPORTED_EXECUTORS)
+def test_remote_generator_tool(worker_index_folder, bare_venv, executor):
+    signature = venv_utils.get_tool_signature(
+        "tools.count", worker_index_folder, venv=str(bare_venv)
+    )
+    count = venv_utils.parse_tool_signature(
+        signature, worker_index_folder, venv=str(bare_venv), executor=executor
+    )
+    assert inspect.isgeneratorfunction(count)
+    assert list(count(5)) == list(range(5))
+    # Closing an infinite stream early stops the tool
+    stream = count(-1, 0.01)
+    assert [next(stream) for _ in range(3)] == [0, 1, 2]
+    stream.close()
+
+
+def test_signature_cache(worker_index_folder, tmp_path, monkeypatch):
+    index_folder = tmp_path / "index"
+    shutil.copytree(worker_index_folder, index_folder)
+    venv.create(index_folder / VENV_NAME, symlinks=True, with_pip=False)
+    try:
+        tools = venv_utils.init_venv_tools(index_folder)
+        assert (index_folder / venv_utils.SIGNATURE_CACHE_FILE).exists()
+
+        # A warm start does not extract signatures again
+        def get_tool_signatures(tool_ids, **kwargs):
+            raise AssertionError(f"Signatures of {tool_ids} were not cached")
+
+        monkeypatch.setattr(venv_utils, "get_tool_signatures", get_tool_signatures)
+        cached_tools = venv_utils.init_venv_tools(index_folder)
+        assert [t.__name__ for t in cached_tools] == [t.__name__ for t in tools]
+        assert list(cached_tools[2](3)) == [0, 1, 2]
+
+        # Editing a tool module invalidates its signatures
+        with open(index_folder / "tools.py", "a") as f:
+            f.write("\n# changed\n")
+        with pytest.raises(AssertionError, match="not cached"):
+            venv_utils.init_venv_tools(index_folder)
+        monkeypatch.undo()
+        venv_utils.init_venv_tools(index_folder)
+
+        # So does a change of dependencies
+        (index_folder / venv_utils.HASH_FILE).write_text("new")
+        monkeypatch.setattr(venv_utils, "get_tool_signatures", get_tool_signatures)
+        with pytest.raises(AssertionError, match="not cached"):
+            venv_utils.init_venv_tools(index_folder)
+    finally:
+        close_workers(index_folder)
+
+
+def test_published_signatures(worker_index_folder, tmp_path, monkeypatch, caplog):
+    index_folder = tmp_path / "index"
+    shutil.copytree(worker_index_folder, index_folder)
+    venv.create(index_folder / VENV_NAME, symlinks=True, with_pip=False)
+    try:
+        main(["signatures", str(index_folder)])
+        with open(index_folder / SIGNATURES_FILENAME) as f:
+            published = json.load(f)
+        assert published["schema_version"] == SIGNATURE_SCHEMA_VERSION
+        assert list(published["modules"]) == ["tools"]
+
+        # Tools are built from the published file without introspection
+        def get_tool_signatures(tool_ids, **kwargs):
+            raise AssertionError(f"Signatures of {tool_ids} were not published")
+
+        monkeypatch.setattr(venv_utils, "get_tool_signatures", get_tool_signatures)
+        tools = venv_utils.init_venv_tools(index_folder)
+        assert [t.__name__ for t in tools] == list(published["tools"])
+        assert list(tools[2](3)) == [0, 1, 2]
+        assert not (index_folder / venv_utils.SIGNATURE_CACHE_FILE).exists()
+
+        # Signatures that do not match the tool module are not trusted
+        with open(index_folder / "tools.py", "a") as f:
+            f.write("\n# changed\n")
+        with pytest.raises(AssertionError, match="not published"):
+            venv_utils.init_venv_tools(index_folder)
+        assert "does not match its source" in caplog.text
+    finally:
+        close_workers(index_folder)
+
+
+def test_get_tool_signatures(worker_index_folder, bare_venv, monkeypatch):
+    popen = venv_utils.subprocess.Popen
+    calls = []
+
+    def counting_popen(*args, **kwargs):
+        calls.append(args)
+        return popen(*args, **kwargs)
+
+    monkeypatch.setattr(venv_utils.subprocess, "Popen", counting_popen)
+    tool_ids = ["tools.sleep_echo", "tools.not_a_tool", "tools.count", "missing.foo"]
+    signatures, errors = venv_utils.get_tool_signatures(
+        tool_ids, worker_index_folder, venv=str(bare_venv)
+    )
+    # All tools are introspected by a single subprocess
+    assert len(calls) == 1
+    assert list(signatures) == ["tools.sleep_echo", "tools.count"]
+    assert signatures["tools.count"]["isgeneratorfunction"]
+    # Broken tools are reported individually
+    assert list(errors) == ["tools.not_a_tool", "missing.foo"]
+    assert "AttributeError" in errors["tools.not_a_tool"]
+    assert "ModuleNotFoundError" in errors["missing.foo"]
+
+
+def test_signature_schema(worker_index_folder, bare_venv):
+    signature = venv_utils.get_tool_signature(
+        "tools.sleep_echo", worker_index_folder, venv=str(bare_venv)
+    )
+    # Signatures are plain JSON that any version of stores can read
+    assert json.loads(json.dumps(signature)) == signature
+    assert signature["schema_version"] == SIGNATURE_SCHEMA_VERSION
+    assert signature["params"] == {
+        "bar": {"type": "str", "kind": "POSITIONAL_OR_KEYWORD"},
+        "delay": {"type": "float", "kind": "POSITIONAL_OR_KEYWORD", "default": 0.5},
+    }
+    assert signature["return"] == {"type": "empty"}
+    tool = venv_utils.parse_tool_signature(
+        signature, worker_index_folder, venv=str(bare_venv)
+    )
+    assert str(inspect.signature(tool)) == "(bar: str, delay: float = 0.5)"
+
+    signature["schema_version"] = SIGNATURE_SCHEMA_VERSION + 1
+    with pytest.raises(ValueError, match="Unsupported signature schema version"):
+        venv_utils.parse_tool_signature(signature, worker_index_folder)
+
+
+def test_tool_timeout():
+    manifest = {"timeout": 30, "timeouts": {"tools.slow": 86400, "tools.fast": 1}}
+    # Timeouts declared by the index never exceed the timeout of the caller
+    assert venv_utils.get_tool_timeout("tools.slow", manifest, 10) == 10
+    assert venv_utils.get_tool_timeout("tools.foo", manifest, 10) == 10
+    assert venv_utils.get_tool_timeout("tools.fast", manifest, 10) == 1
+    assert venv_utils.get_tool_timeout("tools.foo", manifest, 60) == 30
+    # Without a timeout from the caller, declared timeouts apply
+    assert venv_utils.get_tool_timeout("tools.slow", manifest) == 86400
+    assert venv_utils.get_tool_timeout("tools.foo", {}, 10) == 10
+    assert venv_utils.get_tool_timeout("tools.foo", {}) is None
+
+
+def test_pickle_codec_opt_in(tmp_path):
+    index_folder = tmp_path / "index"
+    shutil.copytree("tests/mock_index", index_folder)
+    manifest = (index_folder / "tools.toml").read_text()
+    (index_folder / "tools.toml").write_text(
+        manifest.replace("[index]\n", '[index]\ncodec = "pickle"\n')
+    )
+    # Indexes cannot make the caller unpickle their output without consent
+    with pytest.raises(ValueError, match="allow_pickle=True"):
+        venv_utils.init_venv_tools(index_folder, allow_pickle=False)
@@ -0,0 +1,307 @@
+import asyncio
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+import stores.indexes.worker_pool as worker_pool
+from stores.indexes.worker_runtime import send_message
+
+
+@pytest.fixture()
+def worker(local_index_folder):
+    worker = worker_pool.VenvWorker(sys.executable, local_index_folder)
+    yield worker
+    worker.close()
+
+
+@pytest.fixture()
+def slow_worker(worker_index_folder):
+    worker = worker_pool.VenvWorker(sys.executable, worker_index_folder)
+    yield worker
+    worker.close()
+
+
+def test_worker_reuses_process(worker):
+    assert worker.call("tools.foo", kwargs={"bar": "hello"}) == "hello"
+    pid = worker.pid
+    assert pid is not None
+    assert worker.call("tools.async_foo", args=["world"]) == "world"
+    assert worker.call("hello.world", kwargs={"bar": "hello"}) == "hello"
+    assert worker.pid == pid
+
+
+def test_worker_collects_stream(worker):
+    assert worker.call("tools.stream_input", kwargs={"bar": "a"}) == ["a"] * 3
+    assert worker.call("tools.astream_input", kwargs={"bar": "b"}) == ["b"] * 3
+
+
+async def test_worker_astream(worker):
+    values = [v async for v in worker.astream("tools.stream_input", ["a"])]
+    assert values == ["a"] * 3
+    values = [v async for v in worker.astream("tools.foo", ["b"])]
+    assert values == ["b"]
+
+
+def test_worker_tool_error(worker):
+    with pytest.raises(RuntimeError, match="Subprocess failed with error"):
+        worker.call("tools.not_a_tool")
+    # Worker should still be usable after a tool error
+    assert worker.call("tools.foo", ["hello"]) == "hello"
+
+
+def test_worker_ping_and_close(worker):
+    assert not worker.ping()
+    worker.call("tools.foo", ["hello"])
+    assert worker.ping()
+    worker.close()
+    assert not worker.is_alive()
+    assert not worker.ping()
+
+
+def test_worker_idle_timeout(local_index_folder):
+    worker = worker_pool.VenvWorker(
+        sys.executable, local_index_folder, idle_timeout=0.1
+    )
+    try:
+        worker.call("tools.foo", ["hello"])
+        pid = worker.pid
+        time.sleep(0.2)
+        assert worker.call("tools.foo", ["hello"]) == "hello"
+        assert worker.pid != pid
+    finally:
+        worker.close()
+
+
+def test_get_worker_and_close_workers(local_index_folder):
+    worker = worker_pool.get_worker(sys.executable, local_index_folder)
+    assert worker_pool.get_worker(sys.executable, local_index_folder) is worker
+    assert (
+        worker_pool.get_worker(sys.executable, local_index_folder, {"FOO": "bar"})
+        is not worker
+    )
+    worker.call("tools.foo", ["hello"])
+    worker_pool.close_workers(local_index_folder)
+    assert not worker.is_alive()
+    assert worker_pool.get_worker(sys.executable, local_index_folder) is not worker
+    worker_pool.close_workers()
+
+
+def test_worker_concurrent_calls(slow_worker):
+    slow_worker.call("tools.sleep_echo", ["warmup", 0])
+    pid = slow_worker.pid
+    results = {}
+
+    def call(i):
+        tool_id = "tools.sleep_echo" if i % 2 else "tools.async_sleep_echo"
+        results[i] = slow_worker.call(tool_id, [str(i), 0.5])
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(6)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Calls share one worker and overlap instead of running back to back
+    assert time.monotonic() - start < 2
+    assert results == {i: str(i) for i in range(6)}
+    assert slow_worker.pid == pid
+
+
+async def test_worker_interleaved_streams(slow_worker):
+    async def collect(tool_id):
+        return [v async for v in slow_worker.astream(tool_id, [5, 0.05])]
+
+    results = await asyncio.gather(
+        collect("tools.count"),
+        collect("tools.async_count"),
+        collect("tools.count"),
+    )
+    assert results == [list(range(5))] * 3
+
+
+async def test_worker_abandoned_stream(slow_worker):
+    for tool_id in ["tools.count", "tools.async_count"]:
+        stream = slow_worker.astream(tool_id, [-1, 0.01])
+        assert await stream.__anext__() == 0
+        assert await stream.__anext__() == 1
+        await stream.aclose()
+    # Worker is kept and keeps serving other calls
+    pid = slow_worker.pid
+    assert slow_worker.call("tools.sleep_echo", ["a", 0]) == "a"
+    assert slow_worker.ping()
+    assert slow_worker.pid == pid
+
+
+async def test_worker_acall(slow_worker):
+    assert await slow_worker.acall("tools.sleep_echo", ["warmup", 0]) == "warmup"
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticker = asyncio.create_task(tick())
+    start = time.monotonic()
+    results = await asyncio.gather(
+        *[
+            slow_worker.acall(tool_id, [str(i), 0.5])
+            for i, tool_id in enumerate(
+                ["tools.sleep_echo", "tools.async_sleep_echo"] * 3
+            )
+        ]
+    )
+    ticker.cancel()
+    # Calls overlap and the event loop keeps running while they are awaited
+    assert time.monotonic() - start < 2
+    assert results == [str(i) for i in range(6)]
+    assert ticks > 10
+
+
+async def test_worker_acall_cancelled(slow_worker):
+    task = asyncio.create_task(slow_worker.acall("tools.async_sleep_echo", ["a", 10]))
+    await asyncio.sleep(0.5)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert await slow_worker.acall("tools.sleep_echo", ["b", 0]) == "b"
+
+
+def test_worker_stream(slow_worker):
+    assert list(slow_worker.stream("tools.count", [5])) == list(range(5))
+    assert list(slow_worker.stream("tools.async_count", [5], window=1)) == list(
+        range(5)
+    )
+    assert list(slow_worker.stream("tools.sleep_echo", ["a", 0])) == ["a"]
+    with pytest.raises(ValueError, match="Stream window"):
+        next(slow_worker.stream("tools.count", [5], window=0))
+
+
+@pytest.mark.parametrize("tool_id", ["tools.count", "tools.async_count"])
+def test_worker_stream_backpressure(slow_worker, tool_id):
+    window = 4
+    stream = slow_worker.stream(tool_id, [-1, 0], window=window)
+    for i in range(10):
+        assert next(stream) == i
+        time.sleep(0.05)
+        # The worker waits for the consumer instead of running ahead
+        (pending,) = slow_worker._process.pending.values()
+        assert pending.queue.qsize() <= window
+    stream.close()
+    assert not slow_worker._process.pending
+    assert slow_worker.call("tools.sleep_echo", ["a", 0]) == "a"
+
+
+async def test_worker_astream_backpressure(slow_worker):
+    window = 4
+    stream = slow_worker.astream("tools.async_count", [-1, 0], window=window)
+    for i in range(10):
+        assert await stream.__anext__() == i
+        await asyncio.sleep(0.05)
+        (pending,) = slow_worker._process.pending.values()
+        assert pending.queue.qsize() <= window
+    await stream.aclose()
+    assert await slow_worker.acall("tools.sleep_echo", ["a", 0]) == "a"
+
+
+def test_worker_call_timeout_retires_hung_process(slow_worker, monkeypatch):
+    monkeypatch.setattr(worker_pool, "CANCEL_GRACE_PERIOD", 0.2)
+    slow_worker.call("tools.sleep_echo", ["warmup", 0])
+    process = slow_worker._process
+    with pytest.raises(TimeoutError, match="timed out after 0.2s"):
+        slow_worker.call("tools.sleep_echo", ["a", 10], timeout=0.2)
+    # The sync tool ignores the cancel so its process is retired and killed
+    time.sleep(1)
+    assert process.retired
+    assert process.proc.poll() is not None
+    assert slow_worker.call("tools.sleep_echo", ["b", 0]) == "b"
+    assert slow_worker._process is not process
+
+
+async def test_worker_acall_timeout_keeps_process(slow_worker, monkeypatch):
+    monkeypatch.setattr(worker_pool, "CANCEL_GRACE_PERIOD", 0.2)
+    await slow_worker.acall("tools.sleep_echo", ["warmup", 0])
+    pid = slow_worker.pid
+    with pytest.raises(TimeoutError):
+        await slow_worker.acall("tools.async_sleep_echo", ["a", 10], timeout=0.2)
+    # The async tool is cancelled within the grace period
+    await asyncio.sleep(0.5)
+    assert await slow_worker.acall("tools.sleep_echo", ["b", 0]) == "b"
+    assert slow_worker.pid == pid
+
+
+def test_worker_stream_timeout(slow_worker):
+    stream = slow_worker.stream("tools.count", [5, 2], timeout=0.2)
+    with pytest.raises(TimeoutError):
+        list(stream)
+
+
+def test_worker_tool_exit_reports_error(tmp_path):
+    (tmp_path / "tools.py").write_text("raise SystemExit('broken index')\n")
+    worker = worker_pool.VenvWorker(sys.executable, tmp_path)
+    try:
+        with pytest.raises(RuntimeError, match="broken index"):
+            worker.call("tools.foo", timeout=5)
+    finally:
+        worker.close()
+
+
+def test_worker_startup_failure_reports_stderr(tmp_path):
+    python = tmp_path / "python"
+    python.write_text("#!/bin/sh\necho 'no interpreter here' >&2\nexit 3\n")
+    python.chmod(0o755)
+    worker = worker_pool.VenvWorker(str(python), tmp_path)
+    start = time.monotonic()
+    with pytest.raises(RuntimeError, match="no interpreter here") as e:
+        worker.call("tools.foo")
+    # The exit is noticed without waiting for the startup timeout
+    assert time.monotonic() - start < 5
+    assert "3" in str(e.value)
+    worker.close()
+
+
+def test_fork_server(worker_index_folder):
+    server = worker_pool.get_fork_server(
+        sys.executable, worker_index_folder, preload=["tools"]
+    )
+    try:
+        assert worker_pool.get_fork_server(sys.executable, worker_index_folder) is (
+            server
+        )
+        a, b = socket.socketpair()
+        stderr = worker_pool.StderrTail()
+        child = server.fork("tools.exit_now", b.fileno(), stderr.write_fd)
+        b.close()
+        stderr.start()
+        send_message(a, {"args": [5]})
+        assert child.wait(timeout=5) == 5
+        assert child.pid != server.pid
+        a.close()
+    finally:
+        worker_pool.close_workers(worker_index_folder)
+    assert not server.is_alive()
+    assert worker_pool.get_fork_server(sys.executable, worker_index_folder) is not (
+        server
+    )
+    worker_pool.close_workers()
+
+
+def test_fork_server_exit_kills_children(worker_index_folder):
+    server = worker_pool.ForkServer(sys.executable, worker_index_folder)
+    a, b = socket.socketpair()
+    stderr = worker_pool.StderrTail()
+    child = server.fork("tools.sleep_echo", b.fileno(), stderr.write_fd)
+    b.close()
+    stderr.start()
+    send_message(a, {"args": ["a", 30]})
+    server.proc.kill()
+    # Children of a server that died are killed instead of left running
+    assert child.wait(timeout=5) is not None
+    with pytest.raises(RuntimeError, match="closed"):
+        server.fork("tools.sleep_echo", a.fileno(), stderr.read_fd)
+    a.close()
+    server.close()
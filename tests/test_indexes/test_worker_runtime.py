@@ -0,0 +1,255 @@
+import asyncio
+import os
+import pickle
+import socket
+import sys
+import threading
+
+import pytest
+
+from stores.indexes import venv_utils
+from stores.indexes.worker_pool import VenvWorker
+from stores.indexes.worker_runtime import (
+    HEADER,
+    READ_SIZE,
+    SHARED_MEMORY_DIR,
+    SHARED_MEMORY_PREFIX,
+    MessageDecodeError,
+    MessageReader,
+    read_shared,
+    send_message,
+    write_shared,
+)
+
+
+@pytest.fixture(params=["json", "pickle"])
+def codec(request):
+    yield request.param
+
+
+@pytest.fixture()
+def sockets():
+    a, b = socket.socketpair()
+    yield a, b
+    a.close()
+    b.close()
+
+
+def test_message_reader_many_messages(sockets, codec):
+    a, b = sockets
+    messages = [{"id": i, "value": "x" * (i * 997 % 5000)} for i in range(500)]
+
+    def send():
+        for msg in messages:
+            send_message(a, msg, codec)
+        a.shutdown(socket.SHUT_WR)
+
+    thread = threading.Thread(target=send)
+    thread.start()
+    reader = MessageReader(b, codec)
+    received = []
+    while (msg := reader.read()) is not None:
+        received.append(msg)
+    thread.join()
+    assert received == messages
+
+
+def test_message_reader_large_message(sockets, codec):
+    a, b = sockets
+    msg = {"result": "x" * (20 * READ_SIZE + 1)}
+    thread = threading.Thread(target=send_message, args=(a, msg, codec))
+    thread.start()
+    reader = MessageReader(b, codec)
+    assert reader.read() == msg
+    thread.join()
+    # Buffer shrinks back once the large message has been consumed
+    assert len(reader.buffer) == READ_SIZE
+    send_message(a, {"done": True}, codec)
+    assert reader.read() == {"done": True}
+
+
+def test_message_reader_out_of_band_buffers(sockets):
+    a, b = sockets
+    data = bytearray(b"x" * (4 * READ_SIZE))
+    msg = {"result": pickle.PickleBuffer(data), "small": b"y"}
+    thread = threading.Thread(target=send_message, args=(a, msg, "pickle"))
+    thread.start()
+    received = MessageReader(b, "pickle").read()
+    thread.join()
+    assert received == {"result": data, "small": b"y"}
+
+
+def test_message_reader_timeout_resumes(sockets):
+    a, b = sockets
+    reader = MessageReader(b)
+    body = b'{"ok": true}'
+    frame = HEADER.pack(len(body), 0, 0) + body
+    a.sendall(frame[:5])
+    with pytest.raises(socket.timeout):
+        reader.read(timeout=0.1)
+    a.sendall(frame[5:])
+    assert reader.read(timeout=1) == {"ok": True}
+
+
+async def test_message_reader_aread(sockets, codec):
+    a, b = sockets
+    b.setblocking(False)
+    loop = asyncio.get_running_loop()
+    reader = MessageReader(b, codec)
+    msg = {"result": "x" * (3 * READ_SIZE)}
+    thread = threading.Thread(target=send_message, args=(a, msg, codec))
+    thread.start()
+    assert await reader.aread(loop) == msg
+    thread.join()
+    a.close()
+    assert await reader.aread(loop) is None
+
+
+def test_message_reader_invalid_codec(sockets):
+    with pytest.raises(ValueError, match="Unsupported codec"):
+        MessageReader(sockets[0], "carrier-pigeon")
+
+
+def test_worker_codec(local_index_folder, codec):
+    worker = VenvWorker(sys.executable, local_index_folder, codec=codec)
+    try:
+        result = worker.call("tools.foo", [("a", 1)])
+        # Pickle preserves types that JSON cannot represent
+        assert result == (("a", 1) if codec == "pickle" else ["a", 1])
+    finally:
+        worker.close()
+
+
+def shared_files():
+    prefix = f"{SHARED_MEMORY_PREFIX}{os.getpid()}-"
+    return [f for f in os.listdir(SHARED_MEMORY_DIR) if f.startswith(prefix)]
+
+
+def test_message_reader_shared_memory(sockets, codec):
+    a, b = sockets
+    msg = {"result": "x" * (4 * READ_SIZE)}
+    send_message(a, msg, codec, shared_memory_threshold=READ_SIZE)
+    assert len(shared_files()) == 1
+    # Only the path of the shared file went through the socket
+    send_message(a, {"done": True}, codec, shared_memory_threshold=READ_SIZE)
+    reader = MessageReader(b, codec)
+    assert reader.read() == msg
+    assert reader.read() == {"done": True}
+    assert shared_files() == []
+
+
+def test_message_reader_shared_memory_buffers(sockets):
+    a, b = sockets
+    data = bytearray(b"x" * (4 * READ_SIZE))
+    msg = {"result": pickle.PickleBuffer(data), "small": b"y"}
+    send_message(a, msg, "pickle", shared_memory_threshold=0)
+    received = MessageReader(b, "pickle").read()
+    assert received == {"result": data, "small": b"y"}
+    # Buffers are views of the mapped file and remain writable
+    received["result"][0] = ord("z")
+    assert shared_files() == []
+
+
+def test_write_shared_failure():
+    # Partly written files are removed, e.g. when shared memory is full
+    with pytest.raises(TypeError):
+        write_shared([b"x" * READ_SIZE, object()])
+    assert shared_files() == []
+
+
+def test_shared_memory_fallback(sockets, codec, monkeypatch, tmp_path):
+    # Messages that cannot be written to shared memory are sent inline
+    monkeypatch.setattr(
+        "stores.indexes.worker_runtime.SHARED_MEMORY_DIR", str(tmp_path / "missing")
+    )
+    a, b = sockets
+    msg = {"result": "x" * (4 * READ_SIZE)}
+    shared_paths = []
+    sender = threading.Thread(
+        target=send_message, args=(a, msg, codec, 0, shared_paths)
+    )
+    sender.start()
+    assert MessageReader(b, codec).read() == msg
+    sender.join()
+    assert shared_paths == []
+
+
+def test_read_shared_outside_dir(tmp_path):
+    path = tmp_path / f"{SHARED_MEMORY_PREFIX}{os.getpid()}-other"
+    path.write_bytes(b"")
+    with pytest.raises(ValueError, match="Invalid shared memory path"):
+        read_shared(str(path), 0)
+    assert path.exists()
+
+
+@pytest.mark.parametrize("executor", ["subprocess", "forkserver"])
+def test_shared_params_removed_on_failure(local_index_folder, bare_venv, executor):
+    # The child fails before the tool runs, but has read its params
+    with pytest.raises(RuntimeError, match="No module named 'missing'"):
+        venv_utils.run_remote_tool(
+            "missing.foo",
+            index_folder=local_index_folder,
+            venv=str(bare_venv),
+            executor=executor,
+            args=["x" * (4 * READ_SIZE)],
+            shared_memory_threshold=0,
+        )
+    assert shared_files() == []
+
+
+@pytest.fixture()
+def pickle_index_folder(tmp_path):
+    # Tools returning instances of a class the parent cannot import
+    index_folder = tmp_path / "pickle_index"
+    index_folder.mkdir()
+    (index_folder / "venv_only.py").write_text(
+        "class Thing:\n    pass\n\n\ndef make():\n    return Thing()\n\n\n"
+        "def echo(bar):\n    return bar\n"
+    )
+    (index_folder / "tools.toml").write_text(
+        '[index]\ncodec = "pickle"\ntools = ["venv_only.make", "venv_only.echo"]\n'
+    )
+    return index_folder
+
+
+def test_message_reader_decode_error(sockets, pickle_index_folder, monkeypatch):
+    a, b = sockets
+    monkeypatch.syspath_prepend(str(pickle_index_folder))
+    import venv_only
+
+    send_message(a, {"id": 3, "ok": True, "result": venv_only.make()}, "pickle")
+    send_message(a, {"id": 4, "done": True}, "pickle")
+    monkeypatch.undo()
+    del sys.modules["venv_only"]
+    reader = MessageReader(b, "pickle")
+    with pytest.raises(MessageDecodeError, match="venv_only") as e:
+        reader.read()
+    # The id is recovered and the next message can still be read
+    assert e.value.message_id == 3
+    assert reader.read() == {"id": 4, "done": True}
+
+
+def test_worker_decode_error(pickle_index_folder):
+    worker = VenvWorker(sys.executable, pickle_index_folder, codec="pickle")
+    try:
+        with pytest.raises(RuntimeError, match="Unable to unpickle"):
+            worker.call("venv_only.make")
+        # Only the call with the undecodable result fails
+        pid = worker._process.pid
+        assert worker.call("venv_only.echo", [("a", 1)]) == ("a", 1)
+        assert worker._process.pid == pid
+    finally:
+        worker.close()
+
+
+def test_worker_shared_memory(local_index_folder, codec):
+    worker = VenvWorker(
+        sys.executable, local_index_folder, codec=codec, shared_memory_threshold=0
+    )
+    try:
+        bar = "x" * (4 * READ_SIZE)
+        assert worker.call("tools.foo", [bar]) == bar
+        assert worker.call("tools.stream_input", ["a"]) == ["a"] * 3
+    finally:
+        worker.close()
+    assert shared_files() == []